@@ -10,7 +10,7 @@ setup(
     long_description = long_description,
     long_description_content_type = 'text/markdown',
     url = '',
-    extras_require = dict(tests=['pytest']),
+    extras_require = dict(tests=['pytest'], zstd=['zstandard'], stream=['ijson']),
     packages = find_packages(where='src'),
     package_dir = {'': 'src'},
     entry_points = {
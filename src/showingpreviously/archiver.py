@@ -1,7 +1,18 @@
-import pytz
+import os
+import time
+from typing import Optional
 
-from showingpreviously.db import add_chain, add_cinema, add_screen, add_film, add_showing
-from showingpreviously.model import Showing, ChainArchiver
+import showingpreviously.film_resolution as film_resolution
+import showingpreviously.journal as journal
+import showingpreviously.listings as listings
+import showingpreviously.metrics as metrics
+import showingpreviously.pipeline as pipeline
+import showingpreviously.profiling as profiling
+import showingpreviously.response_archive as response_archive
+from showingpreviously.cassette import use_cassette, RECORD
+from showingpreviously.db import add_chain, add_cinema, add_screen, add_film, add_showing, record_chain_run
+from showingpreviously.consts import UNKNOWN_FILM_YEAR
+from showingpreviously.model import Showing, ChainArchiver, get_utc_time
 from showingpreviously.selenium import close_selenium_webdriver
 
 # import cinemas here, and add them to the all_cinema_chains list
@@ -31,7 +42,7 @@ all_cinema_chains = [
 ]
 
 
-def process_showing(showing: Showing, dry_run: bool = False):
+def process_showing(showing: Showing, dry_run: bool = False) -> Optional[bool]:
     film = showing.film
     time = showing.time
     chain = showing.chain
@@ -39,31 +50,78 @@ def process_showing(showing: Showing, dry_run: bool = False):
     screen = showing.screen
     json_attributes = showing.json_attributes
 
-    timezone = pytz.timezone(cinema.timezone)
-    utc_time = timezone.localize(time).astimezone(pytz.timezone('UTC'))
+    utc_time = get_utc_time(time, cinema.timezone)
 
+    if not dry_run and journal.is_enabled():
+        # the showing is written to the DB by the journal's compactor, so whether it is new isn't known yet
+        journal.append(showing, utc_time)
+        return None
     if not dry_run:
         add_chain(chain.name)
         add_cinema(chain.name, cinema.name, cinema.timezone)
         add_screen(chain.name, cinema.name, screen.name)
         add_film(film.name, film.year)
-        add_showing(film.name, film.year, chain.name, cinema.name, screen.name, utc_time, json_attributes)
+        if film.year == UNKNOWN_FILM_YEAR:
+            film_resolution.resolve_on_ingest(film.name, utc_time.year)
+        else:
+            film_resolution.index_film(film.name, film.year)
+        return add_showing(film.name, film.year, chain.name, cinema.name, screen.name, utc_time, json_attributes)
+    return None
 
 
-def run_chain(chain: ChainArchiver, dry_run: bool = False):
-    showings = chain.get_showings()
-    for showing in showings:
-        process_showing(showing, dry_run)
+def get_cassette_path(cassette_dir: str, chain: ChainArchiver) -> str:
+    return os.path.join(cassette_dir, f'{type(chain).__name__}.jsonl.gz')
 
 
-def run_all(dry_run: bool = False) -> None:
+def get_showings(chain: ChainArchiver, record_dir: Optional[str] = None) -> [Showing]:
+    with response_archive.archive_run(type(chain).__name__):
+        if record_dir is not None:
+            with use_cassette(get_cassette_path(record_dir, chain), RECORD):
+                return chain.get_showings()
+        return chain.get_showings()
+
+
+def run_chain(chain: ChainArchiver, dry_run: bool = False, record_dir: Optional[str] = None):
+    chain_name = type(chain).__name__
+    # listing hashes left over from a run that failed before its showings were written must not be stored
+    for pending_chain_name in listings.listing_hashes.get_pending_chains():
+        listings.listing_hashes.discard(pending_chain_name)
+    with profiling.profile_phase(chain_name, 'get_showings'), metrics.time_chain(chain_name):
+        showings = get_showings(chain, record_dir)
+    inserted = replaced = 0
+    started = time.perf_counter()
+    with profiling.profile_phase(chain_name, 'db_write'):
+        for showing in showings:
+            result = process_showing(showing, dry_run)
+            if result is True:
+                inserted += 1
+            elif result is False:
+                replaced += 1
+    # the listing hashes are only stored once the showings parsed from the listings are durable
+    journal.seal()
+    metrics.record_db_write(chain_name, time.perf_counter() - started, inserted, replaced)
+    listed_chain_names = listings.listing_hashes.get_pending_chains()
+    for listed_chain_name in listed_chain_names:
+        if dry_run:
+            listings.listing_hashes.discard(listed_chain_name)
+        else:
+            listings.listing_hashes.commit(listed_chain_name)
+    if not dry_run:
+        # a chain whose listings were all unchanged has no showings, but still ran successfully
+        for archived_chain_name in set([showing.chain.name for showing in showings] + listed_chain_names):
+            record_chain_run(archived_chain_name)
+
+
+def run_all(dry_run: bool = False, record_dir: Optional[str] = None) -> None:
     for cinema_chain in all_cinema_chains:
-        run_chain(cinema_chain, dry_run)
+        run_chain(cinema_chain, dry_run, record_dir)
     close_selenium_webdriver()
+    pipeline.close_parse_pool()
 
 
-def run_single(name: str, dry_run: bool = False) -> None:
+def run_single(name: str, dry_run: bool = False, record_dir: Optional[str] = None) -> None:
     for cinema_chain in all_cinema_chains:
         if type(cinema_chain).__name__ == name:
-            run_chain(cinema_chain, dry_run)
+            run_chain(cinema_chain, dry_run, record_dir)
     close_selenium_webdriver()
+    pipeline.close_parse_pool()
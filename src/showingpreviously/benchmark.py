@@ -0,0 +1,271 @@
+import io
+import json
+import os
+import time
+import tracemalloc
+from functools import partial
+from typing import Callable, Optional
+
+import showingpreviously.requests as requests
+import showingpreviously.streaming as streaming
+import showingpreviously.synthetic as synthetic
+from showingpreviously.archiver import get_cassette_path
+from showingpreviously.cassette import use_cassette, REPLAY
+from showingpreviously.consts import DATA_DIR, PARSE_BASELINE_NAME, PARSE_REGRESSION_THRESHOLD, UK_TIMEZONE
+from showingpreviously.model import ChainArchiver, Cinema, from_row
+from showingpreviously.cinemas import cineworld, empire, isle_of_bute_discovery_centre_cinema, lpvs, omniplex, picturehouse, vista_system, vue
+
+
+class ChainBenchmark:
+    def __init__(self, chain_name: str, showings: int, wall_time: float, cpu_time: float, request_count: int, peak_memory: int) -> None:
+        self.chain_name = chain_name
+        self.showings = showings
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.request_count = request_count
+        self.peak_memory = peak_memory
+
+    def __repr__(self) -> str:
+        return f'{self.chain_name}: {self.showings} showings, {self.wall_time:.3f}s wall, {self.cpu_time:.3f}s CPU, ' \
+               f'{self.request_count} requests, {self.peak_memory / 1024 / 1024:.1f}MiB peak'
+
+
+def replay_chain(chain: ChainArchiver, cassette_path: str, latency: float) -> (int, float, float, int):
+    requests.reset_stats()
+    with use_cassette(cassette_path, REPLAY, latency):
+        wall_started = time.perf_counter()
+        cpu_started = time.process_time()
+        showings = chain.get_showings()
+        cpu_time = time.process_time() - cpu_started
+        wall_time = time.perf_counter() - wall_started
+    return len(showings), wall_time, cpu_time, requests.request_stats.get_count('requests')
+
+
+def benchmark_chain(chain: ChainArchiver, cassette_dir: str, latency: float = 0, measure_memory: bool = True) -> ChainBenchmark:
+    cassette_path = get_cassette_path(cassette_dir, chain)
+    showings, wall_time, cpu_time, request_count = replay_chain(chain, cassette_path, latency)
+    peak_memory = 0
+    if measure_memory:
+        # tracemalloc slows everything down, so memory is measured on a second replay which isn't timed
+        tracemalloc.start()
+        try:
+            replay_chain(chain, cassette_path, latency)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return ChainBenchmark(type(chain).__name__, showings, wall_time, cpu_time, request_count, peak_memory)
+
+
+def benchmark_chains(chains: [ChainArchiver], cassette_dir: str, latency: float = 0, measure_memory: bool = True) -> [ChainBenchmark]:
+    results = []
+    for chain in chains:
+        if not os.path.exists(get_cassette_path(cassette_dir, chain)):
+            continue
+        results.append(benchmark_chain(chain, cassette_dir, latency, measure_memory))
+    return results
+
+
+BENCHMARK_CINEMA = Cinema('Synthetic Cinema', UK_TIMEZONE)
+
+# each parse benchmark has a function to generate its payload at a scale, and a function which parses that payload
+PARSE_BENCHMARKS: dict[str, (Callable[[int], any], Callable[[any], any])] = {
+    'vista_system.get_showings_date': (
+        synthetic.vista_showings_data,
+        lambda showings_data: vista_system.get_showings_date(showings_data, 'Odeon'),
+    ),
+    'cineworld.parse_showings_date': (
+        synthetic.cineworld_showings_data,
+        lambda showings_data: cineworld.parse_showings_date(showings_data, BENCHMARK_CINEMA),
+    ),
+    'vue.parse_showings_date': (
+        synthetic.vue_showings_data,
+        lambda showings_data: vue.parse_showings_date(showings_data, BENCHMARK_CINEMA),
+    ),
+    # the response bodies the chains parse, decoded whole or streamed depending on their size, as in a run
+    'vista_system.get_showings_content': (
+        lambda scale: json.dumps(synthetic.vista_showings_data(scale)).encode('utf-8'),
+        lambda content: vista_system.get_showings_content(content, 'synthetic', 'Odeon'),
+    ),
+    'cineworld.parse_showing_rows': (
+        lambda scale: json.dumps(synthetic.cineworld_showings_data(scale)).encode('utf-8'),
+        lambda content: cineworld.parse_showing_rows(content, 'synthetic', BENCHMARK_CINEMA, 'synthetic'),
+    ),
+    'vue.parse_showing_rows': (
+        lambda scale: json.dumps(synthetic.vue_showings_data(scale)).encode('utf-8'),
+        lambda content: vue.parse_showing_rows(content, 'synthetic', BENCHMARK_CINEMA, 'synthetic'),
+    ),
+    'isle_of_bute_discovery_centre_cinema.parse_table_row': (
+        synthetic.isle_of_bute_rows,
+        lambda rows: [isle_of_bute_discovery_centre_cinema.parse_table_row(row) for row in rows],
+    ),
+    'cineworld.get_json_attributes': (
+        synthetic.cineworld_attribute_lists,
+        lambda attribute_lists: [cineworld.get_json_attributes(attributes) for attributes in attribute_lists],
+    ),
+    'vue.get_attributes': (
+        synthetic.vue_tag_lists,
+        lambda showings: [vue.get_attributes(showing) for showing in showings],
+    ),
+    'lpvs.get_attributes': (
+        synthetic.lpvs_collection_lists,
+        lambda collection_lists: [lpvs.get_attributes(collections) for collections in collection_lists],
+    ),
+    'omniplex.get_attributes': (
+        synthetic.omniplex_attribute_strings,
+        lambda attribute_strings: [omniplex.get_attributes(at) for at in attribute_strings],
+    ),
+    'picturehouse.get_attributes': (
+        synthetic.picturehouse_attribute_lists,
+        lambda attribute_lists: [picturehouse.get_attributes(attributes) for attributes in attribute_lists],
+    ),
+    'empire.get_json_attributes_from_images': (
+        synthetic.empire_image_lists,
+        lambda image_lists: [empire.get_json_attributes_from_images(images) for images in image_lists],
+    ),
+}
+
+
+class ParseBenchmark:
+    def __init__(self, name: str, scale: int, seconds: float, baseline: Optional[float]) -> None:
+        self.name = name
+        self.scale = scale
+        self.seconds = seconds
+        self.baseline = baseline
+
+    def get_ratio(self) -> Optional[float]:
+        if self.baseline is None or self.baseline == 0:
+            return None
+        return self.seconds / self.baseline
+
+    def is_regression(self, threshold: float = PARSE_REGRESSION_THRESHOLD) -> bool:
+        ratio = self.get_ratio()
+        return ratio is not None and ratio > threshold
+
+    def __repr__(self) -> str:
+        ratio = self.get_ratio()
+        comparison = 'no baseline' if ratio is None else f'{ratio:.2f}x baseline'
+        return f'{self.name} @ {self.scale}x: {self.seconds * 1000:.2f}ms ({comparison})'
+
+
+def get_baseline_path() -> str:
+    return os.path.join(DATA_DIR, PARSE_BASELINE_NAME)
+
+
+def load_parse_baselines(path: str) -> dict[str, dict[str, float]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_parse_baselines(path: str, results: [ParseBenchmark]) -> None:
+    baselines = load_parse_baselines(path)
+    for result in results:
+        baselines.setdefault(result.name, {})[str(result.scale)] = result.seconds
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+
+
+def time_parse(parse: Callable[[any], any], payload: any, repeat: int) -> float:
+    # the fastest run is the one least disturbed by the rest of the machine
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parse(payload)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark_parsers(scales: [int], names: Optional[list[str]] = None, repeat: int = 3, baseline_path: Optional[str] = None) -> [ParseBenchmark]:
+    baselines = load_parse_baselines(baseline_path or get_baseline_path())
+    results = []
+    for name, (generate, parse) in PARSE_BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        for scale in scales:
+            payload = generate(scale)
+            seconds = time_parse(parse, payload, repeat)
+            baseline = baselines.get(name, {}).get(str(scale))
+            results.append(ParseBenchmark(name, scale, seconds, baseline))
+    return results
+
+
+class MemoryBenchmark:
+    def __init__(self, name: str, scale: int, size: int, decoded_peak: int, streamed_peak: int, decoded_seconds: float, streamed_seconds: float) -> None:
+        self.name = name
+        self.scale = scale
+        self.size = size
+        self.decoded_peak = decoded_peak
+        self.streamed_peak = streamed_peak
+        self.decoded_seconds = decoded_seconds
+        self.streamed_seconds = streamed_seconds
+
+    def __repr__(self) -> str:
+        return f'{self.name} @ {self.scale}x ({self.size / 1024 / 1024:.1f}MiB): decoded {self.decoded_peak / 1024 / 1024:.1f}MiB peak in {self.decoded_seconds * 1000:.0f}ms, ' \
+               f'streamed {self.streamed_peak / 1024 / 1024:.1f}MiB peak in {self.streamed_seconds * 1000:.0f}ms'
+
+
+# each memory benchmark parses the same response body by decoding it whole, as the chains used to, and by streaming it from
+# the response into a spooled file and parsing that, as the chains do
+MEMORY_BENCHMARKS: dict[str, (Callable[[int], any], Callable[[bytes], any], Callable[[streaming.ResponseBody], any])] = {
+    'vista_system': (
+        synthetic.vista_showings_data,
+        lambda content: vista_system.get_showings_date(json.loads(content), 'Odeon'),
+        lambda content: vista_system.get_showings_content(content, 'synthetic', 'Odeon'),
+    ),
+    'cineworld': (
+        synthetic.cineworld_showings_data,
+        lambda content: cineworld.parse_showings_date(json.loads(content), BENCHMARK_CINEMA),
+        lambda content: [from_row(row) for row in cineworld.parse_showing_rows(content, 'synthetic', BENCHMARK_CINEMA, 'synthetic')],
+    ),
+    'vue': (
+        synthetic.vue_showings_data,
+        lambda content: vue.parse_showings_date(json.loads(content), BENCHMARK_CINEMA),
+        lambda content: [from_row(row) for row in vue.parse_showing_rows(content, 'synthetic', BENCHMARK_CINEMA, 'synthetic')],
+    ),
+}
+
+
+def measure_parse_memory(parse: Callable[[bytes], any], content: bytes) -> (int, float):
+    # the response body is already allocated, so only what parsing it adds is counted
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        parse(content)
+        seconds = time.perf_counter() - started
+        return tracemalloc.get_traced_memory()[1], seconds
+    finally:
+        tracemalloc.stop()
+
+
+def spool_and_parse(parse: Callable[[streaming.ResponseBody], any], content: bytes) -> any:
+    # the body is read from a response's raw stream, as it would be from the network
+    r = requests.Response()
+    r.status_code = 200
+    r.raw = io.BytesIO(content)
+    body = streaming.spool(r)
+    try:
+        return parse(body)
+    finally:
+        streaming.discard(body)
+
+
+def benchmark_memory(scales: [int], names: Optional[list[str]] = None) -> [MemoryBenchmark]:
+    results = []
+    for name, (generate, parse_decoded, parse_streamed) in MEMORY_BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        for scale in scales:
+            content = json.dumps(generate(scale)).encode('utf-8')
+            decoded_peak, decoded_seconds = measure_parse_memory(parse_decoded, content)
+            # every size is streamed here, to compare the two at each scale
+            min_stream_size = streaming.min_stream_size
+            streaming.set_min_stream_size(0)
+            try:
+                streamed_peak, streamed_seconds = measure_parse_memory(partial(spool_and_parse, parse_streamed), content)
+            finally:
+                streaming.set_min_stream_size(min_stream_size)
+            results.append(MemoryBenchmark(name, scale, len(content), decoded_peak, streamed_peak, decoded_seconds, streamed_seconds))
+    return results
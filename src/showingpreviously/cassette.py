@@ -0,0 +1,192 @@
+import base64
+import gzip
+import json
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Optional, Iterator, Iterable
+
+import requests
+from requests.cookies import cookiejar_from_dict
+from requests.structures import CaseInsensitiveDict
+
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+# formats that chains put dates into urls and request bodies with. dates are only matched on their own, not inside a longer
+# run of digits, and only those in the replay's window are shifted, so ids which happen to look like dates are left alone
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y']
+DATE_PATTERN = re.compile(r'(?<!\d)(?:\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4}|\d{2}-\d{2}-\d{4})(?!\d)')
+DATE_SHIFT_DAYS = range(-1, 15)
+
+
+class CassetteMissException(Exception):
+    pass
+
+
+class Cassette:
+    """A compressed recording of every request and response made during a run, that can be served back offline"""
+
+    def __init__(self, path: Optional[str], mode: str, latency: float = 0) -> None:
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.entries: dict[str, deque[dict[str, any]]] = {}
+        self.date_map: dict[str, str] = {}
+        self.recorded_on = datetime.now()
+        self.file = None
+        self.requests_served = 0
+        if mode == RECORD:
+            self.file = gzip.open(path, 'wt', encoding='utf-8')
+            self.write({'recordedOn': datetime.now().strftime('%Y-%m-%d')})
+        elif mode == REPLAY:
+            # a replay without a path is given its entries with add_entries instead
+            if path is not None:
+                self.load()
+        else:
+            raise ValueError(f'Unknown cassette mode "{mode}"')
+
+    def load(self) -> None:
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            self.add_entries(datetime.strptime(header['recordedOn'], '%Y-%m-%d'), (json.loads(line) for line in f))
+
+    def add_entries(self, recorded_on: datetime, entries: Iterable[dict[str, any]]) -> None:
+        self.date_map = get_date_map(datetime.now(), recorded_on)
+        self.recorded_on = recorded_on
+        for entry in entries:
+            self.entries.setdefault(entry['key'], deque()).append(entry)
+
+    def write(self, entry: dict[str, any]) -> None:
+        self.file.write(json.dumps(entry, separators=(',', ':')))
+        self.file.write('\n')
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def get_key(self, method: str, url: str, kwargs: dict[str, any]) -> str:
+        key = get_request_key(method, url, kwargs)
+        if self.mode == REPLAY:
+            # urls made on a later day have later dates in them, so move them back to the day of the recording
+            key = DATE_PATTERN.sub(lambda match: self.date_map.get(match.group(0), match.group(0)), key)
+        return key
+
+    def record(self, method: str, url: str, kwargs: dict[str, any], r: requests.Response) -> None:
+        entry = {**get_response_metadata(r), 'key': self.get_key(method, url, kwargs), 'content': base64.b64encode(r.content).decode('ascii')}
+        with self.lock:
+            self.write(entry)
+
+    def record_content(self, method: str, url: str, content: str) -> None:
+        entry = {'key': self.get_key(method, url, {}), 'content': base64.b64encode(content.encode('utf-8')).decode('ascii')}
+        with self.lock:
+            self.write(entry)
+
+    def has_entry(self, method: str, url: str, kwargs: dict[str, any]) -> bool:
+        key = self.get_key(method, url, kwargs)
+        with self.lock:
+            return bool(self.entries.get(key))
+
+    def get_entry(self, method: str, url: str, kwargs: dict[str, any]) -> dict[str, any]:
+        key = self.get_key(method, url, kwargs)
+        with self.lock:
+            recorded = self.entries.get(key)
+            if not recorded:
+                raise CassetteMissException(f'No recorded response for {method} {url}')
+            # responses are served in the order they were recorded, and the last one is repeated after that
+            entry = recorded.popleft() if len(recorded) > 1 else recorded[0]
+            self.requests_served += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return entry
+
+    def replay(self, method: str, url: str, kwargs: dict[str, any]) -> requests.Response:
+        entry = self.get_entry(method, url, kwargs)
+        r = requests.Response()
+        r.status_code = entry['status']
+        r.reason = entry['reason']
+        r.url = entry['url']
+        r.headers = CaseInsensitiveDict(entry['headers'])
+        r.cookies = cookiejar_from_dict(entry['cookies'])
+        r.encoding = entry['encoding']
+        r._content = get_content(entry)
+        # the body is already read, so a caller which streams it iterates over the content
+        r._content_consumed = True
+        return r
+
+    def replay_content(self, method: str, url: str) -> str:
+        entry = self.get_entry(method, url, {})
+        return get_content(entry).decode('utf-8')
+
+
+def get_request_key(method: str, url: str, kwargs: dict[str, any]) -> str:
+    body = [kwargs.get('params'), kwargs.get('data'), kwargs.get('json')]
+    return json.dumps([method.upper(), url, body], sort_keys=True, default=str)
+
+
+def get_response_metadata(r: requests.Response) -> dict[str, any]:
+    return {
+        'status': r.status_code,
+        'reason': r.reason,
+        'url': r.url,
+        'headers': dict(r.headers),
+        'cookies': r.cookies.get_dict(),
+        'encoding': r.encoding,
+    }
+
+
+def get_content(entry: dict[str, any]) -> bytes:
+    # cassette files hold content as base64 text, and entries from the response archive hold the bytes themselves
+    content = entry['content']
+    return content if isinstance(content, bytes) else base64.b64decode(content)
+
+
+def get_date_map(today: datetime, recorded_on: datetime) -> dict[str, str]:
+    date_map = {}
+    for days in DATE_SHIFT_DAYS:
+        current_date = today + timedelta(days=days)
+        recorded_date = recorded_on + timedelta(days=days)
+        for date_format in DATE_FORMATS:
+            date_map[current_date.strftime(date_format)] = recorded_date.strftime(date_format)
+    return date_map
+
+
+active: Optional[Cassette] = None
+
+
+@contextmanager
+def use_cassette(path: str, mode: str, latency: float = 0) -> Iterator[Cassette]:
+    global active
+    cassette = Cassette(path, mode, latency)
+    active = cassette
+    try:
+        yield cassette
+    finally:
+        active = None
+        cassette.close()
+
+
+@contextmanager
+def replay_entries(recorded_on: datetime, entries: Iterable[dict[str, any]]) -> Iterator[Cassette]:
+    global active
+    cassette = Cassette(None, REPLAY)
+    cassette.add_entries(recorded_on, entries)
+    active = cassette
+    try:
+        yield cassette
+    finally:
+        active = None
+
+
+def is_recording() -> bool:
+    return active is not None and active.mode == RECORD
+
+
+def is_replaying() -> bool:
+    return active is not None and active.mode == REPLAY
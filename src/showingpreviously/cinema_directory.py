@@ -0,0 +1,85 @@
+import threading
+import time
+from typing import Callable, Optional
+
+import showingpreviously.cassette as cassette
+import showingpreviously.metrics as metrics
+from showingpreviously.consts import CINEMA_DIRECTORY_TTL
+from showingpreviously.db import get_cinema_directory, set_cinema_directory, clear_cinema_directory
+from showingpreviously.model import Cinema
+
+
+class CinemaDirectory:
+    """Each chain's list of cinemas, kept in the DB for a TTL so routine runs skip discovering them"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.ttl = CINEMA_DIRECTORY_TTL
+        self.refresh = False
+        self.dry_run = False
+        self.loaded: dict[str, (float, dict[str, Cinema])] = {}
+        # a directory is only discovered once per process when refreshing, even if it is asked for once per work unit
+        self.refreshed: set[str] = set()
+
+    def get_cinemas(self, directory_name: str, discover: Callable[[], dict[str, Cinema]]) -> dict[str, Cinema]:
+        # cassettes need every request of a run, so nothing is cached while one is recording
+        if cassette.is_recording():
+            return discover()
+        if cassette.is_replaying():
+            # a run archived while the directory was cached has no discovery responses to replay
+            try:
+                return discover()
+            except cassette.CassetteMissException:
+                with self.lock:
+                    return self.get_stored(directory_name, None) or {}
+        with self.lock:
+            cinemas = self.get_stored(directory_name, self.ttl) if not self.is_refreshing(directory_name) else None
+            metrics.record_cache('cinema-directory', cinemas is not None)
+            if cinemas is not None:
+                return cinemas
+            cinemas = discover()
+            self.refreshed.add(directory_name)
+            self.loaded[directory_name] = (time.time(), cinemas)
+            if not self.dry_run:
+                set_cinema_directory(directory_name, [(cinema_key, cinema.name, cinema.timezone) for cinema_key, cinema in cinemas.items()])
+            return cinemas
+
+    def is_refreshing(self, directory_name: str) -> bool:
+        return self.refresh and directory_name not in self.refreshed
+
+    def get_stored(self, directory_name: str, ttl: Optional[float]) -> Optional[dict[str, Cinema]]:
+        if directory_name not in self.loaded:
+            utc_fetched, rows = get_cinema_directory(directory_name)
+            if utc_fetched is None:
+                return None
+            self.loaded[directory_name] = (utc_fetched, {cinema_key: Cinema(cinema_name, timezone) for cinema_key, cinema_name, timezone in rows})
+        utc_fetched, cinemas = self.loaded[directory_name]
+        if ttl is not None and time.time() - utc_fetched > ttl:
+            return None
+        return cinemas
+
+    def invalidate(self, directory_name: str) -> None:
+        # a failed run may be down to a cinema opening or closing, so the next one discovers the cinemas again
+        with self.lock:
+            self.loaded.pop(directory_name, None)
+            if not self.dry_run:
+                clear_cinema_directory(directory_name)
+
+
+cinema_directory = CinemaDirectory()
+
+
+def set_refresh(refresh: bool) -> None:
+    cinema_directory.refresh = refresh
+
+
+def set_dry_run(dry_run: bool) -> None:
+    cinema_directory.dry_run = dry_run
+
+
+def get_cinemas(directory_name: str, discover: Callable[[], dict[str, Cinema]]) -> dict[str, Cinema]:
+    return cinema_directory.get_cinemas(directory_name, discover)
+
+
+def invalidate(directory_name: str) -> None:
+    cinema_directory.invalidate(directory_name)
@@ -1,8 +1,14 @@
 import json
 
 from datetime import datetime, timedelta
+from typing import Optional, Iterable
+import showingpreviously.cinema_directory as cinema_directory
+import showingpreviously.listings as listings
+import showingpreviously.pipeline as pipeline
 import showingpreviously.requests as requests
-from showingpreviously.model import ChainArchiver, CinemaArchiverException, Chain, Cinema, Screen, Film, Showing
+import showingpreviously.streaming as streaming
+from showingpreviously.streaming import JsonDocument, ResponseBody, DECODE_ERRORS
+from showingpreviously.model import ChainArchiver, CinemaArchiverException, Chain, Cinema, Screen, Film, Showing, ShowingRow, to_row, from_row, get_cinema_unit, read_cinema_unit
 from showingpreviously.consts import STANDARD_DAYS_AHEAD, UK_TIMEZONE
 
 
@@ -25,7 +31,15 @@ def get_response(url: str) -> requests.Response:
     return r
 
 
-def get_cinemas_as_dict() -> dict[str, Cinema]:
+def get_body(url: str) -> ResponseBody:
+    r, body = requests.get_body(url, headers=HEADERS)
+    if r.status_code != 200:
+        streaming.discard(body)
+        raise CinemaArchiverException(f'Got status code {r.status_code} when fetching URL {url}')
+    return body
+
+
+def discover_cinemas() -> dict[str, Cinema]:
     end_date = datetime.now() + timedelta(days=STANDARD_DAYS_AHEAD)
     url = CINEMAS_API_URL.format(end_date=end_date.strftime('%Y-%m-%d'))
     r = get_response(url)
@@ -42,6 +56,10 @@ def get_cinemas_as_dict() -> dict[str, Cinema]:
     return cinemas
 
 
+def get_cinemas_as_dict() -> dict[str, Cinema]:
+    return cinema_directory.get_cinemas('Cineworld', discover_cinemas)
+
+
 def get_json_attributes(attributes: [str]) -> dict[str, any]:
     json_attributes = {}
     for attribute in attributes:
@@ -67,23 +85,49 @@ def get_json_attributes(attributes: [str]) -> dict[str, any]:
     return json_attributes
 
 
-def get_showings_date(cinema_id: str, cinema: Cinema, date: str) -> [Showing]:
+def fetch_showings_date(cinema_id: str, cinema: Cinema, date: str) -> Optional[ResponseBody]:
     url = SHOWINGS_API_URL.format(cinema_id=cinema_id, date=date)
-    r = get_response(url)
+    body = get_body(url)
+    if listings.is_unchanged(CHAIN.name, f'{cinema_id} {date}', body):
+        streaming.discard(body)
+        return None
+    return body
+
+
+def parse_showing_rows(content: ResponseBody, cinema_id: str, cinema: Cinema, date: str) -> [ShowingRow]:
+    # runs in the parse pool, so it returns showing rows which are cheap to send back
+    # the films are read first, so the events, which are most of the response, can be decoded one at a time
+    document = JsonDocument(content)
     try:
-        showings_data = r.json()
-    except json.JSONDecodeError:
-        raise CinemaArchiverException(f'Error decoding JSON data from URL {url}')
+        return [to_row(showing) for showing in parse_events(document.get_value('body.films'), document.iter_items('body.events'), cinema)]
+    except DECODE_ERRORS:
+        raise CinemaArchiverException(f'Error decoding JSON data from URL {SHOWINGS_API_URL.format(cinema_id=cinema_id, date=date)}')
+
+
+def get_showings_date(cinema_id: str, cinema: Cinema, date: str) -> [Showing]:
+    content = fetch_showings_date(cinema_id, cinema, date)
+    if content is None:
+        return []
+    try:
+        return [from_row(row) for row in parse_showing_rows(content, cinema_id, cinema, date)]
+    finally:
+        streaming.discard(content)
 
+
+def parse_showings_date(showings_data: dict[str, any], cinema: Cinema) -> [Showing]:
+    return parse_events(showings_data['body']['films'], showings_data['body']['events'], cinema)
+
+
+def parse_events(films_data: [dict[str, any]], events: Iterable[dict[str, any]], cinema: Cinema) -> [Showing]:
     films = {}
-    for film in showings_data['body']['films']:
+    for film in films_data:
         id = film['id']
         name = film['name']
         year = film['releaseYear']
         films[id] = Film(name, year)
 
     showings = []
-    for showing in showings_data['body']['events']:
+    for showing in events:
         film = films[showing['filmId']]
         screen_name = f'Auditorium {showing["auditorium"]}'
         screen = Screen(screen_name)
@@ -103,9 +147,13 @@ def get_showing_dates() -> str:
 
 class Cineworld(ChainArchiver):
     def get_showings(self) -> [Showing]:
-        showings = []
         cinemas = get_cinemas_as_dict()
-        for cinema_id, cinema in cinemas.items():
-            for date in get_showing_dates():
-                showings += get_showings_date(cinema_id, cinema, date)
-        return showings
+        jobs = [(cinema_id, cinema, date) for cinema_id, cinema in cinemas.items() for date in get_showing_dates()]
+        return [from_row(row) for row in pipeline.fetch_and_parse(jobs, fetch_showings_date, parse_showing_rows)]
+
+    def get_work_units(self) -> [str]:
+        return [get_cinema_unit(cinema_id, cinema, date) for cinema_id, cinema in get_cinemas_as_dict().items() for date in get_showing_dates()]
+
+    def get_unit_showings(self, unit: str) -> [Showing]:
+        cinema_id, cinema, (date,) = read_cinema_unit(unit)
+        return get_showings_date(cinema_id, cinema, date)
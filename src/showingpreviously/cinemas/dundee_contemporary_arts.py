@@ -1,13 +1,16 @@
 import json
 import re
 
-from typing import Iterator, Tuple
+from typing import Iterator, Tuple, Optional
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
 import showingpreviously.requests as requests
-from showingpreviously.model import ChainArchiver, CinemaArchiverException, Chain, Cinema, Screen, Film, Showing
-from showingpreviously.consts import STANDARD_DAYS_AHEAD, UK_TIMEZONE
+import showingpreviously.metrics as metrics
+from showingpreviously.model import ChainArchiver, CinemaArchiverException, Chain, Cinema, Screen, Film, Showing, get_utc_time
+from showingpreviously.consts import STANDARD_DAYS_AHEAD, UK_TIMEZONE, MAX_CONCURRENT_REQUESTS
+from showingpreviously.db import get_showing_screen_name
 
 
 FILM_INDEX_URL = 'https://www.dca.org.uk/whats-on/films?from={start}&to={end}'
@@ -91,7 +94,7 @@ def get_screen(showing_id: int) -> Screen:
     return Screen(screen_name)
 
 
-def get_event_showings(event_id: str) -> Iterator[Tuple[datetime, dict[str, any]]]:
+def get_event_instances(event_id: str) -> [Tuple[int, datetime, dict[str, any]]]:
     api_url = EVENT_API_URL.format(id=event_id)
     r = get_response(api_url)
     try:
@@ -100,6 +103,7 @@ def get_event_showings(event_id: str) -> Iterator[Tuple[datetime, dict[str, any]
         raise CinemaArchiverException(f'Error decoding JSON data from URL {api_url}')
     if 'instances' not in event_data:
         raise CinemaArchiverException('JSON data does not have instances key')
+    instances = []
     for instance in event_data['instances']:
         if 'ymd' not in instance or 'time' not in instance:
             raise CinemaArchiverException('Missing attribute ymd or time in JSON')
@@ -114,25 +118,49 @@ def get_event_showings(event_id: str) -> Iterator[Tuple[datetime, dict[str, any]
         except ValueError:
             raise CinemaArchiverException(f'Error parsing timestamp "{timestamp_string}" with format "{format_string}"')
 
-        screen = get_screen(instance['id'])
-
         json_attributes = {}
 
         if 'captioned' in instance and instance['captioned'] == 'Yes':
             json_attributes['captioned'] = 'english'
 
-        yield timestamp, screen, json_attributes
+        instances.append((instance['id'], timestamp, json_attributes))
+    return instances
+
+
+def get_film_instances(film_url: str) -> (Film, dict[str, any], [Tuple[int, datetime, dict[str, any]]]):
+    name, year, event_id, film_attributes = get_film_info_from_url(film_url)
+    return Film(name, year), film_attributes, get_event_instances(event_id)
+
+
+def get_archived_screen(film: Film, timestamp: datetime) -> Optional[Screen]:
+    utc_time = get_utc_time(timestamp, CINEMA.timezone)
+    screen_name = get_showing_screen_name(film.name, film.year, CHAIN.name, CINEMA.name, utc_time)
+    metrics.record_cache('archived-screen', screen_name is not None)
+    if screen_name is None:
+        return None
+    return Screen(screen_name)
 
 
 class DundeeContemporaryArts(ChainArchiver):
+    # each film's info and event requests run as one task, and the seat page lookups for its instances are queued on
+    # the same pool as soon as that film completes, so all three levels of requests overlap
     def get_showings(self) -> [Showing]:
         showings = []
+        screen_futures = []
         index_url = get_film_index_url()
-        for film_link in get_film_links_from_index(index_url):
-            name, year, event_id, film_attributes = get_film_info_from_url(film_link)
-            film = Film(name, year)
-            for timestamp, screen, showing_attributes in get_event_showings(event_id):
-                json_attributes = {**film_attributes, **showing_attributes}
-                showing = Showing(film, timestamp, CHAIN, CINEMA, screen, json_attributes)
-                showings.append(showing)
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            film_futures = [executor.submit(get_film_instances, film_link) for film_link in get_film_links_from_index(index_url)]
+            for film_future in as_completed(film_futures):
+                film, film_attributes, instances = film_future.result()
+                for instance_id, timestamp, showing_attributes in instances:
+                    json_attributes = {**film_attributes, **showing_attributes}
+                    screen = get_archived_screen(film, timestamp)
+                    if screen is not None:
+                        # we already know the screen for this instance, so skip fetching its seat page
+                        showings.append(Showing(film, timestamp, CHAIN, CINEMA, screen, json_attributes))
+                        continue
+                    screen_future = executor.submit(get_screen, instance_id)
+                    screen_futures.append((screen_future, film, timestamp, json_attributes))
+            for screen_future, film, timestamp, json_attributes in screen_futures:
+                showings.append(Showing(film, timestamp, CHAIN, CINEMA, screen_future.result(), json_attributes))
         return showings
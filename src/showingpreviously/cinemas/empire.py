@@ -2,7 +2,9 @@ from bs4 import BeautifulSoup
 import re
 
 from datetime import datetime, timedelta
+import showingpreviously.cinema_directory as cinema_directory
 import showingpreviously.requests as requests
+import showingpreviously.metrics as metrics
 from showingpreviously.model import ChainArchiver, CinemaArchiverException, Chain, Cinema, Screen, Film, Showing
 from showingpreviously.consts import STANDARD_DAYS_AHEAD, UK_TIMEZONE
 
@@ -20,7 +22,7 @@ def get_response(url: str) -> requests.Response:
     return r
 
 
-def get_cinemas() -> dict[str, Cinema]:
+def discover_cinemas() -> dict[str, Cinema]:
     r = get_response(CINEMAS_URL)
     soup = BeautifulSoup(r.text, features='html.parser')
     selector = soup.find('select', {'name': 'tbx_site_id'})
@@ -34,6 +36,10 @@ def get_cinemas() -> dict[str, Cinema]:
     return cinemas
 
 
+def get_cinemas() -> dict[str, Cinema]:
+    return cinema_directory.get_cinemas('Empire', discover_cinemas)
+
+
 def get_showing_dates() -> str:
     current_date = datetime.now()
     end_date = current_date + timedelta(days=STANDARD_DAYS_AHEAD)
@@ -79,6 +85,7 @@ film_cache = {}
 
 def get_film(url: str, title: str) -> Film:
     global film_cache
+    metrics.record_cache('film', url in film_cache)
     if url in film_cache:
         return film_cache[url]
     r = get_response(f'https://www.empirecinemas.co.uk/{url}')
@@ -5,15 +5,18 @@ import datetime
 from bs4 import BeautifulSoup
 from typing import Tuple, Optional
 
+import showingpreviously.cassette as cassette
+import showingpreviously.listings as listings
 import showingpreviously.requests as requests
 from showingpreviously.model import ChainArchiver, CinemaArchiverException, Chain, Cinema, Screen, Film, Showing
-from showingpreviously.consts import UK_TIMEZONE
+from showingpreviously.consts import UK_TIMEZONE, FEED_PAGE_SIZE, FEED_MAX_PAGES
 
 CHAIN = Chain('Isle of Bute Discovery Centre')
 CINEMA = Cinema('Isle of Bute Discovery Centre Cinema', UK_TIMEZONE)
 SCREEN = Screen('Screen 1')
 
 FEED_URL = 'http://discoverycentrecinema.blogspot.com/feeds/posts/default'
+MONTHLY_ENTRY_SUFFIX = ' Films'
 FILM_TITLE_REGEX = re.compile(r'(?P<title>.*) (?P<rating>\(..*\))')
 
 
@@ -21,32 +24,100 @@ class InvalidRowException(Exception):
     pass
 
 
-def get_response(url: str) -> requests.Response:
-    r = requests.get(url)
-    if r.status_code != 200:
+def get_response(url: str, headers: Optional[dict[str, str]] = None, params: Optional[dict[str, any]] = None) -> requests.Response:
+    r = requests.get(url, params=params, headers=headers)
+    if r.status_code not in [200, 304]:
         raise CinemaArchiverException(f'Got status code {r.status_code} when fetching URL {url}')
     return r
 
 
+def get_now() -> datetime.datetime:
+    # a replayed feed is judged as of when it was recorded, so the same pages and showings are kept as were then
+    return cassette.active.recorded_on if cassette.is_replaying() else datetime.datetime.now()
+
+
+def get_entry_month_end(title: str) -> Optional[datetime.datetime]:
+    # monthly entries are titled like 'March 2023 Films', and one titled otherwise is never treated as past
+    try:
+        month_start = datetime.datetime.strptime(title[:-len(MONTHLY_ENTRY_SUFFIX)].strip(), '%B %Y')
+    except ValueError:
+        return None
+    next_month = month_start.replace(year=month_start.year + 1, month=1) if month_start.month == 12 else month_start.replace(month=month_start.month + 1)
+    return next_month - datetime.timedelta(seconds=1)
+
+
+def get_entry_showings(monthly_entry: BeautifulSoup) -> [Showing]:
+    showings = []
+    html_contents = monthly_entry.find('content', type='html').contents
+    html_soup = BeautifulSoup(html_contents[0], features='html.parser')
+    listings_table = html_soup.find('table')
+    for i, row in enumerate(listings_table.find_all('tr')):
+        if i == 0:
+            continue  # skip the 'Film listings for <Month> row'
+        elif i == 1:
+            check_table_schema(row)
+            continue
+        else:
+            showings += parse_table_row(row)
+    return showings
+
+
+def get_first_page_params() -> (Optional[dict[str, any]], int):
+    # returns the first page's query and how many pages can be followed. runs archived before the feed was paged fetched
+    # only the bare feed, so replaying one asks for that instead of missing
+    params = {'max-results': FEED_PAGE_SIZE}
+    if cassette.is_replaying() and not cassette.active.has_entry('GET', FEED_URL, {'params': params}):
+        return None, 1
+    return params, FEED_MAX_PAGES
+
+
+def get_page_showings(feed_soup: BeautifulSoup) -> ([Showing], bool):
+    # returns the showings of the page's new or changed entries, and whether any of its entries are for this month or later
+    showings = []
+    has_upcoming = False
+    now = get_now()
+    for monthly_entry in feed_soup.find_all('entry'):
+        title = monthly_entry.find('title', {'type': 'text'}).text
+        if not title.endswith(MONTHLY_ENTRY_SUFFIX):
+            continue  # Needed to skip 'info'-style entries like COVID re-opening information
+        month_end = get_entry_month_end(title)
+        if month_end is not None and month_end < now:
+            if not listings.is_forced():
+                continue  # every showing in a past month's table has already happened
+        else:
+            has_upcoming = True
+        # an entry's updated time changes whenever it is edited, so one that hasn't changed doesn't need parsing again
+        entry_id = monthly_entry.find('id').text
+        if listings.is_unchanged(CHAIN.name, entry_id, monthly_entry.find('updated').text.encode('utf-8')):
+            continue
+        showings += get_entry_showings(monthly_entry)
+    return showings, has_upcoming
+
+
+def get_next_page_url(feed_soup: BeautifulSoup) -> Optional[str]:
+    next_link = feed_soup.find('link', {'rel': 'next'})
+    return next_link['href'] if next_link is not None else None
+
+
 class IsleOfButeDiscoveryCentreCinema(ChainArchiver):
     def get_showings(self) -> [Showing]:
         showings = []
-        feed_contents = get_response(FEED_URL).text
-        feed_soup = BeautifulSoup(feed_contents, features='xml')
-        for monthly_entry in feed_soup.find_all('entry'):
-            if not monthly_entry.find('title', {'type': 'text'}).text.endswith(' Films'):
-                continue  # Needed to skip 'info'-style entries like COVID re-opening information
-            html_contents = monthly_entry.find('content', type='html').contents
-            html_soup = BeautifulSoup(html_contents[0], features='html.parser')
-            listings_table = html_soup.find('table')
-            for i, row in enumerate(listings_table.find_all('tr')):
-                if i == 0:
-                    continue  # skip the 'Film listings for <Month> row'
-                elif i == 1:
-                    check_table_schema(row)
-                    continue
-                else:
-                    showings += parse_table_row(row)
+        # the feed's validators change whenever any entry does, so a 304 means there is nothing new on any page
+        params, max_pages = get_first_page_params()
+        r = get_response(FEED_URL, listings.get_conditional_headers(CHAIN.name, FEED_URL), params)
+        if listings.is_not_modified(CHAIN.name, FEED_URL, r):
+            return showings
+        if listings.is_unchanged(CHAIN.name, FEED_URL, r.content):
+            return showings
+        feed_soup = BeautifulSoup(r.text, features='xml')
+        # entries are newest first, so the pages are followed only until one has nothing for this month or later
+        for _ in range(max_pages):
+            page_showings, has_upcoming = get_page_showings(feed_soup)
+            showings += page_showings
+            next_page_url = get_next_page_url(feed_soup)
+            if not has_upcoming or next_page_url is None:
+                break
+            feed_soup = BeautifulSoup(get_response(next_page_url).text, features='xml')
         return showings
 
 
@@ -78,7 +149,7 @@ def extract_showing(row_datas: [str], showing_number: int) -> Optional[Showing]:
     showing_film = FILM_TITLE_REGEX.search(film_name).group('title')
     showing_time = datetime.datetime.strptime(showing_time, '%I.%M%p')
     showing_timestamp = row_date + datetime.timedelta(hours=showing_time.hour, minutes=showing_time.minute)
-    if datetime.datetime.now() > showing_timestamp:
+    if get_now() > showing_timestamp:
         return None
     film = Film(name=showing_film, year='')
     showing = Showing(film, showing_timestamp, CHAIN, CINEMA, SCREEN, {})
@@ -1,12 +1,14 @@
 import re
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Optional
 from bs4 import BeautifulSoup
 
+import showingpreviously.cinema_directory as cinema_directory
 import showingpreviously.requests as requests
 from showingpreviously.model import ChainArchiver, CinemaArchiverException, Chain, Cinema, Screen, Film, Showing
-from showingpreviously.consts import STANDARD_DAYS_AHEAD, UK_TIMEZONE, UNKNOWN_FILM_YEAR
+from showingpreviously.consts import STANDARD_DAYS_AHEAD, UK_TIMEZONE, UNKNOWN_FILM_YEAR, MAX_CONCURRENT_REQUESTS, MAX_CONCURRENT_CINEMAS
 
 
 SHOWINGS_URL = '{cinema_url}/resource/services/miniguide/data.ashx'
@@ -17,23 +19,20 @@ SHOWINGS_JSON_PATTERN = re.compile(r'var\s+__gfminiguidedata\s*=\s*(?P<showings_
 SCREEN_PATTERN = re.compile(r'cinema-screen-name">.+?-\s*(?P<screen_name>.+?)<')
 
 
-def get_response(url: str) -> requests.Response:
-    r = requests.get(url)
+def get_response(url: str, session: Optional[requests.Session] = None) -> requests.Response:
+    r = session.get(url) if session is not None else requests.get(url)
     if r.status_code != 200:
         raise CinemaArchiverException(f'Got status code {r.status_code} when fetching URL {url}')
     return r
 
 
-def get_token(cinema_url: str) -> str:
-    r = requests.get(cinema_url)
-    token = TOKEN_PATTERN.search(r.text).group('token')
-    return token
-
-
-def get_lpvs(cinema_url: str) -> str:
-    r = requests.get(cinema_url)
+def get_token_and_lpvs(session: requests.Session, cinema_url: str) -> (Optional[str], Optional[str]):
+    # The Light sites embed a booking token in the page, Parkway sites set an lpvs cookie. one request gets both
+    r = session.get(cinema_url)
+    match = TOKEN_PATTERN.search(r.text)
+    token = match.group('token') if match else None
     lpvs = r.cookies.get('lpvs')
-    return lpvs
+    return token, lpvs
 
 
 def get_attributes(collections: [dict[str, any]]) -> dict[str, any]:
@@ -50,10 +49,10 @@ def get_attributes(collections: [dict[str, any]]) -> dict[str, any]:
     return attributes
 
 
-def get_screen_thelight(cinema_url: str, showing_id: str, token: str) -> Screen:
+def get_screen_thelight(session: requests.Session, cinema_url: str, showing_id: str, token: str) -> Screen:
     url = SCREEN_API_URL.format(cinema_url=cinema_url)
     data = {'SessionId': showing_id, 'Token': token}
-    r = requests.post(url, data=json.dumps(data))
+    r = session.post(url, data=json.dumps(data))
     try:
         booking_data = r.json()
     except json.JSONDecodeError:
@@ -62,41 +61,26 @@ def get_screen_thelight(cinema_url: str, showing_id: str, token: str) -> Screen:
     return Screen(screen_name)
 
 
-def get_screen_lightcinemas(booking_url: str, lpvs: str):
-    r = requests.get(booking_url, cookies={'lpvs': lpvs})
+def get_screen_lightcinemas(session: requests.Session, booking_url: str, lpvs: str):
+    r = session.get(booking_url, cookies={'lpvs': lpvs})
     screen_name = SCREEN_PATTERN.search(r.text).group('screen_name')
     return Screen(screen_name)
 
 
-def process_showing(chain: Chain, showing, date: str, cinema_url: str, cinema: Cinema, film: Film, token: str, lpvs: str) -> Optional[Showing]:
-    if 'BOID' not in showing:
-        # this means the screening has already started, or can't be booked, so we skip it
-        return None
+def process_showing(chain: Chain, showing, date: str, cinema_url: str, cinema: Cinema, film: Film, session: requests.Session, token: str, lpvs: str) -> Showing:
     showing_id = showing['BOID']
     time = showing['Display']
     date_and_time = datetime.strptime(f'{date} {time}', '%Y%m%d %H.%M')
     json_attributes = get_attributes(showing['Collections'])
     if 'Url' in showing and showing['Url'].strip() != '':
-        screen = get_screen_lightcinemas(showing['Url'], lpvs)
+        screen = get_screen_lightcinemas(session, showing['Url'], lpvs)
     else:
-        screen = get_screen_thelight(cinema_url, showing_id, token)
+        screen = get_screen_thelight(session, cinema_url, showing_id, token)
     return Showing(film, date_and_time, chain, cinema, screen, json_attributes)
 
 
-def get_showings(chain: Chain, cinema_url: str, cinema: Cinema) -> [Showing]:
-    token = lpvs = None
-    if 'thelight' in cinema_url:
-        token = get_token(cinema_url)
-    else:
-        lpvs = get_lpvs(cinema_url)
-    url = SHOWINGS_URL.format(cinema_url=cinema_url)
-    r = get_response(url)
-    showings_json = SHOWINGS_JSON_PATTERN.search(r.text).group('showings_json')
-    try:
-        showings_data = json.loads(showings_json)
-    except json.JSONDecodeError:
-        raise CinemaArchiverException(f'Error decoding JSON data from string: {showings_json}')
-    showings = []
+def get_bookable_sessions(showings_data: dict[str, any]) -> [(Film, str, dict[str, any])]:
+    sessions = []
     for film_data in showings_data['Schedule']:
         film_name = film_data['Title']
         film_year = UNKNOWN_FILM_YEAR
@@ -105,16 +89,43 @@ def get_showings(chain: Chain, cinema_url: str, cinema: Cinema) -> [Showing]:
             day = film_data['Dates'][i]
             date = day['Key']
             if 'Sessions' not in day:
-                for format in day['Formats']:
-                    for showing in format['Sessions']:
-                        res = process_showing(chain, showing, date, cinema_url, cinema, film, token, lpvs)
-                        if res is not None:
-                            showings.append(res)
+                day_sessions = [showing for format in day['Formats'] for showing in format['Sessions']]
             else:
-                for showing in day['Sessions']:
-                    res = process_showing(chain, showing, date, cinema_url, cinema, film, token, lpvs)
-                    if res is not None:
-                        showings.append(res)
+                day_sessions = day['Sessions']
+            for showing in day_sessions:
+                if 'BOID' not in showing:
+                    # this means the screening has already started, or can't be booked, so we skip it
+                    continue
+                sessions.append((film, date, showing))
+    return sessions
+
+
+def get_showings(chain: Chain, cinema_url: str, cinema: Cinema) -> [Showing]:
+    with requests.Session() as session:
+        token, lpvs = get_token_and_lpvs(session, cinema_url)
+        if 'thelight' in cinema_url and token is None:
+            raise CinemaArchiverException(f'No booking token found at URL {cinema_url}')
+        r = get_response(SHOWINGS_URL.format(cinema_url=cinema_url), session)
+        showings_json = SHOWINGS_JSON_PATTERN.search(r.text).group('showings_json')
+        try:
+            showings_data = json.loads(showings_json)
+        except json.JSONDecodeError:
+            raise CinemaArchiverException(f'Error decoding JSON data from string: {showings_json}')
+        # the screen of each session needs its own request, so these all run concurrently on the cinema's session
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            futures = [
+                executor.submit(process_showing, chain, showing, date, cinema_url, cinema, film, session, token, lpvs)
+                for film, date, showing in get_bookable_sessions(showings_data)
+            ]
+            return [future.result() for future in futures]
+
+
+def get_showings_for_cinemas(chain: Chain, cinemas: dict[str, Cinema]) -> [Showing]:
+    showings = []
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CINEMAS) as executor:
+        futures = [executor.submit(get_showings, chain, cinema_url, cinema) for cinema_url, cinema in cinemas.items()]
+        for future in futures:
+            showings += future.result()
     return showings
 
 
@@ -126,11 +137,8 @@ class LPVS(ChainArchiver):
         pass
 
     def get_showings(self) -> [Showing]:
-        showings = []
         cinemas = self.get_cinemas_as_dict()
-        for cinema_url, cinema in cinemas.items():
-            showings += get_showings(self.chain, cinema_url, cinema)
-        return showings
+        return get_showings_for_cinemas(self.chain, cinemas)
 
 
 class TheLight(LPVS):
@@ -142,6 +150,9 @@ class TheLight(LPVS):
         super().__init__(TheLight.CHAIN)
 
     def get_cinemas_as_dict(self) -> dict[str, Cinema]:
+        return cinema_directory.get_cinemas('TheLight', self.discover_cinemas)
+
+    def discover_cinemas(self) -> dict[str, Cinema]:
         r = get_response(TheLight.CINEMAS_URL)
         cinemas_json = TheLight.CINEMAS_JSON_PATTERN.search(r.text).group('cinemas_json')
         try:
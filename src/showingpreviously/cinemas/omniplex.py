@@ -1,10 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import Optional
 from bs4 import BeautifulSoup
 import re
 
+import showingpreviously.cinema_directory as cinema_directory
+import showingpreviously.listings as listings
+import showingpreviously.pipeline as pipeline
 import showingpreviously.requests as requests
-from showingpreviously.model import ChainArchiver, CinemaArchiverException, Chain, Cinema, Screen, Film, Showing
-from showingpreviously.consts import STANDARD_DAYS_AHEAD, UK_TIMEZONE, UNKNOWN_FILM_YEAR, UNKNOWN_SCREEN
+from showingpreviously.model import ChainArchiver, CinemaArchiverException, Chain, Cinema, Screen, Film, Showing, get_cinema_unit, read_cinema_unit
+from showingpreviously.consts import STANDARD_DAYS_AHEAD, UK_TIMEZONE, UNKNOWN_FILM_YEAR, UNKNOWN_SCREEN, MAX_CONCURRENT_REQUESTS
 
 
 CINEMAS_URL = 'https://www.omniplex.ie/'
@@ -21,7 +26,7 @@ def get_response(url: str) -> requests.Response:
     return r
 
 
-def get_cinemas_as_dict() -> dict[str, Cinema]:
+def discover_cinemas() -> dict[str, Cinema]:
     r = get_response(CINEMAS_URL)
     soup = BeautifulSoup(r.text, features='html.parser')
     cinema_select = soup.find('select', {'id': 'homeSelectCinema'})
@@ -33,6 +38,10 @@ def get_cinemas_as_dict() -> dict[str, Cinema]:
     return cinemas
 
 
+def get_cinemas_as_dict() -> dict[str, Cinema]:
+    return cinema_directory.get_cinemas('Omniplex', discover_cinemas)
+
+
 def get_attributes(at: str) -> dict[str, any]:
     at = at.lower()
     attributes = {'format': []}
@@ -54,14 +63,21 @@ def get_showing_screen(booking_link: str) -> Screen:
     return screen
 
 
-def get_showings_date(cinema_id: str, cinema: Cinema, dates: [str]) -> [Showing]:
+def fetch_cinema_page(cinema_id: str, cinema: Cinema, dates: [str]) -> Optional[bytes]:
     url = SHOWINGS_URL.format(cinema_id=cinema_id)
     r = get_response(url)
-    soup = BeautifulSoup(r.text, features='html.parser')
-    showings = []
+    # the page lists every date, so it is only unchanged for the same dates
+    if listings.is_unchanged(CHAIN.name, f'{cinema_id} {" ".join(dates)}', r.content):
+        return None
+    return r.content
+
+
+def parse_cinema_page(content: bytes, cinema_id: str, cinema: Cinema, dates: [str]) -> [(str, str, datetime, str, dict[str, any])]:
+    # runs in the parse pool, returning each showing's booking link in place of its screen, which needs its own request
+    soup = BeautifulSoup(content, features='html.parser')
+    bookings = []
     for cinema_block in soup.find_all('div', {'class': 'rightHolder'}):
         film_title = cinema_block.find('h3').text
-        film = Film(film_title, UNKNOWN_FILM_YEAR)
         for date in dates:
             showing_block = cinema_block.find('div', {'class': 'OMP_listingDate', 'data-date': date})
             if showing_block is None:
@@ -71,10 +87,26 @@ def get_showings_date(cinema_id: str, cinema: Cinema, dates: [str]) -> [Showing]
                     booking_link = showing_btn['href']
                     time = showing_btn.find('strong').text
                     date_and_time = datetime.strptime(f'{date} {time}', '%d-%m-%Y %H:%M')
-                    screen = get_showing_screen(booking_link)
                     json_attributes = get_attributes(showing_btn['data-at'])
-                    showings.append(Showing(film, date_and_time, CHAIN, cinema, screen, json_attributes))
-    return showings
+                    bookings.append((cinema_id, film_title, date_and_time, booking_link, json_attributes))
+    return bookings
+
+
+def get_booked_showings(cinemas: dict[str, Cinema], bookings: [(str, str, datetime, str, dict[str, any])]) -> [Showing]:
+    # the screen of each showing needs its own request, so these all run concurrently
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        screens = list(executor.map(get_showing_screen, [booking_link for _, _, _, booking_link, _ in bookings]))
+    return [
+        Showing(Film(film_title, UNKNOWN_FILM_YEAR), date_and_time, CHAIN, cinemas[cinema_id], screen, json_attributes)
+        for (cinema_id, film_title, date_and_time, _, json_attributes), screen in zip(bookings, screens)
+    ]
+
+
+def get_showings_date(cinema_id: str, cinema: Cinema, dates: [str]) -> [Showing]:
+    content = fetch_cinema_page(cinema_id, cinema, dates)
+    if content is None:
+        return []
+    return get_booked_showings({cinema_id: cinema}, parse_cinema_page(content, cinema_id, cinema, dates))
 
 
 def get_showing_dates() -> [str]:
@@ -89,9 +121,14 @@ def get_showing_dates() -> [str]:
 
 class Omniplex(ChainArchiver):
     def get_showings(self) -> [Showing]:
-        showings = []
         cinemas = get_cinemas_as_dict()
         dates = get_showing_dates()
-        for cinema_id, cinema in cinemas.items():
-            showings += get_showings_date(cinema_id, cinema, dates)
-        return showings
+        jobs = [(cinema_id, cinema, dates) for cinema_id, cinema in cinemas.items()]
+        return get_booked_showings(cinemas, pipeline.fetch_and_parse(jobs, fetch_cinema_page, parse_cinema_page))
+
+    def get_work_units(self) -> [str]:
+        return [get_cinema_unit(cinema_id, cinema) for cinema_id, cinema in get_cinemas_as_dict().items()]
+
+    def get_unit_showings(self, unit: str) -> [Showing]:
+        cinema_id, cinema, _ = read_cinema_unit(unit)
+        return get_showings_date(cinema_id, cinema, get_showing_dates())
@@ -3,10 +3,11 @@ import re
 from datetime import datetime
 from bs4 import BeautifulSoup
 
+import showingpreviously.cinema_directory as cinema_directory
 import showingpreviously.requests as requests
 from showingpreviously.model import ChainArchiver, CinemaArchiverException, Chain, Cinema, Screen, Film, Showing
 from showingpreviously.consts import UK_TIMEZONE
-from showingpreviously.cinemas.lpvs import get_showings as lpvs_get_showings
+from showingpreviously.cinemas.lpvs import get_showings_for_cinemas as lpvs_get_showings_for_cinemas
 
 
 SHOWING_LIST_URL = '{cinema_url}/?when={date_code}&type=all'
@@ -22,7 +23,8 @@ def get_response(url: str) -> requests.Response:
     return r
 
 
-def get_cinemas_as_dict() -> dict[str, Cinema]:
+def discover_cinemas() -> dict[str, Cinema]:
+    # one postback per cinema is needed just to learn its url, which is why the directory is cached
     form_data = {}
     r = get_response(Parkway.CINEMAS_URL)
     soup = BeautifulSoup(r.text, features='html.parser')
@@ -39,6 +41,10 @@ def get_cinemas_as_dict() -> dict[str, Cinema]:
     return cinemas
 
 
+def get_cinemas_as_dict() -> dict[str, Cinema]:
+    return cinema_directory.get_cinemas('Parkway', discover_cinemas)
+
+
 def get_date_and_screen(booking_url: str, delay_time: int) -> (datetime, Screen):
     try:
         r = get_response(booking_url)
@@ -94,11 +100,13 @@ class Parkway(ChainArchiver):
     # this method either uses the lpvs code, or the admit-one code
     def get_showings(self) -> [Showing]:
         showings = []
+        lpvs_cinemas = {}
         cinemas = get_cinemas_as_dict()
         for cinema_url, cinema in cinemas.items():
             if 'barnsley' in cinema_url:
                 # special logic for Barnsley which uses its own website system
                 showings += get_showings(cinema_url, cinema)
             else:
-                showings += lpvs_get_showings(Parkway.CHAIN, cinema_url, cinema)
+                lpvs_cinemas[cinema_url] = cinema
+        showings += lpvs_get_showings_for_cinemas(Parkway.CHAIN, lpvs_cinemas)
         return showings
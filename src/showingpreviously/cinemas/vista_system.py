@@ -1,12 +1,16 @@
+import base64
 import json
 import re
+import time
 
 from datetime import datetime, timedelta
-from typing import Tuple, Iterator
+from typing import Tuple, Iterator, Iterable, Optional
 import showingpreviously.requests as requests
-from showingpreviously.selenium import get_selenium_webdriver
+import showingpreviously.streaming as streaming
+from showingpreviously.streaming import JsonDocument, ResponseBody, DECODE_ERRORS
+from showingpreviously.selenium import find_in_page
 from showingpreviously.model import ChainArchiver, CinemaArchiverException, Chain, Cinema, Screen, Film, Showing
-from showingpreviously.consts import STANDARD_DAYS_AHEAD
+from showingpreviously.consts import STANDARD_DAYS_AHEAD, TOKEN_EXPIRY_MARGIN
 
 CINEMAS_URL = 'https://{api_url}/WSVistaWebClient/ocapi/v1/browsing/master-data/sites'
 FILMS_URL = 'https://{api_url}/WSVistaWebClient/ocapi/v1/browsing/master-data/films'
@@ -87,13 +91,24 @@ def get_showing_attributes(showing_attributes: [str], attributes: dict[str, Tupl
 
 
 def get_showings_date(showings_data: any, chain_name: str) -> [Showing]:
-    showings = []
-    showtimes = showings_data['showtimes']
+    return parse_showtimes(showings_data['showtimes'], showings_data['relatedData'], chain_name)
+
+
+def get_showings_content(content: ResponseBody, url: str, chain_name: str) -> [Showing]:
+    # the lookups in relatedData are read first, so the showtimes, which are most of the response, can be decoded one at a time
+    document = JsonDocument(content)
+    try:
+        return parse_showtimes(document.iter_items('showtimes'), document.get_values('relatedData'), chain_name)
+    except DECODE_ERRORS:
+        raise CinemaArchiverException(f'Error decoding JSON data from URL {url}')
+
 
-    cinemas = get_cinemas_as_dict(showings_data['relatedData']['sites'])
-    screens = get_screens_as_dict(showings_data['relatedData']['screens'])
-    films = get_films_as_dict(showings_data['relatedData']['films'])
-    attributes = get_attributes_as_dict(showings_data['relatedData']['attributes'])
+def parse_showtimes(showtimes: Iterable[dict[str, any]], related_data: dict[str, any], chain_name: str) -> [Showing]:
+    showings = []
+    cinemas = get_cinemas_as_dict(related_data['sites'])
+    screens = get_screens_as_dict(related_data['screens'])
+    films = get_films_as_dict(related_data['films'])
+    attributes = get_attributes_as_dict(related_data['attributes'])
 
     for show in showtimes:
         cinema = cinemas[show['siteId']]
@@ -105,36 +120,53 @@ def get_showings_date(showings_data: any, chain_name: str) -> [Showing]:
     return showings
 
 
-def get_api_data(api_url: str, token: str) -> Iterator[dict[str, any]]:
+def get_api_data(api_url: str, token: str) -> Iterator[Tuple[str, ResponseBody]]:
     request_headers = get_request_headers(token)
     current_date = datetime.now()
     end_date = current_date + timedelta(days=STANDARD_DAYS_AHEAD)
     while current_date < end_date:
         url = SHOWINGS_URL.format(api_url=api_url, date=current_date.strftime('%Y-%m-%d'))
-        r = requests.get(url, headers=request_headers)
+        r, body = requests.get_body(url, headers=request_headers)
         if r.status_code != 200:
+            streaming.discard(body)
             raise CinemaArchiverException(f'Got status code {r.status_code} when fetching URL {url}')
-        try:
-            showings_data = r.json()
-        except json.JSONDecodeError:
-            raise CinemaArchiverException(f'Error decoding JSON data from URL {url}')
-        yield showings_data
+        yield url, body
         current_date += timedelta(days=1)
 
 
+def get_token_expiry(token: str) -> float:
+    # the token is a JWT, whose payload has its expiry time, and one that can't be read is treated as expired
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (IndexError, ValueError, KeyError, TypeError):
+        return 0
+
+
 class VistaSystem(ChainArchiver):
     def __init__(self, api_url: str, chain_name: str,):
         super().__init__()
         self.chain_name = chain_name
         self.api_url = api_url
+        self.token: Optional[str] = None
 
     def get_showings(self) -> [Showing]:
-        token = self.get_token()
+        token = self.get_valid_token()
         showings = []
-        for showings_data in get_api_data(self.api_url, token):
-            showings += get_showings_date(showings_data, self.chain_name)
+        for url, body in get_api_data(self.api_url, token):
+            try:
+                showings += get_showings_content(body, url, self.chain_name)
+            finally:
+                streaming.discard(body)
         return showings
 
+    def get_valid_token(self) -> str:
+        # the token is kept until it is about to expire, so a long-running process doesn't fetch one every run
+        if self.token is None or get_token_expiry(self.token) < time.time() + TOKEN_EXPIRY_MARGIN:
+            self.token = self.get_token()
+        return self.token
+
     def get_token(self) -> str:
         pass
 
@@ -145,10 +177,8 @@ class Odeon(VistaSystem):
         super().__init__('vwc.odeon.co.uk', 'Odeon')
 
     def get_token(self) -> str:
-        driver = get_selenium_webdriver()
-        driver.get('https://www.odeon.co.uk/')
         jwt_finder = re.compile(r'"authToken":"(?P<jwt_token>.+?)"')
-        token = jwt_finder.search(driver.page_source).group('jwt_token')
+        token = find_in_page('https://www.odeon.co.uk/', '"authToken"', jwt_finder).group('jwt_token')
         return token
 
 
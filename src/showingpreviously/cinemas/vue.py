@@ -1,8 +1,14 @@
 import json
 
 from datetime import datetime, timedelta
+from typing import Optional, Iterable
+import showingpreviously.cinema_directory as cinema_directory
+import showingpreviously.listings as listings
+import showingpreviously.pipeline as pipeline
 import showingpreviously.requests as requests
-from showingpreviously.model import ChainArchiver, CinemaArchiverException, Chain, Cinema, Screen, Film, Showing
+import showingpreviously.streaming as streaming
+from showingpreviously.streaming import JsonDocument, ResponseBody, DECODE_ERRORS
+from showingpreviously.model import ChainArchiver, CinemaArchiverException, Chain, Cinema, Screen, Film, Showing, ShowingRow, to_row, from_row, get_cinema_unit, read_cinema_unit
 from showingpreviously.consts import STANDARD_DAYS_AHEAD, UK_TIMEZONE
 
 
@@ -19,7 +25,15 @@ def get_response(url: str) -> requests.Response:
     return r
 
 
-def get_cinemas_as_dict() -> dict[str, Cinema]:
+def get_body(url: str) -> ResponseBody:
+    r, body = requests.get_body(url)
+    if r.status_code != 200:
+        streaming.discard(body)
+        raise CinemaArchiverException(f'Got status code {r.status_code} when fetching URL {url}')
+    return body
+
+
+def discover_cinemas() -> dict[str, Cinema]:
     r = get_response(CINEMAS_API_URL)
     try:
         cinemas_data = r.json()
@@ -35,6 +49,10 @@ def get_cinemas_as_dict() -> dict[str, Cinema]:
     return cinemas
 
 
+def get_cinemas_as_dict() -> dict[str, Cinema]:
+    return cinema_directory.get_cinemas('Vue', discover_cinemas)
+
+
 def get_attributes(showing: dict[str, any]) -> dict[str, any]:
     attributes = {'format':[]}
     for tag in showing['tags']:
@@ -59,19 +77,44 @@ def get_attributes(showing: dict[str, any]) -> dict[str, any]:
     return attributes
 
 
-def get_showings_date(cinema_id: str, cinema: Cinema, date: str) -> [Showing]:
+def fetch_showings_date(cinema_id: str, cinema: Cinema, date: str) -> Optional[ResponseBody]:
     url = SHOWINGS_API_URL.format(cinema_id=cinema_id, date=date)
-    r = get_response(url)
+    body = get_body(url)
+    if listings.is_unchanged(CHAIN.name, f'{cinema_id} {date}', body):
+        streaming.discard(body)
+        return None
+    return body
+
+
+def parse_showing_rows(content: ResponseBody, cinema_id: str, cinema: Cinema, date: str) -> [ShowingRow]:
+    # runs in the parse pool, so it returns showing rows which are cheap to send back
+    # each film is decoded on its own, with only its own showings
     try:
-        showings_data = r.json()
-    except json.JSONDecodeError:
-        # raise CinemaArchiverException(f'Error decoding JSON data from URL {url}')
+        return [to_row(showing) for showing in parse_films(JsonDocument(content).iter_items('films'), cinema)]
+    except DECODE_ERRORS:
+        # raise CinemaArchiverException(f'Error decoding JSON data from URL {SHOWINGS_API_URL.format(cinema_id=cinema_id, date=date)}')
         # VUE has an API bug where sometimes this sometimes gives a redirect, not JSON.
         # best way of dealing with this is to skip the day
         return []
 
+
+def get_showings_date(cinema_id: str, cinema: Cinema, date: str) -> [Showing]:
+    content = fetch_showings_date(cinema_id, cinema, date)
+    if content is None:
+        return []
+    try:
+        return [from_row(row) for row in parse_showing_rows(content, cinema_id, cinema, date)]
+    finally:
+        streaming.discard(content)
+
+
+def parse_showings_date(showings_data: dict[str, any], cinema: Cinema) -> [Showing]:
+    return parse_films(showings_data['films'], cinema)
+
+
+def parse_films(films_data: Iterable[dict[str, any]], cinema: Cinema) -> [Showing]:
     showings = []
-    for film_data in showings_data['films']:
+    for film_data in films_data:
         film_name = film_data['title']
         film_year = film_data['info_release'][-4:]
         film = Film(film_name, film_year)
@@ -96,9 +139,13 @@ def get_showing_dates() -> str:
 
 class Vue(ChainArchiver):
     def get_showings(self) -> [Showing]:
-        showings = []
         cinemas = get_cinemas_as_dict()
-        for cinema_id, cinema in cinemas.items():
-            for date in get_showing_dates():
-                showings += get_showings_date(cinema_id, cinema, date)
-        return showings
+        jobs = [(cinema_id, cinema, date) for cinema_id, cinema in cinemas.items() for date in get_showing_dates()]
+        return [from_row(row) for row in pipeline.fetch_and_parse(jobs, fetch_showings_date, parse_showing_rows)]
+
+    def get_work_units(self) -> [str]:
+        return [get_cinema_unit(cinema_id, cinema, date) for cinema_id, cinema in get_cinemas_as_dict().items() for date in get_showing_dates()]
+
+    def get_unit_showings(self, unit: str) -> [Showing]:
+        cinema_id, cinema, (date,) = read_cinema_unit(unit)
+        return get_showings_date(cinema_id, cinema, date)
@@ -1,25 +1,58 @@
+import os
+from datetime import datetime, timedelta
 from typing import Optional
 
 import click
 
 from showingpreviously.archiver import run_all, run_single, all_cinema_chains
-from showingpreviously.db import db_info, database_location
+from showingpreviously.benchmark import benchmark_chains, benchmark_parsers, benchmark_memory, save_parse_baselines, get_baseline_path, PARSE_BENCHMARKS, MEMORY_BENCHMARKS
+from showingpreviously.db import db_info, chain_info, recount_stats, rebuild_rollups, daily_showings, daily_attributes, get_unknown_year_films, add_film_alias, merge_databases, MergeException, get_connection, database_location
+from showingpreviously.film_resolution import get_film_index
+from showingpreviously.reparse import reparse
+from showingpreviously.partitions import compact, query_showings, get_cold_months
+from showingpreviously.distributed import WorkQueue, distribute, work, collect, get_chains
+from showingpreviously.daemon import Daemon
+from showingpreviously.consts import CHAIN_SCHEDULES, PARSE_WORKERS, ARCHIVE_RESPONSES, PARTITION_HOT_MONTHS, FILM_RESOLUTION_THRESHOLD, UNKNOWN_FILM_YEAR, COALESCE_REQUESTS, SINGLE_FLIGHT_WINDOW, HEDGE_REQUESTS, PARSE_BENCHMARK_SCALES, PARSE_REGRESSION_THRESHOLD
+import showingpreviously.cinema_directory as cinema_directory
+import showingpreviously.journal as journal
+import showingpreviously.listings as listings
+import showingpreviously.pipeline as pipeline
+import showingpreviously.streaming as streaming
+import showingpreviously.response_archive as response_archive
+import showingpreviously.requests as requests
+import showingpreviously.metrics as metrics
+import showingpreviously.profiling as profiling
 
 
 @click.group()
 def cli() -> None:
-    pass
+    # the archive's schema is brought up to date before any command reads it
+    get_connection()
 
 
 @cli.command('info')
 @click.option('--list-chains', 'list_chains', is_flag=True, default=False, show_default=False, type=click.BOOL, help='List all the chains that can be run with the --chain option')
-def info_cmd(list_chains: bool) -> None:
+@click.option('--chain-stats', 'chain_stats', is_flag=True, default=False, show_default=False, type=click.BOOL, help='Print the showings archived for each chain')
+@click.option('--recount', is_flag=True, default=False, show_default=False, type=click.BOOL, help='Rebuild the stored statistics by counting the whole database')
+def info_cmd(list_chains: bool, chain_stats: bool, recount: bool) -> None:
     """Prints basic information about showingpreviously, and the database contents"""
     print('ShowingPreviously: A cinema showtimes archiver')
     print(f'The database is stored at "{database_location}".')
     print(f'There are {len(all_cinema_chains)} cinema chains installed')
+    if recount:
+        recount_stats()
     chains_count, cinema_count, screen_count, film_count, showing_count = db_info()
     print(f'In the database we have {chains_count} chains, with {cinema_count} cinemas and {screen_count} screens, {film_count} films and {showing_count} showings.')
+    cold_months = get_cold_months()
+    if len(cold_months) > 0:
+        print(f'{len(cold_months)} months of showings are in read-only partitions, from {min(cold_months)} to {max(cold_months)}.')
+    if chain_stats:
+        for chain_name, showing_count, earliest, latest, last_run in chain_info():
+            last_run_str = last_run.strftime('%Y-%m-%d %H:%M') if last_run is not None else 'never'
+            if showing_count == 0:
+                print(f'{chain_name}: no showings, last successful run {last_run_str}')
+                continue
+            print(f'{chain_name}: {showing_count} showings from {earliest:%Y-%m-%d} to {latest:%Y-%m-%d}, last successful run {last_run_str}')
     if list_chains:
         installed_chains = ', '.join([type(cinema_chain).__name__ for cinema_chain in all_cinema_chains])
         print(f'The installed chains are: {installed_chains}')
@@ -28,17 +61,289 @@ def info_cmd(list_chains: bool) -> None:
 @cli.command('run')
 @click.option('--chain', default=None, show_default=True, type=click.STRING, help='The archiver class name to run')
 @click.option('--dry-run', 'dry_run', is_flag=True, default=False, show_default=False, type=click.BOOL, help='Run, but don\'t make any changes to the DB')
-def run_cmd(chain: Optional[str], dry_run: bool = False) -> None:
+@click.option('--coalesce/--no-coalesce', 'coalesce', default=COALESCE_REQUESTS, show_default=True, help='Share one request between identical GETs in flight at the same time')
+@click.option('--coalesce-window', 'coalesce_window', default=SINGLE_FLIGHT_WINDOW, show_default=True, type=click.FloatRange(0), help='Seconds that identical GETs also share a response after it has finished')
+@click.option('--hedge/--no-hedge', 'hedge', default=HEDGE_REQUESTS, show_default=True, help='Send a duplicate GET when a request is slower than its host\'s p95 latency')
+@click.option('--parse-workers', 'parse_workers', default=PARSE_WORKERS, show_default=True, type=click.IntRange(0), help='Processes that parse listings while more are fetched, 0 to parse them on the fetching threads')
+@click.option('--force', is_flag=True, default=False, help='Parse and write every listing, even those unchanged since the last run')
+@click.option('--refresh-cinemas', 'refresh_cinemas', is_flag=True, default=False, help='Discover every chain\'s cinemas again, instead of using the stored cinema directory')
+@click.option('--archive-responses/--no-archive-responses', 'archive_responses', default=ARCHIVE_RESPONSES, show_default=True, help='Keep every raw response in the compressed response archive, for reparse')
+@click.option('--journal', 'use_journal', is_flag=True, default=False, help='Append showings to the ingest journal, which a background thread compacts into the DB in sorted batches')
+@click.option('--record', 'record_dir', default=None, type=click.Path(file_okay=False, writable=True), help='Record every request and response into a cassette per chain in this directory')
+@click.option('--prometheus', is_flag=True, default=False, help='Also write the run metrics as a Prometheus textfile in the data directory')
+@click.option('--profile', 'profile_mode', is_flag=False, flag_value=profiling.CPU, default=None, type=click.Choice(profiling.MODES), help='Profile each chain\'s get_showings and DB write phases separately, by CPU time, wall time or memory  [default mode: cpu]')
+@click.option('--profile-allocations', 'profile_allocations', default=0, type=click.IntRange(0), help='Also write the top N tracemalloc allocation sites of each profiled phase, profiling by memory if --profile isn\'t given')
+def run_cmd(chain: Optional[str], dry_run: bool = False, coalesce: bool = COALESCE_REQUESTS, coalesce_window: float = SINGLE_FLIGHT_WINDOW, hedge: bool = HEDGE_REQUESTS, parse_workers: int = PARSE_WORKERS, force: bool = False, refresh_cinemas: bool = False, archive_responses: bool = ARCHIVE_RESPONSES, use_journal: bool = False,
+            record_dir: Optional[str] = None, prometheus: bool = False, profile_mode: Optional[str] = None, profile_allocations: int = 0) -> None:
     """Runs the archiver on all cinema chains"""
+    if profile_allocations > 0 and profile_mode is None:
+        profile_mode = profiling.MEM
+    profile_dir = profiling.configure(profile_mode, profile_allocations)
+    if profile_dir is not None:
+        print(f'Writing {profile_mode} profiles to "{profile_dir}"')
     if dry_run:
         print('Dry run, no changes to DB')
+    if record_dir is not None:
+        os.makedirs(record_dir, exist_ok=True)
+        print(f'Recording requests to "{record_dir}"')
+    requests.set_single_flight(coalesce, coalesce_window)
+    requests.set_hedging(hedge)
+    pipeline.set_parse_workers(parse_workers)
+    listings.set_force(force)
+    cinema_directory.set_refresh(refresh_cinemas)
+    cinema_directory.set_dry_run(dry_run)
+    response_archive.set_enabled(archive_responses and not dry_run)
+    if use_journal and not dry_run:
+        open_journal()
     if chain is None:
-        run_all(dry_run)
+        run_all(dry_run, record_dir)
     else:
         installed_chains = [type(cinema_chain).__name__ for cinema_chain in all_cinema_chains]
         if chain not in installed_chains:
             raise click.BadOptionUsage('--chain', f'No such installed chain "{chain}"')
-        run_single(chain, dry_run)
+        run_single(chain, dry_run, record_dir)
+    compacted = journal.close_journal()
+    if compacted is not None:
+        print(compacted)
+    single_flight_stats = requests.single_flight.stats()
+    print(f'Made {single_flight_stats["requests"]} GET requests, and saved {single_flight_stats["saved"]} duplicate requests.')
+    request_stats = requests.request_stats
+    print(f'Sent {request_stats.get_count("requests")} requests: {request_stats.get_count("timeouts")} timed out, {request_stats.get_count("hedged")} were hedged and {request_stats.get_count("hedge_wins")} hedges won.')
+    print(f'Wrote the run report to "{metrics.write_run_report()}"')
+    if prometheus:
+        print(f'Wrote Prometheus metrics to "{metrics.write_prometheus_textfile()}"')
+
+
+@cli.command('bench')
+@click.argument('cassette_dir', type=click.Path(exists=True, file_okay=False))
+@click.option('--chain', default=None, show_default=True, type=click.STRING, help='The archiver class name to benchmark')
+@click.option('--latency', default=0.0, show_default=True, type=click.FLOAT, help='Seconds of simulated latency added to every replayed request')
+@click.option('--memory/--no-memory', 'measure_memory', default=True, show_default=True, help='Also replay each chain under tracemalloc to measure peak memory')
+def bench_cmd(cassette_dir: str, chain: Optional[str], latency: float, measure_memory: bool) -> None:
+    """Benchmarks chain archivers against cassettes recorded with run --record"""
+    chains = all_cinema_chains
+    if chain is not None:
+        chains = [cinema_chain for cinema_chain in all_cinema_chains if type(cinema_chain).__name__ == chain]
+        if len(chains) == 0:
+            raise click.BadOptionUsage('--chain', f'No such installed chain "{chain}"')
+    results = benchmark_chains(chains, cassette_dir, latency, measure_memory)
+    if len(results) == 0:
+        print(f'No cassettes found in "{cassette_dir}"')
+    for result in results:
+        print(result)
+
+
+@cli.command('bench-parse')
+@click.option('--scale', 'scales', multiple=True, default=PARSE_BENCHMARK_SCALES, show_default=True, type=click.INT, help='Multiples of a production-sized payload to benchmark with')
+@click.option('--function', 'functions', multiple=True, type=click.Choice(list(PARSE_BENCHMARKS.keys())), help='Only benchmark these parse functions')
+@click.option('--repeat', default=3, show_default=True, type=click.INT, help='Times to run each benchmark, keeping the fastest')
+@click.option('--baseline', 'baseline_path', default=None, type=click.Path(dir_okay=False), help='Baseline file to compare against [default: in the data directory]')
+@click.option('--save-baseline', 'save_baseline', is_flag=True, default=False, help='Store these results as the new baseline')
+@click.option('--threshold', default=PARSE_REGRESSION_THRESHOLD, show_default=True, type=click.FLOAT, help='Fail when a function is this many times slower than its baseline')
+def bench_parse_cmd(scales: [int], functions: [str], repeat: int, baseline_path: Optional[str], save_baseline: bool, threshold: float) -> None:
+    """Benchmarks the chain parse functions on synthetic payloads"""
+    baseline_path = baseline_path or get_baseline_path()
+    results = benchmark_parsers(scales, functions, repeat, baseline_path)
+    for result in results:
+        print(result)
+    if save_baseline:
+        save_parse_baselines(baseline_path, results)
+        print(f'Saved baseline to "{baseline_path}"')
+        return
+    regressions = [result for result in results if result.is_regression(threshold)]
+    if len(regressions) > 0:
+        names = ', '.join([f'{result.name} @ {result.scale}x' for result in regressions])
+        raise click.ClickException(f'{len(regressions)} parse benchmarks are over {threshold}x their baseline: {names}')
+
+
+@cli.command('bench-memory')
+@click.option('--scale', 'scales', multiple=True, default=PARSE_BENCHMARK_SCALES, show_default=True, type=click.INT, help='Multiples of a production-sized payload to benchmark with')
+@click.option('--chain', 'chains', multiple=True, type=click.Choice(list(MEMORY_BENCHMARKS.keys())), help='Only benchmark these chains\' parsers')
+def bench_memory_cmd(scales: [int], chains: [str]) -> None:
+    """Compares the peak memory of parsing synthetic JSON responses by decoding them whole and by streaming them"""
+    if streaming.ijson is None:
+        print('ijson is not installed, so streamed responses are decoded whole')
+    for result in benchmark_memory(scales, chains):
+        print(result)
+
+
+@cli.command('rollups')
+@click.option('--from', 'start_day', default=None, type=click.DateTime(['%Y-%m-%d']), help='The first UTC day to report  [default: today]')
+@click.option('--to', 'end_day', default=None, type=click.DateTime(['%Y-%m-%d']), help='The last UTC day to report  [default: a week after --from]')
+@click.option('--chain', 'chain_name', default=None, type=click.STRING, help='Only report this chain, by its name in the database')
+@click.option('--cinema', 'cinema_name', default=None, type=click.STRING, help='Only report this cinema, by its name in the database')
+@click.option('--attributes', 'show_attributes', is_flag=True, default=False, help='Report how many showings had each attribute instead of the showings per film')
+@click.option('--rebuild', is_flag=True, default=False, help='Rebuild the daily rollups from the showings table first')
+def rollups_cmd(start_day: Optional[datetime], end_day: Optional[datetime], chain_name: Optional[str], cinema_name: Optional[str], show_attributes: bool, rebuild: bool) -> None:
+    """Reports showings per day, chain, cinema and film from the daily rollup tables"""
+    if rebuild:
+        rebuild_rollups()
+        print('Rebuilt the daily rollups')
+    start_day = start_day or datetime.utcnow()
+    end_day = end_day or start_day + timedelta(days=7)
+    start_day_str, end_day_str = start_day.strftime('%Y-%m-%d'), end_day.strftime('%Y-%m-%d')
+    if show_attributes:
+        for attribute, showing_count in daily_attributes(start_day_str, end_day_str, chain_name, cinema_name):
+            print(f'{attribute}: {showing_count} showings')
+        return
+    for day, row_chain_name, row_cinema_name, film_name, film_year, showing_count, screen_count in daily_showings(start_day_str, end_day_str, chain_name, cinema_name):
+        print(f'{day} {row_chain_name} {row_cinema_name}: {film_name} ({film_year}) {showing_count} showings on {screen_count} screens')
+
+
+@cli.command('resolve-films')
+@click.option('--threshold', default=FILM_RESOLUTION_THRESHOLD, show_default=True, type=click.FloatRange(0, 1), help='Title similarity needed to match a film of unknown year to a known film')
+@click.option('--dry-run', 'dry_run', is_flag=True, default=False, show_default=False, type=click.BOOL, help='Print the matches, but don\'t store them in the DB')
+def resolve_films_cmd(threshold: float, dry_run: bool) -> None:
+    """Matches every archived film of unknown year to a known film, storing the matches as aliases"""
+    film_index = get_film_index()
+    unknown_year_films = get_unknown_year_films()
+    resolved = 0
+    for film_name, latest_showing in unknown_year_films:
+        resolution = film_index.resolve(film_name, latest_showing.year if latest_showing is not None else None, threshold)
+        if resolution is None:
+            continue
+        resolved_name, resolved_year, confidence = resolution
+        print(f'{film_name} -> {resolved_name} ({resolved_year}), {confidence:.2f} similar')
+        if not dry_run:
+            add_film_alias(film_name, UNKNOWN_FILM_YEAR, resolved_name, resolved_year, confidence)
+        resolved += 1
+    print(f'Resolved {resolved} of {len(unknown_year_films)} films of unknown year.')
+
+
+@cli.command('reparse')
+@click.option('--chain', default=None, type=click.STRING, help='The archiver class name to reparse')
+@click.option('--from', 'since', default=None, type=click.DateTime(), help='Only reparse runs started at or after this time')
+@click.option('--to', 'until', default=None, type=click.DateTime(), help='Only reparse runs started at or before this time')
+@click.option('--workers', default=None, type=click.IntRange(1), help='Worker processes to parse with  [default: one per CPU]')
+@click.option('--dry-run', 'dry_run', is_flag=True, default=False, show_default=False, type=click.BOOL, help='Parse, but don\'t make any changes to the DB')
+def reparse_cmd(chain: Optional[str], since: Optional[datetime], until: Optional[datetime], workers: Optional[int], dry_run: bool) -> None:
+    """Parses the archived raw responses again with the current chain archivers, and updates their showings"""
+    if chain is not None and chain not in [type(cinema_chain).__name__ for cinema_chain in all_cinema_chains]:
+        raise click.BadOptionUsage('--chain', f'No such installed chain "{chain}"')
+    result = reparse(chain, since, until, workers, dry_run)
+    for failed_chain_name, run_started, e in result.failures:
+        print(f'Failed to reparse the {failed_chain_name} run of {datetime.fromtimestamp(run_started):%Y-%m-%d %H:%M}: {e}')
+    print(result)
+
+
+@cli.command('distribute')
+@click.argument('queue_path', type=click.Path(dir_okay=False))
+@click.option('--chain', 'chains', multiple=True, type=click.Choice([type(cinema_chain).__name__ for cinema_chain in all_cinema_chains]), help='Only queue these chains  [default: all]')
+def distribute_cmd(queue_path: str, chains: [str]) -> None:
+    """Splits a run of the chains into work units on a queue shared with workers"""
+    queue = WorkQueue(queue_path)
+    run_id, unit_count, failures = distribute(queue, list(chains))
+    for chain_name, e in failures:
+        print(f'Failed to split {chain_name} into units: {e}')
+    print(f'Queued run {run_id} as {unit_count} units in "{queue_path}"')
+
+
+@cli.command('worker')
+@click.argument('queue_path', type=click.Path(exists=True, dir_okay=False))
+@click.argument('shard_path', type=click.Path(dir_okay=False))
+@click.option('--worker-id', 'worker_id', default=None, type=click.STRING, help='The name this worker leases units under  [default: host and process id]')
+@click.option('--wait', is_flag=True, default=False, help='Keep waiting while other workers hold units, in case they are lost')
+def worker_cmd(queue_path: str, shard_path: str, worker_id: Optional[str], wait: bool) -> None:
+    """Archives work units from a queue into a shard database, until the queue is empty"""
+    units_done, units_failed = work(WorkQueue(queue_path), shard_path, worker_id, wait)
+    print(f'Archived {units_done} units into "{shard_path}", and {units_failed} units failed')
+
+
+@cli.command('collect')
+@click.argument('queue_path', type=click.Path(exists=True, dir_okay=False))
+@click.argument('shard_paths', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+def collect_cmd(queue_path: str, shard_paths: [str]) -> None:
+    """Merges worker shard databases into the archive, and records the chains whose units all finished"""
+    try:
+        run_id, counts, merge_result = collect(WorkQueue(queue_path), list(shard_paths))
+    except MergeException as e:
+        raise click.ClickException(str(e))
+    print(merge_result)
+    states = ', '.join([f'{count} {state}' for state, count in sorted(counts.items())])
+    print(f'Run {run_id} has {states} units.')
+
+
+@cli.command('merge')
+@click.argument('source_paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+def merge_cmd(source_paths: [str]) -> None:
+    """Merges other showingpreviously databases into the archive, oldest first, as later ones' showing attributes win"""
+    try:
+        result = merge_databases(list(source_paths))
+    except MergeException as e:
+        raise click.ClickException(str(e))
+    print(result)
+    if result.rebuilt_stats:
+        print('Recounted the statistics and rebuilt the daily rollups.')
+
+
+@cli.command('compact')
+@click.option('--hot-months', 'hot_months', default=PARTITION_HOT_MONTHS, show_default=True, type=click.IntRange(1), help='Months of showings, up to the current one, to keep in the archive')
+@click.option('--vacuum', is_flag=True, default=False, help='Vacuum the archive afterwards to give the space back')
+def compact_cmd(hot_months: int, vacuum: bool) -> None:
+    """Moves the showings of old months into a read-only database file per month"""
+    results = compact(hot_months, vacuum)
+    for result in results:
+        print(result)
+    if len(results) == 0:
+        print('No months to compact')
+
+
+@cli.command('showings')
+@click.option('--from', 'start', required=True, type=click.DateTime(), help='The earliest showing time')
+@click.option('--to', 'end', required=True, type=click.DateTime(), help='The latest showing time')
+@click.option('--chain', 'chain_name', default=None, type=click.STRING, help='Only show this chain, by its name in the database')
+@click.option('--cinema', 'cinema_name', default=None, type=click.STRING, help='Only show this cinema, by its name in the database')
+@click.option('--film', 'film_name', default=None, type=click.STRING, help='Only show this film, by its name in the database')
+def showings_cmd(start: datetime, end: datetime, chain_name: Optional[str], cinema_name: Optional[str], film_name: Optional[str]) -> None:
+    """Prints the archived showings between two times, from the archive and any partitions the times fall in"""
+    for film, year, chain, cinema, screen, time, attributes in query_showings(start, end, chain_name, cinema_name, film_name):
+        print(f'{time:%Y-%m-%d %H:%M} {chain}, {cinema}, {screen}: {film} ({year}) {attributes}')
+
+
+@cli.command('daemon')
+@click.option('--chain', 'chains', multiple=True, type=click.Choice([type(cinema_chain).__name__ for cinema_chain in all_cinema_chains]), help='Only run these chains  [default: all]')
+@click.option('--schedule', 'schedules', multiple=True, type=click.STRING, help='Seconds between runs of a chain, as NAME=SECONDS, replacing its default schedule')
+@click.option('--dry-run', 'dry_run', is_flag=True, default=False, show_default=False, type=click.BOOL, help='Run, but don\'t make any changes to the DB')
+@click.option('--refresh-cinemas', 'refresh_cinemas', is_flag=True, default=False, help='Discover every chain\'s cinemas again on its first run, instead of using the stored cinema directory')
+@click.option('--journal', 'use_journal', is_flag=True, default=False, help='Append showings to the ingest journal, which a background thread compacts into the DB in sorted batches')
+@click.option('--prometheus', is_flag=True, default=False, help='Rewrite the Prometheus textfile in the data directory after every chain run')
+def daemon_cmd(chains: [str], schedules: [str], dry_run: bool, refresh_cinemas: bool, use_journal: bool, prometheus: bool) -> None:
+    """Stays running, archiving each chain on its own schedule until stopped with SIGTERM or Ctrl-C"""
+    chain_schedules = dict(CHAIN_SCHEDULES)
+    for schedule in schedules:
+        name, _, seconds = schedule.partition('=')
+        try:
+            chain_schedules[name] = float(seconds)
+        except ValueError:
+            raise click.BadOptionUsage('--schedule', f'Schedule "{schedule}" is not NAME=SECONDS')
+    if dry_run:
+        print('Dry run, no changes to DB')
+    cinema_directory.set_refresh(refresh_cinemas)
+    cinema_directory.set_dry_run(dry_run)
+    response_archive.set_enabled(ARCHIVE_RESPONSES and not dry_run)
+    if use_journal and not dry_run:
+        open_journal()
+    Daemon(get_chains(list(chains)), chain_schedules, dry_run, prometheus).run()
+
+
+@cli.command('compact-journal')
+def compact_journal_cmd() -> None:
+    """Writes the showings left in the ingest journal by a run that was killed into the DB"""
+    try:
+        print(journal.open_journal())
+    except journal.JournalLockedException as e:
+        raise click.ClickException(str(e))
+    journal.close_journal()
+
+
+def open_journal() -> None:
+    try:
+        recovered = journal.open_journal()
+    except journal.JournalLockedException as e:
+        raise click.ClickException(str(e))
+    if recovered.segments > 0:
+        print(f'Recovered from an earlier run: {recovered}')
+    print(f'Journaling showings to "{journal.ingest_journal.directory}"')
 
 
 if __name__ == '__main__':
@@ -9,9 +9,41 @@ from showingpreviously.model import Screen
 PROGRAM_NAME = 'showingpreviously'
 DATABASE_NAME = 'showtimes.db'
 URL_LOG_NAME = 'url-log-%Y-%m-%d.txt'
+PARSE_BASELINE_NAME = 'parse-benchmark-baseline.json'
+RUN_REPORT_NAME = 'run-report-%Y-%m-%dT%H-%M-%S.json'
+PROMETHEUS_TEXTFILE_NAME = 'showingpreviously.prom'
+PROFILE_DIR_NAME = 'profiles'
+RESPONSE_ARCHIVE_NAME = 'responses.db'
+PARTITION_DIR_NAME = 'partitions'
+PARTITION_NAME = 'showings-{month}.db'
+BROWSER_PROFILE_DIR_NAME = 'browser-profile'
+JOURNAL_DIR_NAME = 'journal'
+JOURNAL_SEGMENT_NAME = 'segment-{sequence:012d}.log'
+JOURNAL_LOCK_NAME = 'journal.lock'
 DATA_DIR = user_data_dir(PROGRAM_NAME)
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# database consts
+DB_BUSY_TIMEOUT = 30  # seconds to wait for a lock before giving up
+DB_CACHE_SIZE = 64 * 1024 * 1024  # bytes of page cache per connection
+DB_MMAP_SIZE = 256 * 1024 * 1024  # bytes of the database file to memory map
+PARTITION_HOT_MONTHS = 3  # months of showings, up to the current one, kept in the archive rather than compacted into partitions
+MERGE_MAX_ATTACHED = 9  # sources merged in one transaction, under SQLite's limit of 10 attached databases
+MERGE_REBUILD_FRACTION = 0.25  # merges adding more than this fraction of the archive's showings recount the stats afterwards
+
+# journal consts
+JOURNAL_SEGMENT_SIZE = 64 * 1024 * 1024  # bytes written to a journal segment before a new one is started
+JOURNAL_COMPACT_BATCH = 50000  # showings written to the DB in each transaction when compacting the journal
+
+# response archive consts
+ARCHIVE_RESPONSES = True
+RESPONSE_COMPRESSION_LEVEL = 9  # zstd level, high enough with a trained dictionary while staying cheap on the fetching threads
+RESPONSE_FLUSH_ENTRIES = 16  # responses buffered before they are compressed and written, so a run's bodies aren't all held in memory
+RESPONSE_DICTIONARY_SIZE = 112 * 1024  # bytes
+RESPONSE_DICTIONARY_MIN_SAMPLES = 8  # responses a chain needs in a run before a dictionary is trained on them
+RESPONSE_DICTIONARY_MAX_AGE = 30 * 24 * 60 * 60  # seconds before a chain's dictionary is retrained
+REPARSE_BATCH = 50000  # reparsed showings written to the DB in each transaction
+
 # model consts
 UNKNOWN_SCREEN = Screen('UNKNOWN SCREEN')
 UNKNOWN_FILM_YEAR = ''
@@ -19,3 +51,82 @@ UNKNOWN_FILM_YEAR = ''
 # archiver consts
 STANDARD_DAYS_AHEAD = 2
 UK_TIMEZONE = 'Europe/London'
+CINEMA_DIRECTORY_TTL = 7 * 24 * 60 * 60  # seconds a chain's list of cinemas is reused before it is discovered again
+FEED_PAGE_SIZE = 25  # entries asked for in each page of a blog feed
+FEED_MAX_PAGES = 10  # pages of a blog feed followed before giving up, however many have upcoming entries
+
+# film resolution consts
+FILM_RESOLUTION_THRESHOLD = 0.8  # trigram similarity needed to match a film of unknown year to a known film
+FILM_RESOLUTION_YEARS_BEFORE = 3  # years before a showing that its film is first looked for in
+FILM_RESOLUTION_YEARS_AFTER = 1
+FILM_RESOLUTION_CANDIDATE_TOKENS = 2  # the rarest words of a title whose films are compared against it
+
+# daemon consts
+CHAIN_SCHEDULES = {
+    # seconds between runs of each chain, by archiver class name
+    'Cineworld': 60 * 60,
+    'Odeon': 60 * 60,
+    'Vue': 60 * 60,
+    'IsleOfButeDiscoveryCentreCinema': 24 * 60 * 60,
+    'DundeeContemporaryArts': 12 * 60 * 60,
+}
+DEFAULT_CHAIN_SCHEDULE = 3 * 60 * 60
+DAEMON_RETRY_INTERVAL = 15 * 60  # seconds before a chain that failed is run again, if sooner than its schedule
+TOKEN_EXPIRY_MARGIN = 5 * 60  # seconds before a cached API token expires that a new one is fetched
+
+# request consts
+MAX_CONCURRENT_REQUESTS = 8
+MAX_CONCURRENT_CINEMAS = 4
+PARSE_WORKERS = os.cpu_count() or 1  # processes that parse fetched listings, 0 to parse them on the threads that fetch them
+COALESCE_REQUESTS = True  # identical GETs in flight at the same time share one request
+SINGLE_FLIGHT_WINDOW = 0  # seconds an identical GET also shares a response after it has finished
+DEFAULT_TIMEOUT = (10, 60)  # (connect, read) seconds
+HOST_TIMEOUTS = {
+    # booking pages which are slow to render server-side get a longer read timeout
+    'omniplex.ie': (10, 90),
+    'empirecinemas.co.uk': (10, 90),
+    'admit-one.eu': (10, 90),
+    'tickets.dca.org.uk': (10, 90),
+    # json apis should answer quickly
+    'cineworld.co.uk': (5, 30),
+    'myvue.com': (5, 30),
+    'odeon.co.uk': (5, 30),
+    'curzon.com': (5, 30),
+}
+HEDGE_REQUESTS = False
+HEDGE_MIN_SAMPLES = 20  # latencies needed for a host before its p95 is trusted
+HEDGE_MIN_DELAY = 0.5  # never hedge a request sooner than this many seconds
+HEDGE_MAX_FRACTION = 0.1  # at most this fraction of GETs to a host are hedged
+
+# browser consts
+BROWSER_BLOCKED_URLS = [
+    # pages are only loaded for values in their HTML, so nothing they embed or report to is fetched
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.avif', '*.svg', '*.ico',
+    '*.mp4', '*.webm', '*.mp3',
+    '*.woff', '*.woff2', '*.ttf', '*.otf',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*facebook.net*', '*facebook.com/tr*',
+    '*hotjar.com*', '*optimizely.com*', '*onetrust.com*', '*cookielaw.org*', '*tiktok.com*', '*bing.com*',
+]
+BROWSER_WAIT_TIMEOUT = 30  # seconds to wait for a value to appear in a page
+BROWSER_POLL_INTERVAL = 0.1  # seconds between checks of the page for a value
+
+# distributed consts
+WORK_LEASE_TIMEOUT = 30 * 60  # seconds before a unit leased by a worker is assumed lost, and leased again
+WORK_MAX_ATTEMPTS = 3
+WORK_POLL_INTERVAL = 5  # seconds a waiting worker sleeps between checking the queue
+
+# metrics consts
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]  # seconds
+RUN_REPORTS_KEPT = 100  # the newest run reports kept in the data directory, older ones are deleted as new ones are written
+
+# profiling consts
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between stack samples for the collapsed-stack output
+PROFILE_DEFAULT_ALLOCATIONS = 25
+
+# parse consts
+STREAM_JSON_MIN_SIZE = 4 * 1024 * 1024  # bytes a JSON response needs to be streamed, smaller ones decode faster whole
+STREAM_CHUNK_SIZE = 64 * 1024  # bytes read from the network, or a spooled body, at a time
+
+# benchmark consts
+PARSE_BENCHMARK_SCALES = [1, 10, 100]
+PARSE_REGRESSION_THRESHOLD = 1.25  # a parse function this many times slower than its baseline is a regression
@@ -0,0 +1,82 @@
+import signal
+import threading
+import time
+import traceback
+from datetime import datetime
+
+import showingpreviously.cinema_directory as cinema_directory
+import showingpreviously.journal as journal
+import showingpreviously.metrics as metrics
+import showingpreviously.pipeline as pipeline
+import showingpreviously.requests as requests
+from showingpreviously.archiver import run_chain
+from showingpreviously.consts import DEFAULT_CHAIN_SCHEDULE, DAEMON_RETRY_INTERVAL
+from showingpreviously.model import ChainArchiver
+from showingpreviously.selenium import close_selenium_webdriver
+
+
+class ChainSchedule:
+    def __init__(self, chain: ChainArchiver, interval: float) -> None:
+        self.chain = chain
+        self.name = type(chain).__name__
+        self.interval = interval
+        self.next_run = time.time()
+
+
+class Daemon:
+    """Runs each chain on its own schedule in one long-lived process, so sessions, tokens, caches and the browser stay warm"""
+
+    def __init__(self, chains: [ChainArchiver], schedules: dict[str, float], dry_run: bool = False, prometheus: bool = False) -> None:
+        self.schedules = [ChainSchedule(chain, schedules.get(type(chain).__name__, DEFAULT_CHAIN_SCHEDULE)) for chain in chains]
+        self.dry_run = dry_run
+        self.prometheus = prometheus
+        self.stopping = threading.Event()
+
+    def stop(self, signal_number: int, frame: any) -> None:
+        # the chain being run is left to finish, so its showings and listing hashes are all written
+        log(f'Received {signal.Signals(signal_number).name}, stopping after the current chain')
+        self.stopping.set()
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        requests.set_keep_alive(True)
+        try:
+            while not self.stopping.is_set():
+                schedule = min(self.schedules, key=lambda s: s.next_run)
+                delay = schedule.next_run - time.time()
+                if delay > 0:
+                    self.stopping.wait(delay)
+                    continue
+                self.run_chain(schedule)
+        finally:
+            close_selenium_webdriver()
+            pipeline.close_parse_pool()
+            requests.close_host_sessions()
+            compacted = journal.close_journal()
+            if compacted is not None:
+                log(str(compacted))
+            log('Stopped')
+
+    def run_chain(self, schedule: ChainSchedule) -> None:
+        started = time.time()
+        log(f'Running {schedule.name}')
+        try:
+            run_chain(schedule.chain, self.dry_run)
+        except Exception:
+            log(f'{schedule.name} failed:\n{traceback.format_exc()}')
+            # a browser left broken by the failure is started again on the next run that needs it, and the cinemas discovered again
+            close_selenium_webdriver()
+            cinema_directory.invalidate(schedule.name)
+            schedule.next_run = started + min(schedule.interval, DAEMON_RETRY_INTERVAL)
+        else:
+            schedule.next_run = started + schedule.interval
+            log(f'Finished {schedule.name} in {time.time() - started:.1f}s')
+        # the metrics are kept for the life of the daemon, so the textfile's counters only ever go up
+        if self.prometheus:
+            metrics.write_prometheus_textfile()
+        log(f'Next run of {schedule.name} at {datetime.fromtimestamp(schedule.next_run):%Y-%m-%d %H:%M:%S}')
+
+
+def log(message: str) -> None:
+    print(f'{datetime.now():%Y-%m-%d %H:%M:%S} {message}', flush=True)
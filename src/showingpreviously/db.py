@@ -1,67 +1,599 @@
 import sqlite3
 import os
 import json
-from contextlib import closing
+import threading
+import time
+from contextlib import closing, contextmanager
 from datetime import datetime
+from typing import Optional, Iterator
+from urllib.request import pathname2url
 
-from showingpreviously.consts import DATA_DIR, DATABASE_NAME
+from showingpreviously.consts import DATA_DIR, DATABASE_NAME, DB_BUSY_TIMEOUT, DB_CACHE_SIZE, DB_MMAP_SIZE, MERGE_MAX_ATTACHED, MERGE_REBUILD_FRACTION, UNKNOWN_FILM_YEAR
+
+
+def set_pragmas(connection: sqlite3.Connection) -> None:
+    connection.execute(f'PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT * 1000)}')
+    connection.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE // 1024}')
+    connection.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+
+
+def connect(path: str) -> sqlite3.Connection:
+    # the archive is written from the archiver's threads, so the connection is shared and guarded by write_lock
+    connection = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+    # in WAL mode readers see a snapshot and never block the writer, and the writer never waits for readers
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('PRAGMA synchronous = NORMAL')
+    set_pragmas(connection)
+    return connection
+
+
+def get_connection() -> sqlite3.Connection:
+    # the archive is opened, and its schema created, on first use, so processes which only parse listings, like the parse
+    # pool's workers, never open it
+    global conn
+    with write_lock:
+        if conn is None:
+            conn = connect(database_location)
+            create_table()
+        return conn
+
+
+@contextmanager
+def read_connection() -> Iterator[sqlite3.Connection]:
+    if not os.path.exists(database_location):
+        # a read-only connection can't create the archive, so a fresh one is created by opening it for writing
+        get_connection()
+    uri = f'file:{pathname2url(database_location)}?mode=ro'
+    connection = sqlite3.connect(uri, uri=True, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+    try:
+        connection.execute('PRAGMA query_only = ON')
+        set_pragmas(connection)
+        yield connection
+    finally:
+        connection.close()
+
+
+@contextmanager
+def write_cursor() -> Iterator[sqlite3.Cursor]:
+    with write_lock, closing(get_connection().cursor()) as cur:
+        try:
+            yield cur
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+@contextmanager
+def durable_write_cursor() -> Iterator[sqlite3.Cursor]:
+    # the commit fsyncs the WAL, and with it every earlier commit, instead of leaving that to the next checkpoint
+    with write_lock:
+        get_connection().execute('PRAGMA synchronous = FULL')
+        try:
+            with write_cursor() as cur:
+                yield cur
+        finally:
+            conn.execute('PRAGMA synchronous = NORMAL')
 
 
 def add_chain(chain_name: str) -> None:
-    with closing(conn.cursor()) as cur:
+    with write_cursor() as cur:
         cur.execute('INSERT OR IGNORE INTO chains (name) values (?)', (chain_name,))
-    conn.commit()
 
 
 def add_cinema(chain_name: str, cinema_name: str, cinema_timezone: str) -> None:
     epoch_started_archiving = int(datetime.now().timestamp())
-    with closing(conn.cursor()) as cur:
+    with write_cursor() as cur:
         cur.execute('INSERT OR IGNORE INTO cinemas (chainName, name, timezone, utcStartedArchiving) values (?, ?, ?, ?)', (chain_name, cinema_name, cinema_timezone, epoch_started_archiving,))
-    conn.commit()
 
 
 def add_screen(chain_name: str, cinema_name: str, screen_name: str) -> None:
-    with closing(conn.cursor()) as cur:
+    with write_cursor() as cur:
         cur.execute('INSERT OR IGNORE INTO screens (chainName, cinemaName, name) values (?, ?, ?)', (chain_name, cinema_name, screen_name,))
-    conn.commit()
 
 
 def add_film(film_name: str, film_year: str) -> None:
-    with closing(conn.cursor()) as cur:
+    with write_cursor() as cur:
         cur.execute('INSERT OR IGNORE INTO films (name, year) values (?, ?)', (film_name, film_year,))
-    conn.commit()
 
 
-def add_showing(film_name: str, film_year: str, chain_name: str, cinema_name: str, screen_name: str, time: datetime, json_attributes: dict[str, any]) -> None:
+def add_film_alias(film_name: str, film_year: str, resolved_name: str, resolved_year: str, confidence: float) -> None:
+    with write_cursor() as cur:
+        cur.execute(
+            'INSERT OR REPLACE INTO filmAliases (filmName, filmYear, resolvedName, resolvedYear, confidence) values (?, ?, ?, ?, ?)',
+            (film_name, film_year, resolved_name, resolved_year, confidence,)
+        )
+
+
+def add_showing(film_name: str, film_year: str, chain_name: str, cinema_name: str, screen_name: str, time: datetime, json_attributes: dict[str, any]) -> bool:
+    # returns True if the showing is new, and False if it replaced the attributes of one already archived
     epoch_time = int(time.timestamp())
     json_attributes_string = json.dumps(json_attributes)
-    with closing(conn.cursor()) as cur:
+    with write_cursor() as cur:
         cur.execute(
-            'INSERT OR REPLACE INTO showings (filmName, filmYear, chainName, cinemaName, screenName, utcTime, jsonAttributes) values (?, ?, ?, ?, ?, ?, ?)',
+            'INSERT OR IGNORE INTO showings (filmName, filmYear, chainName, cinemaName, screenName, utcTime, jsonAttributes) values (?, ?, ?, ?, ?, ?, ?)',
             (film_name, film_year, chain_name, cinema_name, screen_name, epoch_time, json_attributes_string,)
         )
-    conn.commit()
+        inserted = cur.rowcount == 1
+        if not inserted:
+            cur.execute(
+                'UPDATE showings SET jsonAttributes = ? WHERE filmName = ? AND filmYear = ? AND chainName = ? AND cinemaName = ? AND screenName = ? AND utcTime = ?',
+                (json_attributes_string, film_name, film_year, chain_name, cinema_name, screen_name, epoch_time,)
+            )
+    return inserted
+
+
+def add_showings(rows: [(str, str, str, str, str, str, int, str)], durable: bool = False) -> (int, int):
+    # rows are (film name, film year, chain name, cinema name, cinema timezone, screen name, utc epoch, attributes JSON), and
+    # are written in one transaction in key order, so the inserts walk the showings B-tree instead of jumping around it
+    rows = sorted(rows, key=lambda row: (row[0], row[1], row[2], row[3], row[5], row[6]))
+    epoch_now = int(datetime.now().timestamp())
+    with durable_write_cursor() if durable else write_cursor() as cur:
+        cur.execute('BEGIN IMMEDIATE')
+        cur.executemany('INSERT OR IGNORE INTO chains (name) values (?)', sorted(set((row[2],) for row in rows)))
+        cur.executemany(
+            'INSERT OR IGNORE INTO cinemas (chainName, name, timezone, utcStartedArchiving) values (?, ?, ?, ?)',
+            sorted(set((row[2], row[3], row[4], epoch_now,) for row in rows))
+        )
+        cur.executemany('INSERT OR IGNORE INTO screens (chainName, cinemaName, name) values (?, ?, ?)', sorted(set((row[2], row[3], row[5],) for row in rows)))
+        cur.executemany('INSERT OR IGNORE INTO films (name, year) values (?, ?)', sorted(set((row[0], row[1],) for row in rows)))
+        cur.executemany(
+            'INSERT OR IGNORE INTO showings (filmName, filmYear, chainName, cinemaName, screenName, utcTime, jsonAttributes) values (?, ?, ?, ?, ?, ?, ?)',
+            [(row[0], row[1], row[2], row[3], row[5], row[6], row[7],) for row in rows]
+        )
+        inserted = cur.rowcount
+        # only showings whose attributes changed are updated, so the rollup triggers don't fire for the rest
+        cur.executemany(
+            'UPDATE showings SET jsonAttributes = ? WHERE filmName = ? AND filmYear = ? AND chainName = ? AND cinemaName = ? AND screenName = ? AND utcTime = ? '
+            'AND jsonAttributes != ?',
+            [(row[7], row[0], row[1], row[2], row[3], row[5], row[6], row[7],) for row in rows]
+        )
+    return inserted, len(rows) - inserted
+
+
+def get_showing_screen_name(film_name: str, film_year: str, chain_name: str, cinema_name: str, time: datetime) -> Optional[str]:
+    epoch_time = int(time.timestamp())
+    with read_connection() as read_conn, closing(read_conn.cursor()) as cur:
+        row = cur.execute(
+            'SELECT screenName FROM showings WHERE filmName = ? AND filmYear = ? AND chainName = ? AND cinemaName = ? AND utcTime = ? LIMIT 1',
+            (film_name, film_year, chain_name, cinema_name, epoch_time,)
+        ).fetchone()
+    return row[0] if row is not None else None
 
 
 def create_table() -> None:
-    with closing(conn.cursor()) as cur:
+    with write_cursor() as cur:
         cur.execute('CREATE TABLE IF NOT EXISTS chains (name TEXT, PRIMARY KEY (name))')
         cur.execute('CREATE TABLE IF NOT EXISTS cinemas (chainName TEXT, name TEXT, timezone TEXT, utcStartedArchiving INT, PRIMARY KEY (chainName, name), FOREIGN KEY (chainName) REFERENCES chains(name))')
         cur.execute('CREATE TABLE IF NOT EXISTS screens (chainName TEXT, cinemaName TEXT, name TEXT, PRIMARY KEY (chainName, cinemaName, name), FOREIGN KEY (chainName) REFERENCES cinemas (chainName), FOREIGN KEY (cinemaName) REFERENCES cinemas (name))')
         cur.execute('CREATE TABLE IF NOT EXISTS films (name TEXT, year TEXT, PRIMARY KEY (name, year))')
         cur.execute('CREATE TABLE IF NOT EXISTS showings (filmName TEXT, filmYear TEXT, chainName TEXT, cinemaName TEXT, screenName TEXT, utcTime INT, jsonAttributes TEXT, PRIMARY KEY (filmName, filmYear, chainName, cinemaName, screenName, utcTime), FOREIGN KEY (filmName) REFERENCES films (name), FOREIGN KEY (filmYear) REFERENCES films (year), FOREIGN KEY (chainName) REFERENCES screens (chainName), FOREIGN KEY (cinemaName) REFERENCES screens (cinemaName), FOREIGN KEY (screenName) REFERENCES screens (name))')
+        cur.execute('CREATE TABLE IF NOT EXISTS filmAliases (filmName TEXT, filmYear TEXT, resolvedName TEXT, resolvedYear TEXT, confidence REAL, PRIMARY KEY (filmName, filmYear), FOREIGN KEY (resolvedName) REFERENCES films (name), FOREIGN KEY (resolvedYear) REFERENCES films (year))')
+        cur.execute('CREATE TABLE IF NOT EXISTS listingHashes (chainName TEXT, listingKey TEXT, hash TEXT, utcFetched INT, PRIMARY KEY (chainName, listingKey))')
+        cur.execute('CREATE TABLE IF NOT EXISTS listingValidators (chainName TEXT, listingKey TEXT, etag TEXT, lastModified TEXT, utcFetched INT, PRIMARY KEY (chainName, listingKey))')
+        cur.execute('CREATE TABLE IF NOT EXISTS cinemaDirectories (directoryName TEXT, cinemaKey TEXT, cinemaName TEXT, timezone TEXT, utcFetched INT, PRIMARY KEY (directoryName, cinemaKey))')
+        cur.execute('CREATE INDEX IF NOT EXISTS showingsByTime ON showings (utcTime)')
+        create_partition_tables(cur)
+        create_stats_tables(cur)
+        create_rollup_tables(cur)
+
+
+def create_partition_tables(cur: sqlite3.Cursor) -> None:
+    # months of showings that have been compacted out of the archive into their own read-only database files
+    cur.execute('CREATE TABLE IF NOT EXISTS partitions (month TEXT, path TEXT, showingCount INT, utcCompacted INT, PRIMARY KEY (month))')
+    cur.execute('CREATE TABLE IF NOT EXISTS partitionChainStats (month TEXT, chainName TEXT, showingCount INT, earliestUtcTime INT, latestUtcTime INT, PRIMARY KEY (month, chainName))')
+
+
+def create_stats_tables(cur: sqlite3.Cursor) -> None:
+    # the stats tables are kept up to date by triggers as rows are written, so reading them never scans the archive
+    cur.execute('CREATE TABLE IF NOT EXISTS tableCounts (name TEXT, count INT, PRIMARY KEY (name))')
+    cur.execute('CREATE TABLE IF NOT EXISTS chainStats (chainName TEXT, showingCount INT, earliestUtcTime INT, latestUtcTime INT, utcLastSuccessfulRun INT, PRIMARY KEY (chainName))')
+    for table in COUNTED_TABLES:
+        cur.execute(f'CREATE TRIGGER IF NOT EXISTS {table}CountInsert AFTER INSERT ON {table} BEGIN UPDATE tableCounts SET count = count + 1 WHERE name = \'{table}\'; END')
+        cur.execute(f'CREATE TRIGGER IF NOT EXISTS {table}CountDelete AFTER DELETE ON {table} BEGIN UPDATE tableCounts SET count = count - 1 WHERE name = \'{table}\'; END')
+    cur.execute(
+        'CREATE TRIGGER IF NOT EXISTS showingsChainStatsInsert AFTER INSERT ON showings BEGIN '
+        'INSERT INTO chainStats (chainName, showingCount, earliestUtcTime, latestUtcTime) VALUES (NEW.chainName, 1, NEW.utcTime, NEW.utcTime) '
+        'ON CONFLICT (chainName) DO UPDATE SET showingCount = showingCount + 1, earliestUtcTime = MIN(earliestUtcTime, excluded.earliestUtcTime), latestUtcTime = MAX(latestUtcTime, excluded.latestUtcTime); '
+        'END'
+    )
+    cur.execute('CREATE TRIGGER IF NOT EXISTS showingsChainStatsDelete AFTER DELETE ON showings BEGIN UPDATE chainStats SET showingCount = showingCount - 1 WHERE chainName = OLD.chainName; END')
+    counted = cur.execute('SELECT COUNT(*) FROM tableCounts').fetchone()[0]
+    if counted < len(COUNTED_TABLES):
+        recount_stats_with_cursor(cur)
+
+
+def create_rollup_tables(cur: sqlite3.Cursor) -> None:
+    # daily rollups per UTC day, chain, cinema and film, kept up to date by triggers so analytics never scan showings
+    cur.execute('CREATE TABLE IF NOT EXISTS dailyShowings (utcDay TEXT, chainName TEXT, cinemaName TEXT, filmName TEXT, filmYear TEXT, showingCount INT, PRIMARY KEY (utcDay, chainName, cinemaName, filmName, filmYear))')
+    cur.execute('CREATE TABLE IF NOT EXISTS dailyScreens (utcDay TEXT, chainName TEXT, cinemaName TEXT, filmName TEXT, filmYear TEXT, screenName TEXT, showingCount INT, PRIMARY KEY (utcDay, chainName, cinemaName, filmName, filmYear, screenName))')
+    cur.execute('CREATE TABLE IF NOT EXISTS dailyAttributes (utcDay TEXT, chainName TEXT, cinemaName TEXT, filmName TEXT, filmYear TEXT, attribute TEXT, showingCount INT, PRIMARY KEY (utcDay, chainName, cinemaName, filmName, filmYear, attribute))')
+    cur.execute(
+        'CREATE TRIGGER IF NOT EXISTS showingsRollupInsert AFTER INSERT ON showings BEGIN '
+        f'{get_rollup_increment_sql("NEW")} '
+        'END'
+    )
+    cur.execute(
+        'CREATE TRIGGER IF NOT EXISTS showingsRollupDelete AFTER DELETE ON showings BEGIN '
+        f'{get_rollup_decrement_sql("OLD", True)} '
+        'END'
+    )
+    cur.execute(
+        'CREATE TRIGGER IF NOT EXISTS showingsRollupUpdate AFTER UPDATE OF jsonAttributes ON showings WHEN OLD.jsonAttributes IS NOT NEW.jsonAttributes BEGIN '
+        f'{get_rollup_decrement_sql("OLD", False)} '
+        f'{get_rollup_increment_sql("NEW", False)} '
+        'END'
+    )
+    has_rollups = cur.execute('SELECT EXISTS (SELECT 1 FROM dailyShowings)').fetchone()[0]
+    has_showings = cur.execute('SELECT EXISTS (SELECT 1 FROM showings)').fetchone()[0]
+    if has_showings and not has_rollups:
+        rebuild_rollups_with_cursor(cur)
+
+
+def get_attribute_labels_sql(json_attributes: str) -> str:
+    # an attribute is counted as its key if it is true, and as key=value for each string or list item value
+    return (
+        f'SELECT key AS attribute FROM json_each({json_attributes}) WHERE type = \'true\' '
+        f'UNION ALL SELECT key || \'=\' || value FROM json_each({json_attributes}) WHERE type IN (\'text\', \'integer\', \'real\') '
+        f'UNION ALL SELECT a.key || \'=\' || f.value FROM json_each({json_attributes}) a, json_each(a.value) f WHERE a.type = \'array\''
+    )
+
+
+def get_rollup_increment_sql(row: str, with_showings: bool = True) -> str:
+    day = f'date({row}.utcTime, \'unixepoch\')'
+    key_values = f'{day}, {row}.chainName, {row}.cinemaName, {row}.filmName, {row}.filmYear'
+    key_columns = 'utcDay, chainName, cinemaName, filmName, filmYear'
+    statements = []
+    if with_showings:
+        statements.append(f'INSERT INTO dailyShowings ({key_columns}, showingCount) VALUES ({key_values}, 1) ON CONFLICT DO UPDATE SET showingCount = showingCount + 1;')
+        statements.append(f'INSERT INTO dailyScreens ({key_columns}, screenName, showingCount) VALUES ({key_values}, {row}.screenName, 1) ON CONFLICT DO UPDATE SET showingCount = showingCount + 1;')
+    statements.append(
+        f'INSERT INTO dailyAttributes ({key_columns}, attribute, showingCount) SELECT {key_values}, attribute, 1 FROM ({get_attribute_labels_sql(f"{row}.jsonAttributes")}) WHERE true '
+        'ON CONFLICT DO UPDATE SET showingCount = showingCount + 1;'
+    )
+    return ' '.join(statements)
+
+
+def get_rollup_decrement_sql(row: str, with_showings: bool = True) -> str:
+    key_match = f'utcDay = date({row}.utcTime, \'unixepoch\') AND chainName = {row}.chainName AND cinemaName = {row}.cinemaName AND filmName = {row}.filmName AND filmYear = {row}.filmYear'
+    statements = []
+    if with_showings:
+        statements.append(f'UPDATE dailyShowings SET showingCount = showingCount - 1 WHERE {key_match};')
+        statements.append(f'DELETE FROM dailyShowings WHERE {key_match} AND showingCount <= 0;')
+        statements.append(f'UPDATE dailyScreens SET showingCount = showingCount - 1 WHERE {key_match} AND screenName = {row}.screenName;')
+        statements.append(f'DELETE FROM dailyScreens WHERE {key_match} AND screenName = {row}.screenName AND showingCount <= 0;')
+    statements.append(f'UPDATE dailyAttributes SET showingCount = showingCount - 1 WHERE {key_match} AND attribute IN ({get_attribute_labels_sql(f"{row}.jsonAttributes")});')
+    statements.append(f'DELETE FROM dailyAttributes WHERE {key_match} AND showingCount <= 0;')
+    return ' '.join(statements)
+
+
+def insert_rollups(cur: sqlite3.Cursor, source_table: str, condition: str, parameters: tuple = ()) -> None:
+    key_columns = 'utcDay, chainName, cinemaName, filmName, filmYear'
+    key_values = 'date(utcTime, \'unixepoch\'), chainName, cinemaName, filmName, filmYear'
+    cur.execute(f'INSERT INTO dailyShowings ({key_columns}, showingCount) SELECT {key_values}, COUNT(*) FROM {source_table} WHERE {condition} GROUP BY {key_values}', parameters)
+    cur.execute(f'INSERT INTO dailyScreens ({key_columns}, screenName, showingCount) SELECT {key_values}, screenName, COUNT(*) FROM {source_table} WHERE {condition} GROUP BY {key_values}, screenName', parameters)
+    labels = (
+        f'SELECT {key_values}, a.key AS attribute FROM {source_table} s, json_each(s.jsonAttributes) a WHERE a.type = \'true\' AND {condition} '
+        f'UNION ALL SELECT {key_values}, a.key || \'=\' || a.value FROM {source_table} s, json_each(s.jsonAttributes) a WHERE a.type IN (\'text\', \'integer\', \'real\') AND {condition} '
+        f'UNION ALL SELECT {key_values}, a.key || \'=\' || f.value FROM {source_table} s, json_each(s.jsonAttributes) a, json_each(a.value) f WHERE a.type = \'array\' AND {condition}'
+    )
+    cur.execute(f'INSERT INTO dailyAttributes ({key_columns}, attribute, showingCount) SELECT *, COUNT(*) FROM ({labels}) GROUP BY 1, 2, 3, 4, 5, 6', parameters * 3)
+
+
+def rebuild_rollups_with_cursor(cur: sqlite3.Cursor) -> None:
+    # the days of cold partitions are rebuilt when they are compacted, so only those still in the showings table are rebuilt here
+    for table in ['dailyShowings', 'dailyScreens', 'dailyAttributes']:
+        cur.execute(f'DELETE FROM {table} WHERE substr(utcDay, 1, 7) NOT IN (SELECT month FROM partitions)')
+    insert_rollups(cur, 'showings', 'strftime(\'%Y-%m\', utcTime, \'unixepoch\') NOT IN (SELECT month FROM partitions)')
+
+
+def rebuild_rollups() -> None:
+    with write_cursor() as cur:
+        rebuild_rollups_with_cursor(cur)
+
+
+def recount_stats_with_cursor(cur: sqlite3.Cursor) -> None:
+    for table in COUNTED_TABLES:
+        cur.execute(f'INSERT OR REPLACE INTO tableCounts (name, count) SELECT ?, COUNT(*) FROM {table}', (table,))
+    # showings moved into cold partitions are still part of the archive
+    cur.execute('UPDATE tableCounts SET count = count + (SELECT COALESCE(SUM(showingCount), 0) FROM partitionChainStats) WHERE name = \'showings\'')
+    cur.execute('UPDATE chainStats SET showingCount = 0, earliestUtcTime = NULL, latestUtcTime = NULL')
+    cur.execute(
+        'INSERT INTO chainStats (chainName, showingCount, earliestUtcTime, latestUtcTime) '
+        'SELECT chainName, SUM(showingCount), MIN(earliestUtcTime), MAX(latestUtcTime) FROM ('
+        'SELECT chainName, COUNT(*) AS showingCount, MIN(utcTime) AS earliestUtcTime, MAX(utcTime) AS latestUtcTime FROM showings GROUP BY chainName '
+        'UNION ALL SELECT chainName, showingCount, earliestUtcTime, latestUtcTime FROM partitionChainStats) WHERE true GROUP BY chainName '
+        'ON CONFLICT (chainName) DO UPDATE SET showingCount = excluded.showingCount, earliestUtcTime = excluded.earliestUtcTime, latestUtcTime = excluded.latestUtcTime'
+    )
+
+
+def recount_stats() -> None:
+    with write_cursor() as cur:
+        recount_stats_with_cursor(cur)
+
+
+def record_chain_run(chain_name: str) -> None:
+    epoch_now = int(datetime.now().timestamp())
+    with write_cursor() as cur:
+        cur.execute(
+            'INSERT INTO chainStats (chainName, showingCount, utcLastSuccessfulRun) VALUES (?, 0, ?) '
+            'ON CONFLICT (chainName) DO UPDATE SET utcLastSuccessfulRun = excluded.utcLastSuccessfulRun',
+            (chain_name, epoch_now,)
+        )
+
+
+def get_listing_hashes(chain_name: str) -> dict[str, str]:
+    with read_connection() as read_conn, closing(read_conn.cursor()) as cur:
+        return dict(cur.execute('SELECT listingKey, hash FROM listingHashes WHERE chainName = ?', (chain_name,)).fetchall())
+
+
+def set_listing_hashes(chain_name: str, hashes: dict[str, str]) -> None:
+    epoch_now = int(datetime.now().timestamp())
+    with write_cursor() as cur:
+        cur.executemany(
+            'INSERT OR REPLACE INTO listingHashes (chainName, listingKey, hash, utcFetched) values (?, ?, ?, ?)',
+            [(chain_name, listing_key, listing_hash, epoch_now,) for listing_key, listing_hash in hashes.items()]
+        )
+
+
+def get_listing_validators(chain_name: str) -> dict[str, (Optional[str], Optional[str])]:
+    with read_connection() as read_conn, closing(read_conn.cursor()) as cur:
+        rows = cur.execute('SELECT listingKey, etag, lastModified FROM listingValidators WHERE chainName = ?', (chain_name,)).fetchall()
+    return {listing_key: (etag, last_modified) for listing_key, etag, last_modified in rows}
+
+
+def set_listing_validators(chain_name: str, validators: dict[str, (Optional[str], Optional[str])]) -> None:
+    epoch_now = int(datetime.now().timestamp())
+    with write_cursor() as cur:
+        cur.executemany(
+            'INSERT OR REPLACE INTO listingValidators (chainName, listingKey, etag, lastModified, utcFetched) values (?, ?, ?, ?, ?)',
+            [(chain_name, listing_key, etag, last_modified, epoch_now,) for listing_key, (etag, last_modified) in validators.items()]
+        )
+
+
+def get_cinema_directory(directory_name: str) -> (Optional[int], [(str, str, str)]):
+    with read_connection() as read_conn, closing(read_conn.cursor()) as cur:
+        rows = cur.execute('SELECT cinemaKey, cinemaName, timezone, utcFetched FROM cinemaDirectories WHERE directoryName = ?', (directory_name,)).fetchall()
+    if len(rows) == 0:
+        return None, []
+    return min(row[3] for row in rows), [(cinema_key, cinema_name, timezone) for cinema_key, cinema_name, timezone, _ in rows]
+
+
+def set_cinema_directory(directory_name: str, cinemas: [(str, str, str)]) -> None:
+    # the whole directory is replaced, so cinemas which have closed drop out of it
+    epoch_now = int(datetime.now().timestamp())
+    with write_cursor() as cur:
+        cur.execute('BEGIN IMMEDIATE')
+        cur.execute('DELETE FROM cinemaDirectories WHERE directoryName = ?', (directory_name,))
+        cur.executemany(
+            'INSERT INTO cinemaDirectories (directoryName, cinemaKey, cinemaName, timezone, utcFetched) values (?, ?, ?, ?, ?)',
+            [(directory_name, cinema_key, cinema_name, timezone, epoch_now,) for cinema_key, cinema_name, timezone in cinemas]
+        )
+
+
+def clear_cinema_directory(directory_name: Optional[str] = None) -> None:
+    with write_cursor() as cur:
+        if directory_name is None:
+            cur.execute('DELETE FROM cinemaDirectories')
+        else:
+            cur.execute('DELETE FROM cinemaDirectories WHERE directoryName = ?', (directory_name,))
+
+
+def use_database(path: str) -> None:
+    # workers write to their own shard database, in the same schema as the archive
+    global conn, database_location
+    with write_lock:
+        if conn is not None:
+            conn.close()
+        database_location = path
+        conn = None
+        get_connection()
+
+
+class MergeException(Exception):
+    pass
+
+
+class MergeResult:
+    def __init__(self, sources: [str]) -> None:
+        self.sources = sources
+        self.rows: dict[str, int] = {table: 0 for table in MERGED_TABLES}
+        self.seconds = 0.0
+        self.rebuilt_stats = False
+
+    def __repr__(self) -> str:
+        total = sum(self.rows.values())
+        rows = ', '.join([f'{count} {table}' for table, count in self.rows.items()])
+        return f'Merged {len(self.sources)} databases in {self.seconds:.1f}s: {rows} ({total / max(self.seconds, 1e-9):,.0f} rows/s)'
+
+
+def get_source_tables(cur: sqlite3.Cursor, source: str) -> dict[str, set[str]]:
+    tables = [row[0] for row in cur.execute(f'SELECT name FROM {source}.sqlite_master WHERE type = \'table\'').fetchall()]
+    return {table: set(row[1] for row in cur.execute(f'PRAGMA {source}.table_info({table})').fetchall()) for table in tables}
+
+
+def check_source(cur: sqlite3.Cursor, source: str, path: str) -> None:
+    source_tables = get_source_tables(cur, source)
+    for table, columns in MERGED_TABLES.items():
+        if table not in source_tables:
+            if table in OPTIONAL_MERGED_TABLES:
+                continue
+            raise MergeException(f'"{path}" has no {table} table')
+        missing = set(columns.split(', ')) - source_tables[table]
+        if missing:
+            raise MergeException(f'The {table} table of "{path}" is missing the columns {", ".join(sorted(missing))}')
+    # every row must refer to rows which are either in the source or already in the archive
+    for table, referenced_table, match in MERGE_REFERENCES:
+        orphans = cur.execute(
+            f'SELECT COUNT(*) FROM {source}.{table} r WHERE NOT EXISTS (SELECT 1 FROM {source}.{referenced_table} d WHERE {match}) '
+            f'AND NOT EXISTS (SELECT 1 FROM main.{referenced_table} d WHERE {match})'
+        ).fetchone()[0]
+        if orphans > 0:
+            raise MergeException(f'{orphans} {table} rows in "{path}" refer to {referenced_table} which are in neither database')
+
+
+def check_merged(cur: sqlite3.Cursor, source: str, path: str) -> None:
+    missing = cur.execute(
+        f'SELECT COUNT(*) FROM {source}.showings r WHERE NOT EXISTS (SELECT 1 FROM main.showings d WHERE {SHOWING_KEY_MATCH})'
+    ).fetchone()[0]
+    if missing > 0:
+        raise MergeException(f'{missing} showings of "{path}" are not in the archive after merging')
+
+
+def drop_stats_triggers(cur: sqlite3.Cursor) -> None:
+    table_names = ', '.join([f'\'{table}\'' for table in COUNTED_TABLES])
+    for trigger_name, in cur.execute(f'SELECT name FROM main.sqlite_master WHERE type = \'trigger\' AND tbl_name IN ({table_names})').fetchall():
+        cur.execute(f'DROP TRIGGER {trigger_name}')
+
+
+def merge_sources(cur: sqlite3.Cursor, sources: [(str, str)], result: MergeResult) -> None:
+    for source, path in sources:
+        check_source(cur, source, path)
+    # only showings the archive doesn't have yet count, so merging the same source again never rebuilds the stats
+    new_showings = sum(cur.execute(
+        f'SELECT COUNT(*) FROM {source}.showings r WHERE NOT EXISTS (SELECT 1 FROM main.showings d WHERE {SHOWING_KEY_MATCH})'
+    ).fetchone()[0] for source, _ in sources)
+    archive_showings = cur.execute('SELECT count FROM tableCounts WHERE name = \'showings\'').fetchone()[0]
+    # triggers update the stats row by row, which is slower than counting again once a merge is large enough
+    rebuild_stats = new_showings > archive_showings * MERGE_REBUILD_FRACTION
+    if rebuild_stats:
+        drop_stats_triggers(cur)
+    for source, path in sources:
+        source_tables = get_source_tables(cur, source)
+        for table, columns in MERGED_TABLES.items():
+            if table not in source_tables:
+                continue
+            cur.execute(f'INSERT INTO main.{table} ({columns}) SELECT {columns} FROM {source}.{table} WHERE true ON CONFLICT {MERGE_CONFLICTS[table]}')
+            result.rows[table] += max(cur.rowcount, 0)
+        if 'chainStats' in source_tables:
+            cur.execute(
+                f'INSERT INTO main.chainStats (chainName, showingCount, utcLastSuccessfulRun) '
+                f'SELECT chainName, 0, utcLastSuccessfulRun FROM {source}.chainStats WHERE utcLastSuccessfulRun IS NOT NULL '
+                'ON CONFLICT (chainName) DO UPDATE SET utcLastSuccessfulRun = MAX(COALESCE(utcLastSuccessfulRun, 0), excluded.utcLastSuccessfulRun)'
+            )
+        check_merged(cur, source, path)
+    if rebuild_stats:
+        create_stats_tables(cur)
+        create_rollup_tables(cur)
+        recount_stats_with_cursor(cur)
+        rebuild_rollups_with_cursor(cur)
+        result.rebuilt_stats = True
+
+
+def merge_databases(paths: [str]) -> MergeResult:
+    # each batch of sources is attached and merged in one transaction, so a failed check leaves the archive as it was
+    result = MergeResult(paths)
+    started = time.perf_counter()
+    for batch_start in range(0, len(paths), MERGE_MAX_ATTACHED):
+        batch = [(f'source{i}', path) for i, path in enumerate(paths[batch_start:batch_start + MERGE_MAX_ATTACHED])]
+        with write_lock:
+            for source, path in batch:
+                if not os.path.exists(path):
+                    raise MergeException(f'"{path}" does not exist')
+                get_connection().execute(f'ATTACH DATABASE ? AS {source}', (path,))
+            try:
+                with write_cursor() as cur:
+                    cur.execute('BEGIN IMMEDIATE')
+                    merge_sources(cur, batch, result)
+            finally:
+                for source, _ in batch:
+                    conn.execute(f'DETACH DATABASE {source}')
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def db_info() -> (int, int, int, int, int):
+    with read_connection() as read_conn, closing(read_conn.cursor()) as cur:
+        counts = dict(cur.execute('SELECT name, count FROM tableCounts').fetchall())
+    return tuple(counts.get(table, 0) for table in COUNTED_TABLES)
+
+
+def chain_info() -> [(str, int, Optional[datetime], Optional[datetime], Optional[datetime])]:
+    with read_connection() as read_conn, closing(read_conn.cursor()) as cur:
+        rows = cur.execute('SELECT chainName, showingCount, earliestUtcTime, latestUtcTime, utcLastSuccessfulRun FROM chainStats ORDER BY chainName').fetchall()
+    return [(chain_name, showing_count, from_epoch(earliest), from_epoch(latest), from_epoch(last_run)) for chain_name, showing_count, earliest, latest, last_run in rows]
+
+
+def get_known_films() -> [(str, str)]:
+    with read_connection() as read_conn, closing(read_conn.cursor()) as cur:
+        return cur.execute('SELECT name, year FROM films WHERE year != ?', (UNKNOWN_FILM_YEAR,)).fetchall()
+
+
+def get_unknown_year_films() -> [(str, Optional[datetime])]:
+    # each film of unknown year, with the time of its latest showing
+    with read_connection() as read_conn, closing(read_conn.cursor()) as cur:
+        rows = cur.execute(
+            'SELECT f.name, (SELECT MAX(s.utcTime) FROM showings s WHERE s.filmName = f.name AND s.filmYear = f.year) FROM films f WHERE f.year = ?',
+            (UNKNOWN_FILM_YEAR,)
+        ).fetchall()
+    return [(film_name, from_epoch(latest)) for film_name, latest in rows]
+
+
+def get_rollup_filter(start_day: str, end_day: str, chain_name: Optional[str], cinema_name: Optional[str]) -> (str, tuple):
+    conditions = ['utcDay >= ?', 'utcDay <= ?']
+    parameters = [start_day, end_day]
+    if chain_name is not None:
+        conditions.append('chainName = ?')
+        parameters.append(chain_name)
+    if cinema_name is not None:
+        conditions.append('cinemaName = ?')
+        parameters.append(cinema_name)
+    return ' AND '.join(conditions), tuple(parameters)
+
+
+def daily_showings(start_day: str, end_day: str, chain_name: Optional[str] = None, cinema_name: Optional[str] = None) -> [(str, str, str, str, str, int, int)]:
+    # days are UTC dates as YYYY-MM-DD, and each row is a day, chain, cinema, film, year, showing count and screen count
+    conditions, parameters = get_rollup_filter(start_day, end_day, chain_name, cinema_name)
+    with read_connection() as read_conn, closing(read_conn.cursor()) as cur:
+        return cur.execute(
+            'SELECT s.utcDay, s.chainName, s.cinemaName, s.filmName, s.filmYear, s.showingCount, '
+            '(SELECT COUNT(*) FROM dailyScreens d WHERE d.utcDay = s.utcDay AND d.chainName = s.chainName AND d.cinemaName = s.cinemaName AND d.filmName = s.filmName AND d.filmYear = s.filmYear) '
+            f'FROM dailyShowings s WHERE {conditions} ORDER BY s.utcDay, s.chainName, s.cinemaName, s.showingCount DESC',
+            parameters
+        ).fetchall()
+
+
+def daily_attributes(start_day: str, end_day: str, chain_name: Optional[str] = None, cinema_name: Optional[str] = None) -> [(str, int)]:
+    # the number of showings with each attribute over the days, most common first
+    conditions, parameters = get_rollup_filter(start_day, end_day, chain_name, cinema_name)
+    with read_connection() as read_conn, closing(read_conn.cursor()) as cur:
+        return cur.execute(
+            f'SELECT attribute, SUM(showingCount) FROM dailyAttributes WHERE {conditions} GROUP BY attribute ORDER BY 2 DESC, 1',
+            parameters
+        ).fetchall()
 
 
-def db_info() -> (int, int, int, int):
-    with closing(conn.cursor()) as cur:
-        chains_count = cur.execute('SELECT COUNT(*) FROM chains').fetchone()[0]
-        cinema_count = cur.execute('SELECT COUNT(*) FROM cinemas').fetchone()[0]
-        screen_count = cur.execute('SELECT COUNT(*) FROM screens').fetchone()[0]
-        film_count = cur.execute('SELECT COUNT(*) FROM films').fetchone()[0]
-        showing_count = cur.execute('SELECT COUNT(*) FROM showings').fetchone()[0]
-    return chains_count, cinema_count, screen_count, film_count, showing_count
+def from_epoch(epoch: Optional[int]) -> Optional[datetime]:
+    return datetime.fromtimestamp(epoch) if epoch is not None else None
 
 
+COUNTED_TABLES = ['chains', 'cinemas', 'screens', 'films', 'showings']
+MERGED_TABLES = {
+    'chains': 'name',
+    'cinemas': 'chainName, name, timezone, utcStartedArchiving',
+    'screens': 'chainName, cinemaName, name',
+    'films': 'name, year',
+    'showings': 'filmName, filmYear, chainName, cinemaName, screenName, utcTime, jsonAttributes',
+    'filmAliases': 'filmName, filmYear, resolvedName, resolvedYear, confidence',
+}
+OPTIONAL_MERGED_TABLES = ['filmAliases']
+# showings have no time they were fetched, so a source's attributes replace the archive's, and sources merged later replace
+# those merged earlier. sources should be given oldest first
+MERGE_CONFLICTS = {
+    'chains': 'DO NOTHING',
+    'cinemas': 'DO UPDATE SET utcStartedArchiving = excluded.utcStartedArchiving WHERE excluded.utcStartedArchiving < utcStartedArchiving',
+    'screens': 'DO NOTHING',
+    'films': 'DO NOTHING',
+    'showings': 'DO UPDATE SET jsonAttributes = excluded.jsonAttributes WHERE jsonAttributes IS NOT excluded.jsonAttributes',
+    'filmAliases': 'DO UPDATE SET resolvedName = excluded.resolvedName, resolvedYear = excluded.resolvedYear, confidence = excluded.confidence WHERE excluded.confidence > confidence',
+}
+SHOWING_KEY_MATCH = 'd.filmName = r.filmName AND d.filmYear = r.filmYear AND d.chainName = r.chainName AND d.cinemaName = r.cinemaName AND d.screenName = r.screenName AND d.utcTime = r.utcTime'
+MERGE_REFERENCES = [
+    ('cinemas', 'chains', 'd.name = r.chainName'),
+    ('screens', 'cinemas', 'd.chainName = r.chainName AND d.name = r.cinemaName'),
+    ('showings', 'screens', 'd.chainName = r.chainName AND d.cinemaName = r.cinemaName AND d.name = r.screenName'),
+    ('showings', 'films', 'd.name = r.filmName AND d.year = r.filmYear'),
+]
 database_location = os.path.join(DATA_DIR, DATABASE_NAME)
-conn = sqlite3.connect(database_location)
-create_table()
+write_lock = threading.RLock()
+conn: Optional[sqlite3.Connection] = None
@@ -0,0 +1,158 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+from datetime import datetime
+from typing import Optional
+
+import showingpreviously.listings as listings
+import showingpreviously.response_archive as response_archive
+from showingpreviously.archiver import all_cinema_chains, process_showing
+from showingpreviously.consts import DB_BUSY_TIMEOUT, WORK_LEASE_TIMEOUT, WORK_MAX_ATTEMPTS, WORK_POLL_INTERVAL
+from showingpreviously.db import use_database, merge_databases, record_chain_run, MergeResult
+from showingpreviously.model import ChainArchiver
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class WorkQueue:
+    """Chain work units in a SQLite file shared between a coordinator and its workers, which lease units one at a time"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # autocommit, so each lease can be its own immediate transaction
+        self.conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS units (id INTEGER PRIMARY KEY, runId TEXT, chainName TEXT, unit TEXT, state TEXT, worker TEXT, attempts INT, '
+            'utcLeased INT, utcFinished INT, showingCount INT, archivedChains TEXT, error TEXT, UNIQUE (runId, chainName, unit))'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS unitsByState ON units (state, id)')
+
+    def enqueue(self, run_id: str, chain_name: str, units: [str]) -> None:
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO units (runId, chainName, unit, state, attempts) VALUES (?, ?, ?, ?, 0)',
+            [(run_id, chain_name, unit, QUEUED,) for unit in units]
+        )
+        self.conn.execute('COMMIT')
+
+    def lease(self, worker_id: str) -> Optional[tuple[int, str, str]]:
+        # a unit whose worker has held it too long is assumed lost, and is leased again until it runs out of attempts, so a
+        # unit that kills every worker it runs on fails rather than being retried forever
+        epoch_now = int(time.time())
+        expired = epoch_now - WORK_LEASE_TIMEOUT
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.execute(
+                'UPDATE units SET state = ?, error = ? WHERE state = ? AND utcLeased < ? AND attempts >= ?',
+                (FAILED, 'Lease expired on the last attempt', RUNNING, expired, WORK_MAX_ATTEMPTS,)
+            )
+            row = self.conn.execute(
+                'UPDATE units SET state = ?, worker = ?, utcLeased = ?, attempts = attempts + 1 WHERE id = ('
+                'SELECT id FROM units WHERE state = ? OR (state = ? AND utcLeased < ? AND attempts < ?) ORDER BY id LIMIT 1) RETURNING id, chainName, unit',
+                (RUNNING, worker_id, epoch_now, QUEUED, RUNNING, expired, WORK_MAX_ATTEMPTS,)
+            ).fetchone()
+        finally:
+            self.conn.execute('COMMIT')
+        return row
+
+    def finish(self, unit_id: int, showing_count: int, archived_chains: [str]) -> None:
+        self.conn.execute(
+            'UPDATE units SET state = ?, utcFinished = ?, showingCount = ?, archivedChains = ?, error = NULL WHERE id = ?',
+            (DONE, int(time.time()), showing_count, json.dumps(archived_chains), unit_id,)
+        )
+
+    def fail(self, unit_id: int, error: str) -> None:
+        # failed units are queued again until they run out of attempts
+        self.conn.execute(
+            'UPDATE units SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ? WHERE id = ?',
+            (WORK_MAX_ATTEMPTS, FAILED, QUEUED, error, unit_id,)
+        )
+
+    def has_pending(self) -> bool:
+        return self.conn.execute('SELECT EXISTS (SELECT 1 FROM units WHERE state IN (?, ?))', (QUEUED, RUNNING,)).fetchone()[0] == 1
+
+    def get_latest_run_id(self) -> Optional[str]:
+        row = self.conn.execute('SELECT runId FROM units ORDER BY id DESC LIMIT 1').fetchone()
+        return row[0] if row is not None else None
+
+    def get_counts(self, run_id: str) -> dict[str, int]:
+        return dict(self.conn.execute('SELECT state, COUNT(*) FROM units WHERE runId = ? GROUP BY state', (run_id,)).fetchall())
+
+    def get_archived_chains(self, run_id: str) -> [str]:
+        # the chain names in the archive of each chain whose units all finished
+        rows = self.conn.execute(
+            'SELECT archivedChains FROM units WHERE runId = ? AND chainName NOT IN (SELECT chainName FROM units WHERE runId = ? AND state != ?)',
+            (run_id, run_id, DONE,)
+        ).fetchall()
+        return sorted(set(chain_name for archived_chains, in rows for chain_name in json.loads(archived_chains)))
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def get_chains(chain_names: Optional[list[str]] = None) -> [ChainArchiver]:
+    return [cinema_chain for cinema_chain in all_cinema_chains if not chain_names or type(cinema_chain).__name__ in chain_names]
+
+
+def distribute(queue: WorkQueue, chain_names: Optional[list[str]] = None) -> (str, int, [(str, Exception)]):
+    run_id = datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
+    unit_count = 0
+    failures = []
+    for cinema_chain in get_chains(chain_names):
+        chain_name = type(cinema_chain).__name__
+        try:
+            units = cinema_chain.get_work_units()
+        except Exception as e:
+            failures.append((chain_name, e))
+            continue
+        queue.enqueue(run_id, chain_name, units)
+        unit_count += len(units)
+    return run_id, unit_count, failures
+
+
+def get_worker_id() -> str:
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def work(queue: WorkQueue, shard_path: str, worker_id: Optional[str] = None, wait: bool = False) -> (int, int):
+    worker_id = worker_id or get_worker_id()
+    use_database(shard_path)
+    # a shard can't see the hashes or responses in the main archive, so workers always parse, and don't archive responses
+    listings.set_force(True)
+    response_archive.set_enabled(False)
+    chains = {type(cinema_chain).__name__: cinema_chain for cinema_chain in all_cinema_chains}
+    units_done = units_failed = 0
+    while True:
+        leased = queue.lease(worker_id)
+        if leased is None:
+            # units leased by other workers are queued again if those workers are lost
+            if wait and queue.has_pending():
+                time.sleep(WORK_POLL_INTERVAL)
+                continue
+            return units_done, units_failed
+        unit_id, chain_name, unit = leased
+        try:
+            showings = chains[chain_name].get_unit_showings(unit)
+            for showing in showings:
+                process_showing(showing)
+        except Exception as e:
+            queue.fail(unit_id, repr(e))
+            units_failed += 1
+            continue
+        queue.finish(unit_id, len(showings), sorted(set(showing.chain.name for showing in showings)))
+        units_done += 1
+
+
+def collect(queue: WorkQueue, shard_paths: [str], run_id: Optional[str] = None) -> (str, dict[str, int], MergeResult):
+    merge_result = merge_databases(shard_paths)
+    run_id = run_id or queue.get_latest_run_id()
+    for chain_name in queue.get_archived_chains(run_id):
+        record_chain_run(chain_name)
+    return run_id, queue.get_counts(run_id), merge_result
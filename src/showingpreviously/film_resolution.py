@@ -0,0 +1,136 @@
+import re
+import threading
+from datetime import datetime
+from typing import Optional
+
+from showingpreviously.consts import UNKNOWN_FILM_YEAR, FILM_RESOLUTION_THRESHOLD, FILM_RESOLUTION_YEARS_BEFORE, FILM_RESOLUTION_YEARS_AFTER, FILM_RESOLUTION_CANDIDATE_TOKENS
+from showingpreviously.db import get_known_films, add_film_alias
+
+
+BRACKETS = re.compile(r'\([^)]*\)|\[[^\]]*\]')
+NON_ALPHANUMERIC = re.compile(r'[^a-z0-9]+')
+STOP_WORDS = {'the', 'a', 'an', 'and', 'of'}
+
+
+def normalise_title(name: str) -> str:
+    # chains add certificates and formats in brackets, and differ in case and punctuation
+    title = BRACKETS.sub(' ', name.lower()).replace('&', ' and ')
+    return ' '.join(NON_ALPHANUMERIC.sub(' ', title).split())
+
+
+def get_tokens(title: str) -> set[str]:
+    words = set(title.split())
+    return words - STOP_WORDS or words
+
+
+def get_trigrams(title: str) -> frozenset[str]:
+    padded = f'  {title} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def get_similarity(trigrams: frozenset[str], other_trigrams: frozenset[str]) -> float:
+    if not trigrams or not other_trigrams:
+        return 0.0
+    shared = len(trigrams & other_trigrams)
+    return shared / (len(trigrams) + len(other_trigrams) - shared)
+
+
+class FilmIndex:
+    """An inverted index of the titles of films with a known year, bucketed by year, to match films of an unknown year against"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.trigrams: dict[(str, str), frozenset[str]] = {}
+        self.by_title: dict[str, set[(str, str)]] = {}
+        self.by_token: dict[str, set[(str, str)]] = {}
+        self.by_token_year: dict[(str, int), set[(str, str)]] = {}
+        self.resolved: dict[str, Optional[tuple[str, str, float]]] = {}
+
+    def add(self, film_name: str, film_year: str) -> None:
+        if film_year == UNKNOWN_FILM_YEAR or not film_year.isdigit():
+            return
+        film = (film_name, film_year)
+        title = normalise_title(film_name)
+        with self.lock:
+            if film in self.trigrams:
+                return
+            self.trigrams[film] = get_trigrams(title)
+            self.by_title.setdefault(title, set()).add(film)
+            for token in get_tokens(title):
+                self.by_token.setdefault(token, set()).add(film)
+                self.by_token_year.setdefault((token, int(film_year)), set()).add(film)
+
+    def get_candidates(self, tokens: set[str], years: Optional[range]) -> set[(str, str)]:
+        # a film similar enough to match shares its rarest words, so only their postings are looked at
+        rarest = sorted(tokens, key=lambda token: len(self.by_token.get(token, ())))[:FILM_RESOLUTION_CANDIDATE_TOKENS]
+        candidates = set()
+        for token in rarest:
+            if years is None:
+                candidates |= self.by_token.get(token, set())
+                continue
+            for year in years:
+                candidates |= self.by_token_year.get((token, year), set())
+        return candidates
+
+    def resolve(self, film_name: str, showing_year: Optional[int] = None, threshold: float = FILM_RESOLUTION_THRESHOLD) -> Optional[tuple[str, str, float]]:
+        title = normalise_title(film_name)
+        trigrams = get_trigrams(title)
+        tokens = get_tokens(title)
+        year_buckets = [None]
+        if showing_year is not None:
+            # a film being shown was most likely released shortly before, so those years are tried first
+            year_buckets.insert(0, range(showing_year - FILM_RESOLUTION_YEARS_BEFORE, showing_year + FILM_RESOLUTION_YEARS_AFTER + 1))
+        with self.lock:
+            exact = self.by_title.get(title, set())
+            for years in year_buckets:
+                candidates = exact if exact else self.get_candidates(tokens, years)
+                if years is not None:
+                    candidates = {film for film in candidates if int(film[1]) in years}
+                scored = [(get_similarity(trigrams, self.trigrams[film]), film[1], film[0]) for film in candidates]
+                if len(scored) == 0:
+                    continue
+                # ties between remakes go to the most recent one
+                similarity, resolved_year, resolved_name = max(scored)
+                if similarity >= threshold:
+                    return resolved_name, resolved_year, round(similarity, 4)
+        return None
+
+
+film_index: Optional[FilmIndex] = None
+film_index_lock = threading.Lock()
+
+
+def get_film_index() -> FilmIndex:
+    global film_index
+    with film_index_lock:
+        if film_index is None:
+            film_index = FilmIndex()
+            for film_name, film_year in get_known_films():
+                film_index.add(film_name, film_year)
+        return film_index
+
+
+def index_film(film_name: str, film_year: str) -> None:
+    # known films archived during a run are matched against from then on, if the index has been loaded
+    if film_index is not None:
+        film_index.add(film_name, film_year)
+
+
+def index_showing_rows(rows: [(str, str, str, str, str, str, int, str)]) -> None:
+    # rows are in the format of db.add_showings, and each of their films is indexed, or resolved, once
+    for (film_name, film_year), utc_epoch in {(row[0], row[1]): row[6] for row in rows}.items():
+        if film_year == UNKNOWN_FILM_YEAR:
+            resolve_on_ingest(film_name, datetime.utcfromtimestamp(utc_epoch).year)
+        else:
+            index_film(film_name, film_year)
+
+
+def resolve_on_ingest(film_name: str, showing_year: int) -> None:
+    index = get_film_index()
+    if film_name in index.resolved:
+        return
+    resolution = index.resolve(film_name, showing_year)
+    index.resolved[film_name] = resolution
+    if resolution is not None:
+        resolved_name, resolved_year, confidence = resolution
+        add_film_alias(film_name, UNKNOWN_FILM_YEAR, resolved_name, resolved_year, confidence)
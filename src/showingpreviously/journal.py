@@ -0,0 +1,247 @@
+import fcntl
+import json
+import os
+import re
+import struct
+import threading
+import traceback
+import zlib
+from datetime import datetime
+from typing import Optional, Iterator
+
+import showingpreviously.film_resolution as film_resolution
+from showingpreviously.consts import DATA_DIR, JOURNAL_DIR_NAME, JOURNAL_SEGMENT_NAME, JOURNAL_LOCK_NAME, JOURNAL_SEGMENT_SIZE, JOURNAL_COMPACT_BATCH
+from showingpreviously.db import add_showings
+from showingpreviously.model import Showing
+
+
+# each record is its payload's length and CRC32, then the payload, a JSON list of the showing's DB columns
+RECORD_HEADER = struct.Struct('<II')
+SEGMENT_PATTERN = re.compile(r'^segment-(?P<sequence>\d+)\.log$')
+
+JournalRow = tuple[str, str, str, str, str, str, int, str]
+
+
+class JournalLockedException(Exception):
+    pass
+
+
+class CompactResult:
+    def __init__(self) -> None:
+        self.segments = 0
+        self.showings = 0
+        self.inserted = 0
+        self.replaced = 0
+        self.corrupt_records = 0
+
+    def add(self, other: 'CompactResult') -> None:
+        self.segments += other.segments
+        self.showings += other.showings
+        self.inserted += other.inserted
+        self.replaced += other.replaced
+        self.corrupt_records += other.corrupt_records
+
+    def __repr__(self) -> str:
+        return f'Compacted {self.segments} journal segments into {self.showings} showings: {self.inserted} new, {self.replaced} replaced, ' \
+               f'{self.corrupt_records} corrupt records skipped'
+
+
+class Journal:
+    """
+    Showings appended to checksummed segment files, which a background compactor folds into the DB in sorted batches, so
+    runs never wait on the DB. Segments are only deleted once their showings are committed, so any left by a crash are
+    compacted when the journal is next opened. One process owns the journal at a time.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.compact_lock = threading.Lock()
+        self.file = None
+        self.sequence = 0
+        self.size = 0
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.compactor: Optional[threading.Thread] = None
+        self.lock_file = None
+        # everything compacted since the journal was started, not counting the segments it recovered
+        self.compacted = CompactResult()
+
+    def get_segments(self) -> [(int, str)]:
+        segments = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match is not None:
+                segments.append((int(match.group('sequence')), os.path.join(self.directory, name)))
+        return sorted(segments)
+
+    def open_segment(self) -> None:
+        segments = self.get_segments()
+        self.sequence = max([self.sequence] + [sequence for sequence, _ in segments]) + 1
+        self.file = open(os.path.join(self.directory, JOURNAL_SEGMENT_NAME.format(sequence=self.sequence)), 'ab')
+        self.size = 0
+
+    def append(self, showing: Showing, utc_time: datetime) -> None:
+        row = (showing.film.name, showing.film.year, showing.chain.name, showing.cinema.name, showing.cinema.timezone, showing.screen.name,
+               int(utc_time.timestamp()), json.dumps(showing.json_attributes))
+        payload = json.dumps(row).encode('utf-8')
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            if self.file is None:
+                self.open_segment()
+            self.file.write(record)
+            self.size += len(record)
+            if self.size >= JOURNAL_SEGMENT_SIZE:
+                self.seal_segment()
+
+    def seal(self) -> None:
+        # the showings appended so far are made durable, and handed to the compactor
+        with self.lock:
+            self.seal_segment()
+
+    def seal_segment(self) -> None:
+        if self.file is None:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+        self.wake.set()
+
+    def compact(self) -> CompactResult:
+        result = CompactResult()
+        with self.compact_lock:
+            with self.lock:
+                active_sequence = self.sequence if self.file is not None else None
+            for sequence, path in self.get_segments():
+                if sequence == active_sequence:
+                    continue
+                batch = []
+                for row in read_segment(path, result):
+                    if len(batch) >= JOURNAL_COMPACT_BATCH:
+                        write_batch(batch, result)
+                        batch = []
+                    batch.append(row)
+                # the last batch's commit is fsynced, which makes the segment's earlier batches durable too, before it is removed
+                write_batch(batch, result, True)
+                # a crash before this leaves the segment to be compacted again, which writes the same showings again
+                os.remove(path)
+                result.segments += 1
+            self.compacted.add(result)
+        return result
+
+    def run_compactor(self) -> None:
+        while not self.stopping.is_set():
+            self.wake.wait()
+            self.wake.clear()
+            try:
+                self.compact()
+            except Exception:
+                # the segments are left in place, and compacted on the next wake or when the journal is next opened
+                print(f'Journal compaction failed:\n{traceback.format_exc()}')
+
+    def start(self) -> CompactResult:
+        # segments left by a process which crashed are compacted before any new ones are written
+        os.makedirs(self.directory, exist_ok=True)
+        self.acquire()
+        try:
+            recovered = self.compact()
+        except Exception:
+            self.release()
+            raise
+        self.compacted = CompactResult()
+        self.stopping.clear()
+        self.compactor = threading.Thread(target=self.run_compactor, name='journal-compactor', daemon=True)
+        self.compactor.start()
+        return recovered
+
+    def close(self) -> CompactResult:
+        self.seal()
+        if self.compactor is not None:
+            self.stopping.set()
+            self.wake.set()
+            self.compactor.join()
+            self.compactor = None
+        self.compact()
+        self.release()
+        return self.compacted
+
+    def acquire(self) -> None:
+        # the lock is held until close, so no other process compacts, and removes, a segment this one is still appending to.
+        # the kernel drops it if the process dies, so a crashed run never leaves the journal locked
+        lock_file = open(os.path.join(self.directory, JOURNAL_LOCK_NAME), 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise JournalLockedException(f'The journal in "{self.directory}" is in use by another process')
+        self.lock_file = lock_file
+
+    def release(self) -> None:
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+
+
+def read_segment(path: str, result: CompactResult) -> Iterator[JournalRow]:
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # a torn header can only be the last record of a segment being written when the process died
+                result.corrupt_records += 1 if len(header) > 0 else 0
+                return
+            length, checksum = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                result.corrupt_records += 1
+                return
+            if zlib.crc32(payload) != checksum:
+                # the length it was read with may be corrupt too, so nothing after it can be trusted to start a record
+                result.corrupt_records += 1
+                return
+            yield tuple(json.loads(payload))
+
+
+def write_batch(batch: [JournalRow], result: CompactResult, durable: bool = False) -> None:
+    if len(batch) == 0:
+        return
+    inserted, replaced = add_showings(batch, durable)
+    result.showings += len(batch)
+    result.inserted += inserted
+    result.replaced += replaced
+    film_resolution.index_showing_rows(batch)
+
+
+ingest_journal: Optional[Journal] = None
+
+
+def open_journal() -> CompactResult:
+    global ingest_journal
+    new_journal = Journal(os.path.join(DATA_DIR, JOURNAL_DIR_NAME))
+    recovered = new_journal.start()
+    ingest_journal = new_journal
+    return recovered
+
+
+def close_journal() -> Optional[CompactResult]:
+    global ingest_journal
+    if ingest_journal is None:
+        return None
+    result = ingest_journal.close()
+    ingest_journal = None
+    return result
+
+
+def is_enabled() -> bool:
+    return ingest_journal is not None
+
+
+def append(showing: Showing, utc_time: datetime) -> None:
+    ingest_journal.append(showing, utc_time)
+
+
+def seal() -> None:
+    if ingest_journal is not None:
+        ingest_journal.seal()
@@ -0,0 +1,116 @@
+import hashlib
+import threading
+from typing import Optional
+
+import requests
+
+import showingpreviously.cassette as cassette
+import showingpreviously.metrics as metrics
+from showingpreviously.streaming import ResponseBody, SpooledBody
+from showingpreviously.db import get_listing_hashes, set_listing_hashes, get_listing_validators, set_listing_validators
+
+
+def get_listing_hash(content: ResponseBody) -> str:
+    listing_hash = hashlib.blake2b(digest_size=16)
+    for chunk in content.iter_chunks() if isinstance(content, SpooledBody) else [content]:
+        listing_hash.update(chunk)
+    return listing_hash.hexdigest()
+
+
+class ListingHashes:
+    """Hashes of the listing responses each chain got on its last successful run, so unchanged listings can be skipped"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.force = False
+        self.previous: dict[str, dict[str, str]] = {}
+        self.pending: dict[str, dict[str, str]] = {}
+        self.previous_validators: dict[str, dict[str, (Optional[str], Optional[str])]] = {}
+        self.pending_validators: dict[str, dict[str, (Optional[str], Optional[str])]] = {}
+
+    def is_unchanged(self, chain_name: str, listing_key: str, content: ResponseBody) -> bool:
+        listing_hash = get_listing_hash(content)
+        with self.lock:
+            if chain_name not in self.previous:
+                self.previous[chain_name] = get_listing_hashes(chain_name)
+            self.pending.setdefault(chain_name, {})[listing_key] = listing_hash
+            unchanged = self.previous[chain_name].get(listing_key) == listing_hash
+        # cassettes need every request of a run, so nothing is skipped while one is in use
+        if self.is_forced():
+            return False
+        metrics.record_cache('listing', unchanged)
+        return unchanged
+
+    def is_forced(self) -> bool:
+        return self.force or cassette.active is not None
+
+    def get_conditional_headers(self, chain_name: str, listing_key: str) -> dict[str, str]:
+        if self.is_forced():
+            return {}
+        with self.lock:
+            if chain_name not in self.previous_validators:
+                self.previous_validators[chain_name] = get_listing_validators(chain_name)
+            etag, last_modified = self.previous_validators[chain_name].get(listing_key, (None, None))
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def record_response(self, chain_name: str, listing_key: str, r: requests.Response) -> bool:
+        # returns whether the listing is unchanged since the last run, because the server answered a conditional request with 304
+        with self.lock:
+            pending_validators = self.pending_validators.setdefault(chain_name, {})
+            if r.status_code != 304:
+                pending_validators[listing_key] = (r.headers.get('ETag'), r.headers.get('Last-Modified'))
+        if r.status_code == 304:
+            metrics.record_cache('listing', True)
+            return True
+        return False
+
+    def commit(self, chain_name: str) -> None:
+        # hashes are only stored once the showings parsed from the listings are in the DB
+        with self.lock:
+            pending = self.pending.pop(chain_name, {})
+            pending_validators = self.pending_validators.pop(chain_name, {})
+            self.previous.pop(chain_name, None)
+            self.previous_validators.pop(chain_name, None)
+        if len(pending) > 0:
+            set_listing_hashes(chain_name, pending)
+        if len(pending_validators) > 0:
+            set_listing_validators(chain_name, pending_validators)
+
+    def discard(self, chain_name: str) -> None:
+        with self.lock:
+            self.pending.pop(chain_name, None)
+            self.pending_validators.pop(chain_name, None)
+            self.previous.pop(chain_name, None)
+            self.previous_validators.pop(chain_name, None)
+
+    def get_pending_chains(self) -> [str]:
+        with self.lock:
+            return list(dict.fromkeys(list(self.pending.keys()) + list(self.pending_validators.keys())))
+
+
+listing_hashes = ListingHashes()
+
+
+def set_force(force: bool) -> None:
+    listing_hashes.force = force
+
+
+def is_unchanged(chain_name: str, listing_key: str, content: ResponseBody) -> bool:
+    return listing_hashes.is_unchanged(chain_name, listing_key, content)
+
+
+def is_forced() -> bool:
+    return listing_hashes.is_forced()
+
+
+def get_conditional_headers(chain_name: str, listing_key: str) -> dict[str, str]:
+    return listing_hashes.get_conditional_headers(chain_name, listing_key)
+
+
+def is_not_modified(chain_name: str, listing_key: str, r: requests.Response) -> bool:
+    return listing_hashes.record_response(chain_name, listing_key, r)
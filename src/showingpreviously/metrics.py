@@ -0,0 +1,257 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from showingpreviously.consts import DATA_DIR, RUN_REPORT_NAME, PROMETHEUS_TEXTFILE_NAME, LATENCY_BUCKETS, RUN_REPORTS_KEPT
+
+
+class Histogram:
+    def __init__(self, buckets: [float]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+        self.count += 1
+
+    def to_dict(self) -> dict[str, any]:
+        buckets = {str(bucket): count for bucket, count in zip(self.buckets, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {'count': self.count, 'sum': round(self.total, 6), 'buckets': buckets}
+
+
+class RequestMetrics:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.bytes = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.counts = Counter()
+
+    def to_dict(self) -> dict[str, any]:
+        return {'requests': self.requests, 'bytes': self.bytes, 'latency': self.latency.to_dict(), **self.counts}
+
+
+class ChainMetrics(RequestMetrics):
+    def __init__(self) -> None:
+        super().__init__()
+        self.showings = 0
+        self.get_showings_seconds = 0.0
+        self.parse_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.pool_parse_seconds = 0.0
+        self.db_seconds = 0.0
+        self.rows_inserted = 0
+        self.rows_replaced = 0
+        self.cache_hits = Counter()
+        self.cache_misses = Counter()
+
+    def get_cache_hit_rates(self) -> dict[str, float]:
+        hit_rates = {}
+        for cache in set(self.cache_hits) | set(self.cache_misses):
+            lookups = self.cache_hits[cache] + self.cache_misses[cache]
+            hit_rates[cache] = round(self.cache_hits[cache] / lookups, 4)
+        return hit_rates
+
+    def to_dict(self) -> dict[str, any]:
+        return {
+            **super().to_dict(),
+            'showings': self.showings,
+            'getShowingsSeconds': round(self.get_showings_seconds, 6),
+            'parseSeconds': round(self.parse_seconds, 6),
+            'waitSeconds': round(self.wait_seconds, 6),
+            'poolParseSeconds': round(self.pool_parse_seconds, 6),
+            'dbSeconds': round(self.db_seconds, 6),
+            'rowsInserted': self.rows_inserted,
+            'rowsReplaced': self.rows_replaced,
+            'cacheHits': dict(self.cache_hits),
+            'cacheMisses': dict(self.cache_misses),
+            'cacheHitRates': self.get_cache_hit_rates(),
+        }
+
+
+class RunMetrics:
+    """Per-chain and per-host metrics of a single archive run"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.started = datetime.now()
+        self.finished: Optional[datetime] = None
+        self.current_chain: Optional[str] = None
+        self.chains: dict[str, ChainMetrics] = {}
+        self.hosts: dict[str, RequestMetrics] = {}
+
+    def get_chain(self, chain_name: Optional[str] = None) -> ChainMetrics:
+        # requests and caches made outside of a chain run are put under their own name
+        chain_name = chain_name or self.current_chain or 'none'
+        if chain_name not in self.chains:
+            self.chains[chain_name] = ChainMetrics()
+        return self.chains[chain_name]
+
+    def get_host(self, host: str) -> RequestMetrics:
+        if host not in self.hosts:
+            self.hosts[host] = RequestMetrics()
+        return self.hosts[host]
+
+    def record_request(self, host: str, latency: float, size: int) -> None:
+        with self.lock:
+            for request_metrics in [self.get_chain(), self.get_host(host)]:
+                request_metrics.requests += 1
+                request_metrics.bytes += size
+                request_metrics.latency.observe(latency)
+
+    def count_request(self, host: str, name: str) -> None:
+        with self.lock:
+            self.get_chain().counts[name] += 1
+            self.get_host(host).counts[name] += 1
+
+    def record_cache(self, cache: str, hit: bool) -> None:
+        with self.lock:
+            chain_metrics = self.get_chain()
+            if hit:
+                chain_metrics.cache_hits[cache] += 1
+            else:
+                chain_metrics.cache_misses[cache] += 1
+
+    def to_dict(self) -> dict[str, any]:
+        with self.lock:
+            return {
+                'started': self.started.isoformat(),
+                'finished': self.finished.isoformat() if self.finished is not None else None,
+                'chains': {name: chain_metrics.to_dict() for name, chain_metrics in self.chains.items()},
+                'hosts': {host: host_metrics.to_dict() for host, host_metrics in self.hosts.items()},
+            }
+
+
+class ChainTimer:
+    """Splits the time a chain spends in get_showings into CPU time spent parsing, and the rest spent waiting"""
+
+    def __init__(self, chain_name: str) -> None:
+        self.chain_name = chain_name
+
+    def __enter__(self) -> 'ChainTimer':
+        run_metrics.current_chain = self.chain_name
+        self.wall_started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        wall_time = time.perf_counter() - self.wall_started
+        cpu_time = time.process_time() - self.cpu_started
+        # requests made after get_showings, like the DB write's, aren't charged to this chain
+        run_metrics.current_chain = None
+        with run_metrics.lock:
+            chain_metrics = run_metrics.get_chain(self.chain_name)
+            chain_metrics.get_showings_seconds += wall_time
+            chain_metrics.parse_seconds += cpu_time
+            chain_metrics.wait_seconds += max(wall_time - cpu_time, 0)
+
+
+run_metrics = RunMetrics()
+
+
+def reset() -> None:
+    global run_metrics
+    run_metrics = RunMetrics()
+
+
+def record_request(host: str, latency: float, size: int) -> None:
+    run_metrics.record_request(host, latency, size)
+
+
+def count_request(host: str, name: str) -> None:
+    run_metrics.count_request(host, name)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    run_metrics.record_cache(cache, hit)
+
+
+def time_chain(chain_name: str) -> ChainTimer:
+    return ChainTimer(chain_name)
+
+
+def record_pool_parse(seconds: float) -> None:
+    # CPU time spent parsing in the parse pool's processes, which the chain's own process time doesn't include
+    with run_metrics.lock:
+        run_metrics.get_chain().pool_parse_seconds += seconds
+
+
+def record_db_write(chain_name: str, seconds: float, inserted: int, replaced: int) -> None:
+    with run_metrics.lock:
+        chain_metrics = run_metrics.get_chain(chain_name)
+        chain_metrics.db_seconds += seconds
+        chain_metrics.rows_inserted += inserted
+        chain_metrics.rows_replaced += replaced
+        chain_metrics.showings += inserted + replaced
+
+
+def write_atomically(path: str, contents: str) -> None:
+    # write then rename, so something reading the file never sees half of it
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(contents)
+    os.replace(temp_path, path)
+
+
+def write_run_report() -> str:
+    run_metrics.finished = datetime.now()
+    path = os.path.join(DATA_DIR, run_metrics.started.strftime(RUN_REPORT_NAME))
+    write_atomically(path, json.dumps(run_metrics.to_dict(), indent=2))
+    remove_old_run_reports()
+    return path
+
+
+def remove_old_run_reports() -> None:
+    # report names start with their run's time, so they sort oldest first
+    prefix = RUN_REPORT_NAME[:RUN_REPORT_NAME.index('%')]
+    extension = os.path.splitext(RUN_REPORT_NAME)[1]
+    reports = sorted(name for name in os.listdir(DATA_DIR) if name.startswith(prefix) and name.endswith(extension))
+    for name in reports[:-RUN_REPORTS_KEPT]:
+        os.remove(os.path.join(DATA_DIR, name))
+
+
+def get_prometheus_lines(prefix: str, labels: str, metrics: dict[str, any]) -> [str]:
+    lines = []
+    for key, value in metrics.items():
+        if key == 'latency':
+            cumulative = 0
+            for bucket, count in value['buckets'].items():
+                cumulative += count
+                lines.append(f'{prefix}_latency_seconds_bucket{{{labels},le="{bucket}"}} {cumulative}')
+            lines.append(f'{prefix}_latency_seconds_sum{{{labels}}} {value["sum"]}')
+            lines.append(f'{prefix}_latency_seconds_count{{{labels}}} {value["count"]}')
+        elif isinstance(value, dict):
+            for name, count in value.items():
+                lines.append(f'{prefix}_{to_snake_case(key)}{{{labels},cache="{name}"}} {count}')
+        else:
+            lines.append(f'{prefix}_{to_snake_case(key)}{{{labels}}} {value}')
+    return lines
+
+
+def to_snake_case(name: str) -> str:
+    return ''.join([f'_{c.lower()}' if c.isupper() else c for c in name])
+
+
+def write_prometheus_textfile() -> str:
+    report = run_metrics.to_dict()
+    lines = []
+    for chain_name, chain_metrics in report['chains'].items():
+        lines += get_prometheus_lines('showingpreviously_chain', f'chain="{chain_name}"', chain_metrics)
+    for host, host_metrics in report['hosts'].items():
+        lines += get_prometheus_lines('showingpreviously_host', f'host="{host}"', host_metrics)
+    lines.append(f'showingpreviously_last_run_timestamp_seconds {int(run_metrics.started.timestamp())}')
+    path = os.path.join(DATA_DIR, PROMETHEUS_TEXTFILE_NAME)
+    write_atomically(path, '\n'.join(lines) + '\n')
+    return path
@@ -1,41 +1,125 @@
+import json
+import threading
+import weakref
 from datetime import datetime
 
+import pytz
 
-class Chain:
-    def __init__(self, name: str) -> None:
-        self.name = name.strip()
+
+class Interned:
+    """
+    An immutable value object, where constructing an equal value returns the existing object instead of a new one.
+    Objects are looked up by their constructor arguments first, so repeats don't pay for normalising them again.
+    """
+    __slots__ = ('__weakref__',)
+    fields: (str,) = ()
+    interned: weakref.WeakValueDictionary
+    lock: threading.Lock
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls.interned = weakref.WeakValueDictionary()
+        cls.lock = threading.Lock()
+
+    @classmethod
+    def intern(cls, args: tuple) -> 'Interned':
+        with cls.lock:
+            obj = cls.interned.get(args)
+            if obj is not None:
+                return obj
+            values = cls.normalise(*args)
+            obj = cls.interned.get(values)
+            if obj is None:
+                obj = object.__new__(cls)
+                for field, value in zip(cls.fields, values):
+                    object.__setattr__(obj, field, value)
+                cls.interned[values] = obj
+            cls.interned[args] = obj
+            return obj
+
+    @staticmethod
+    def normalise(*args) -> tuple:
+        return args
+
+    def get_key(self) -> tuple:
+        return tuple(getattr(self, field) for field in self.fields)
+
+    def __setattr__(self, name: str, value: any) -> None:
+        raise AttributeError(f'{type(self).__name__} objects are immutable')
+
+    def __eq__(self, other: any) -> bool:
+        return self is other or (type(self) is type(other) and self.get_key() == other.get_key())
+
+    def __hash__(self) -> int:
+        return hash(self.get_key())
+
+    def __reduce__(self) -> (type, tuple):
+        return type(self), self.get_key()
+
+
+class Chain(Interned):
+    __slots__ = ('name',)
+    fields = ('name',)
+
+    def __new__(cls, name: str) -> 'Chain':
+        return cls.intern((name,))
+
+    @staticmethod
+    def normalise(name: str) -> (str,):
+        return name.strip(),
 
     def __repr__(self) -> str:
         return f'Chain "{self.name}"'
 
 
-class Cinema:
-    def __init__(self, name: str, timezone: str) -> None:
-        self.name = name.strip()
-        self.timezone = timezone
+class Cinema(Interned):
+    __slots__ = ('name', 'timezone')
+    fields = ('name', 'timezone')
+
+    def __new__(cls, name: str, timezone: str) -> 'Cinema':
+        return cls.intern((name, timezone))
+
+    @staticmethod
+    def normalise(name: str, timezone: str) -> (str, str):
+        return name.strip(), timezone
 
     def __repr__(self) -> str:
         return f'Cinema "{self.name}"'
 
 
-class Screen:
-    def __init__(self, name: str) -> None:
-        self.name = name.strip()
+class Screen(Interned):
+    __slots__ = ('name',)
+    fields = ('name',)
+
+    def __new__(cls, name: str) -> 'Screen':
+        return cls.intern((name,))
+
+    @staticmethod
+    def normalise(name: str) -> (str,):
+        return name.strip(),
 
     def __repr__(self) -> str:
         return f'Screen "{self.name}"'
 
 
-class Film:
-    def __init__(self, name: str, year: str) -> None:
-        self.name = name.strip().upper()
-        self.year = str(year).strip()
+class Film(Interned):
+    __slots__ = ('name', 'year')
+    fields = ('name', 'year')
+
+    def __new__(cls, name: str, year: str) -> 'Film':
+        return cls.intern((name, year))
+
+    @staticmethod
+    def normalise(name: str, year: str) -> (str, str):
+        return name.strip().upper(), str(year).strip()
 
     def __repr__(self) -> str:
         return f'Film "{self.name}" ({self.year})'
 
 
 class Showing:
+    __slots__ = ('film', 'time', 'chain', 'cinema', 'screen', 'json_attributes')
+
     def __init__(self, film: Film, time: datetime, chain: Chain, cinema: Cinema, screen: Screen,
                  json_attributes: dict[str, str]) -> None:
         self.film = film
@@ -49,10 +133,47 @@ class Showing:
         return f'Showing of {self.film} at {self.chain}, {self.cinema}, {self.screen}, on {self.time.strftime("%Y-%m-%d %H:%M")}'
 
 
+# showings are sent between processes as plain tuples, which pickle far smaller than model objects
+ShowingRow = tuple[str, str, str, str, str, str, datetime, dict[str, any]]
+
+
+def to_row(showing: Showing) -> ShowingRow:
+    return (showing.film.name, showing.film.year, showing.chain.name, showing.cinema.name, showing.cinema.timezone, showing.screen.name, showing.time, showing.json_attributes)
+
+
+def from_row(row: ShowingRow) -> Showing:
+    film_name, film_year, chain_name, cinema_name, cinema_timezone, screen_name, time, json_attributes = row
+    return Showing(Film(film_name, film_year), time, Chain(chain_name), Cinema(cinema_name, cinema_timezone), Screen(screen_name), json_attributes)
+
+
+def get_utc_time(time: datetime, timezone: str) -> datetime:
+    return pytz.timezone(timezone).localize(time).astimezone(pytz.timezone('UTC'))
+
+
 class ChainArchiver:
     def get_showings(self) -> [Showing]:
         pass
 
+    def get_work_units(self) -> [str]:
+        # chains which can be split up return a unit per cinema or date, so the units can be shared between workers
+        return [ALL_WORK]
+
+    def get_unit_showings(self, unit: str) -> [Showing]:
+        return self.get_showings()
+
+
+ALL_WORK = 'all'
+
+
+def get_cinema_unit(cinema_id: str, cinema: Cinema, *args: str) -> str:
+    # a unit carries its cinema's directory entry, so workers use the cinemas the coordinator split the run up with
+    return json.dumps([cinema_id, cinema.name, cinema.timezone, *args])
+
+
+def read_cinema_unit(unit: str) -> (str, Cinema, [str]):
+    cinema_id, cinema_name, cinema_timezone, *args = json.loads(unit)
+    return cinema_id, Cinema(cinema_name, cinema_timezone), args
+
 
 class CinemaArchiverException(Exception):
     pass
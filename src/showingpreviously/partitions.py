@@ -0,0 +1,165 @@
+import os
+import stat
+import time
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.request import pathname2url
+
+import showingpreviously.db as db
+from showingpreviously.consts import DATA_DIR, PARTITION_DIR_NAME, PARTITION_NAME, PARTITION_HOT_MONTHS, MERGE_MAX_ATTACHED
+
+
+MONTH_FORMAT = '%Y-%m'
+SHOWING_COLUMNS = 'filmName, filmYear, chainName, cinemaName, screenName, utcTime, jsonAttributes'
+
+
+class CompactResult:
+    def __init__(self, month: str, showings: int, seconds: float) -> None:
+        self.month = month
+        self.showings = showings
+        self.seconds = seconds
+
+    def __repr__(self) -> str:
+        return f'Compacted {self.showings} showings of {self.month} in {self.seconds:.1f}s'
+
+
+def get_partition_path(month: str) -> str:
+    return os.path.join(DATA_DIR, PARTITION_DIR_NAME, PARTITION_NAME.format(month=month))
+
+
+def get_month_range(month: str) -> (int, int):
+    # the first and last epoch second of a UTC month
+    start = datetime.strptime(month, MONTH_FORMAT).replace(tzinfo=timezone.utc)
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return int(start.timestamp()), int(end.timestamp()) - 1
+
+
+def get_months(start: datetime, end: datetime) -> [str]:
+    months = []
+    current = datetime(start.year, start.month, 1)
+    while current <= end:
+        months.append(current.strftime(MONTH_FORMAT))
+        current = current.replace(year=current.year + 1, month=1) if current.month == 12 else current.replace(month=current.month + 1)
+    return months
+
+
+def get_cold_months() -> dict[str, str]:
+    with db.read_connection() as read_conn, closing(read_conn.cursor()) as cur:
+        return {month: get_partition_path(month) for month, in cur.execute('SELECT month FROM partitions').fetchall()}
+
+
+def get_compactable_months(hot_months: int = PARTITION_HOT_MONTHS) -> [str]:
+    # this month and the hot_months - 1 before it stay in the archive, along with everything after
+    now = datetime.utcnow()
+    month_index = now.year * 12 + now.month - 1 - (hot_months - 1)
+    cutoff = get_month_range(f'{month_index // 12:04d}-{month_index % 12 + 1:02d}')[0]
+    with db.read_connection() as read_conn, closing(read_conn.cursor()) as cur:
+        rows = cur.execute('SELECT DISTINCT strftime(\'%Y-%m\', utcTime, \'unixepoch\') FROM showings WHERE utcTime < ? ORDER BY 1', (cutoff,)).fetchall()
+    return [month for month, in rows]
+
+
+def set_read_only(path: str, read_only: bool) -> None:
+    mode = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+    os.chmod(path, mode if read_only else mode | stat.S_IWUSR)
+
+
+def compact_month(month: str) -> CompactResult:
+    # showings of the month move into its partition, joining any already there, and the partition is made read-only again
+    started = time.perf_counter()
+    path = get_partition_path(month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        set_read_only(path, False)
+    start, end = get_month_range(month)
+    with db.write_lock:
+        db.get_connection().execute('ATTACH DATABASE ? AS partition', (path,))
+        try:
+            with db.write_cursor() as cur:
+                cur.execute('BEGIN IMMEDIATE')
+                cur.execute(
+                    'CREATE TABLE IF NOT EXISTS partition.showings (filmName TEXT, filmYear TEXT, chainName TEXT, cinemaName TEXT, screenName TEXT, utcTime INT, jsonAttributes TEXT, '
+                    'PRIMARY KEY (filmName, filmYear, chainName, cinemaName, screenName, utcTime))'
+                )
+                cur.execute('CREATE INDEX IF NOT EXISTS partition.showingsByTime ON showings (utcTime)')
+                moved_by_chain = dict(cur.execute('SELECT chainName, COUNT(*) FROM main.showings WHERE utcTime BETWEEN ? AND ? GROUP BY chainName', (start, end,)).fetchall())
+                partitioned_by_chain = dict(cur.execute('SELECT chainName, showingCount FROM main.partitionChainStats WHERE month = ?', (month,)).fetchall())
+                cur.execute(
+                    f'INSERT INTO partition.showings ({SHOWING_COLUMNS}) SELECT {SHOWING_COLUMNS} FROM main.showings WHERE utcTime BETWEEN ? AND ? '
+                    'ON CONFLICT DO UPDATE SET jsonAttributes = excluded.jsonAttributes',
+                    (start, end,)
+                )
+                moved = cur.rowcount
+                # the stats still count the moved showings, so they are deleted without the triggers which would uncount them
+                db.drop_stats_triggers(cur)
+                cur.execute('DELETE FROM main.showings WHERE utcTime BETWEEN ? AND ?', (start, end,))
+                db.create_stats_tables(cur)
+                db.create_rollup_tables(cur)
+                cur.execute(
+                    'INSERT OR REPLACE INTO main.partitions (month, path, showingCount, utcCompacted) SELECT ?, ?, COUNT(*), ? FROM partition.showings',
+                    (month, os.path.basename(path), int(time.time()),)
+                )
+                cur.execute('DELETE FROM main.partitionChainStats WHERE month = ?', (month,))
+                cur.execute(
+                    'INSERT INTO main.partitionChainStats (month, chainName, showingCount, earliestUtcTime, latestUtcTime) '
+                    'SELECT ?, chainName, COUNT(*), MIN(utcTime), MAX(utcTime) FROM partition.showings GROUP BY chainName',
+                    (month,)
+                )
+                # showings written late for an already compacted month were counted in both the archive and the partition, so
+                # those that joined ones already in the partition are uncounted, and the month's rollups are rebuilt from the partition
+                compacted_by_chain = dict(cur.execute('SELECT chainName, showingCount FROM main.partitionChainStats WHERE month = ?', (month,)).fetchall())
+                duplicates = [
+                    (partitioned_by_chain.get(chain_name, 0) + moved_count - compacted_by_chain.get(chain_name, 0), chain_name,)
+                    for chain_name, moved_count in moved_by_chain.items()
+                ]
+                cur.executemany('UPDATE main.chainStats SET showingCount = showingCount - ? WHERE chainName = ?', duplicates)
+                cur.execute('UPDATE main.tableCounts SET count = count - ? WHERE name = \'showings\'', (sum(count for count, _ in duplicates),))
+                for table in ['dailyShowings', 'dailyScreens', 'dailyAttributes']:
+                    cur.execute(f'DELETE FROM main.{table} WHERE substr(utcDay, 1, 7) = ?', (month,))
+                db.insert_rollups(cur, 'partition.showings', 'true')
+        finally:
+            db.conn.execute('DETACH DATABASE partition')
+    set_read_only(path, True)
+    return CompactResult(month, moved, time.perf_counter() - started)
+
+
+def compact(hot_months: int = PARTITION_HOT_MONTHS, vacuum: bool = False) -> [CompactResult]:
+    results = [compact_month(month) for month in get_compactable_months(hot_months)]
+    if vacuum and len(results) > 0:
+        with db.write_lock:
+            db.get_connection().execute('VACUUM')
+    return results
+
+
+def query_showings(start: datetime, end: datetime, chain_name: Optional[str] = None, cinema_name: Optional[str] = None,
+                   film_name: Optional[str] = None) -> [(str, str, str, str, str, datetime, str)]:
+    # only the partitions of months in the range are attached, and rows still in the archive win over a partition's
+    start_epoch, end_epoch = int(start.timestamp()), int(end.timestamp())
+    conditions = ['utcTime BETWEEN ? AND ?']
+    parameters = [start_epoch, end_epoch]
+    for column, value in [('chainName', chain_name), ('cinemaName', cinema_name), ('filmName', film_name)]:
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            parameters.append(value)
+    where = ' AND '.join(conditions)
+    cold_months = get_cold_months()
+    paths = [cold_months[month] for month in get_months(datetime.utcfromtimestamp(start_epoch), datetime.utcfromtimestamp(end_epoch)) if month in cold_months]
+    rows = []
+    with db.read_connection() as read_conn:
+        rows += read_conn.execute(f'SELECT {SHOWING_COLUMNS} FROM main.showings WHERE {where}', parameters).fetchall()
+        for batch_start in range(0, len(paths), MERGE_MAX_ATTACHED):
+            batch = paths[batch_start:batch_start + MERGE_MAX_ATTACHED]
+            for i, path in enumerate(batch):
+                read_conn.execute(f'ATTACH DATABASE ? AS partition{i}', (f'file:{pathname2url(path)}?mode=ro',))
+            try:
+                for i in range(len(batch)):
+                    rows += read_conn.execute(
+                        f'SELECT {SHOWING_COLUMNS} FROM partition{i}.showings r WHERE {where} '
+                        f'AND NOT EXISTS (SELECT 1 FROM main.showings d WHERE {db.SHOWING_KEY_MATCH})',
+                        parameters
+                    ).fetchall()
+            finally:
+                for i in range(len(batch)):
+                    read_conn.execute(f'DETACH DATABASE partition{i}')
+    rows.sort(key=lambda row: (row[5], row[2], row[3]))
+    return [(film, year, chain, cinema, screen, datetime.fromtimestamp(utc_time), attributes) for film, year, chain, cinema, screen, utc_time, attributes in rows]
@@ -0,0 +1,88 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+import showingpreviously.metrics as metrics
+import showingpreviously.streaming as streaming
+from showingpreviously.streaming import ResponseBody
+from showingpreviously.consts import PARSE_WORKERS, MAX_CONCURRENT_CINEMAS
+
+
+class ParsePool:
+    """Worker processes which parse fetched listings, so a chain's requests stay in flight while the GIL would hold them up"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.workers = PARSE_WORKERS
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    def submit(self, parse: Callable[..., list], content: ResponseBody, args: tuple) -> Future:
+        if self.workers == 0:
+            future = Future()
+            try:
+                future.set_result(run_parse(parse, content, args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        with self.lock:
+            # worker processes are spawned rather than forked, so none of them share the parent's DB connections
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self.executor.submit(run_parse, parse, content, args)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+
+def run_parse(parse: Callable[..., list], content: ResponseBody, args: tuple) -> (list, float):
+    # a spooled body is only needed until it is parsed, wherever that happens
+    started = time.process_time()
+    try:
+        results = parse(content, *args)
+    finally:
+        streaming.discard(content)
+    return results, time.process_time() - started
+
+
+parse_pool = ParsePool()
+
+
+def set_parse_workers(workers: int) -> None:
+    parse_pool.close()
+    parse_pool.workers = workers
+
+
+def close_parse_pool() -> None:
+    parse_pool.close()
+
+
+def fetch_and_submit(fetch: Callable[..., Optional[ResponseBody]], parse: Callable[..., list], job: tuple) -> Optional[Future]:
+    content = fetch(*job)
+    if content is None:
+        return None
+    return parse_pool.submit(parse, content, job)
+
+
+def fetch_and_parse(jobs: [tuple], fetch: Callable[..., Optional[ResponseBody]], parse: Callable[..., list], io_workers: int = MAX_CONCURRENT_CINEMAS) -> list:
+    """
+    Runs fetch(*job) for every job on I/O threads, and hands each listing it returns to the parse pool as parse(content, *job).
+    Returns the results of every parse in job order. fetch returns None for a listing which doesn't need parsing, and parse
+    must be a module-level function that returns something small to pickle, like showing rows rather than Showings.
+    """
+    with ThreadPoolExecutor(max_workers=io_workers) as io_executor:
+        fetch_futures = [io_executor.submit(fetch_and_submit, fetch, parse, job) for job in jobs]
+        parse_futures = [fetch_future.result() for fetch_future in fetch_futures]
+    results = []
+    for parse_future in parse_futures:
+        if parse_future is None:
+            continue
+        job_results, parse_seconds = parse_future.result()
+        if parse_pool.workers != 0:
+            metrics.record_pool_parse(parse_seconds)
+        results += job_results
+    return results
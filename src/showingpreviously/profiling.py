@@ -0,0 +1,178 @@
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Optional, Iterator
+
+from showingpreviously.consts import DATA_DIR, PROFILE_DIR_NAME, PROFILE_SAMPLE_INTERVAL, PROFILE_DEFAULT_ALLOCATIONS
+
+
+CPU = 'cpu'
+WALL = 'wall'
+MEM = 'mem'
+MODES = [CPU, WALL, MEM]
+
+
+class StackSampler(threading.Thread):
+    """Samples the stack of every thread at an interval, for collapsed-stack flamegraphs"""
+
+    def __init__(self, interval: float) -> None:
+        super().__init__(name='stack-sampler', daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+    def write(self, path: str) -> None:
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class PhaseProfiler:
+    """Profiles one phase of a chain run, including the threads it starts, and writes the results when it ends"""
+
+    def __init__(self, output_dir: str, name: str, mode: str, allocations: int) -> None:
+        self.output_dir = output_dir
+        self.name = name
+        self.mode = mode
+        self.allocations = allocations
+        self.lock = threading.Lock()
+        self.profiles: [cProfile.Profile] = []
+        self.sampler: Optional[StackSampler] = None
+
+    def get_path(self, suffix: str) -> str:
+        return os.path.join(self.output_dir, f'{self.name}{suffix}')
+
+    def new_profile(self) -> cProfile.Profile:
+        timer = time.thread_time if self.mode == CPU else time.perf_counter
+        profile = cProfile.Profile(timer)
+        with self.lock:
+            self.profiles.append(profile)
+        return profile
+
+    def enable_profile(self, *args) -> None:
+        # cProfile only sees the thread it is enabled on, so each thread the phase starts gets its own profile. a profile
+        # can only be disabled from its own thread, so the threads of long-lived pools aren't profiled for their lifetime:
+        # process pools' bookkeeping threads not at all, and the hedger's threads per task with profile_task
+        thread = threading.current_thread()
+        if type(thread).__module__ == 'concurrent.futures.process' or thread.name == 'QueueFeederThread':
+            sys.setprofile(None)
+            return
+        self.new_profile().enable()
+
+    def start(self) -> None:
+        if self.mode == MEM or self.allocations > 0:
+            tracemalloc.start(25)
+        if self.mode in [CPU, WALL]:
+            threading.setprofile(self.enable_profile)
+            self.new_profile().enable()
+            self.sampler = StackSampler(PROFILE_SAMPLE_INTERVAL)
+            self.sampler.start()
+
+    def stop(self) -> None:
+        if self.mode in [CPU, WALL]:
+            threading.setprofile(None)
+            self.sampler.stop()
+            with self.lock:
+                profiles = self.profiles
+            for profile in profiles:
+                profile.disable()
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                profile.create_stats()
+                if profile.stats:
+                    stats.add(profile)
+            stats.dump_stats(self.get_path('.pstats'))
+            self.sampler.write(self.get_path('.folded'))
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            top_n = self.allocations if self.allocations > 0 else PROFILE_DEFAULT_ALLOCATIONS
+            self.write_allocations(snapshot, peak, top_n)
+
+    def write_allocations(self, snapshot: tracemalloc.Snapshot, peak: int, top_n: int) -> None:
+        with open(self.get_path('-allocations.txt'), 'w') as f:
+            f.write(f'Peak traced memory: {peak / 1024 / 1024:.1f}MiB\n')
+            f.write(f'Top {top_n} allocation sites still alive at the end of {self.name}:\n')
+            for statistic in snapshot.statistics('lineno')[:top_n]:
+                f.write(f'{statistic}\n')
+
+
+mode: Optional[str] = None
+allocations = 0
+output_dir: Optional[str] = None
+active_profiler: Optional[PhaseProfiler] = None
+
+
+def configure(profile_mode: Optional[str], profile_allocations: int = 0) -> Optional[str]:
+    global mode, allocations, output_dir
+    mode = profile_mode
+    allocations = profile_allocations
+    if mode is None:
+        output_dir = None
+        return None
+    output_dir = os.path.join(DATA_DIR, PROFILE_DIR_NAME, datetime.now().strftime('%Y-%m-%dT%H-%M-%S'))
+    os.makedirs(output_dir, exist_ok=True)
+    return output_dir
+
+
+@contextmanager
+def profile_phase(chain_name: str, phase: str) -> Iterator[None]:
+    if mode is None:
+        yield
+        return
+    global active_profiler
+    profiler = PhaseProfiler(output_dir, f'{chain_name}-{phase}', mode, allocations)
+    profiler.start()
+    active_profiler = profiler
+    try:
+        yield
+    finally:
+        active_profiler = None
+        profiler.stop()
+
+
+def disable_thread_profile() -> None:
+    # the initializer of long-lived pool threads, which are profiled per task instead of for as long as they live
+    sys.setprofile(None)
+
+
+def profile_task(function: Callable[[], any]) -> Callable[[], any]:
+    # wraps a task run on a long-lived pool thread, so it is profiled as part of the phase it was submitted in
+    profiler = active_profiler
+    if profiler is None or profiler.mode not in [CPU, WALL]:
+        return function
+
+    def run() -> any:
+        profile = profiler.new_profile()
+        profile.enable()
+        try:
+            return function()
+        finally:
+            profile.disable()
+    return run
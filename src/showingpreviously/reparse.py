@@ -0,0 +1,73 @@
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+from showingpreviously.archiver import all_cinema_chains
+from showingpreviously.cassette import replay_entries
+from showingpreviously.consts import REPARSE_BATCH
+from showingpreviously.db import add_showings
+import showingpreviously.film_resolution as film_resolution
+import showingpreviously.pipeline as pipeline
+from showingpreviously.model import ShowingRow, to_row, get_utc_time
+from showingpreviously.response_archive import response_archive
+
+
+class ReparseResult:
+    def __init__(self) -> None:
+        self.runs = 0
+        self.showings = 0
+        self.inserted = 0
+        self.replaced = 0
+        self.failures: [(str, int, Exception)] = []
+
+    def __repr__(self) -> str:
+        return f'Reparsed {self.runs} runs into {self.showings} showings: {self.inserted} new, {self.replaced} replaced, {len(self.failures)} runs failed'
+
+
+def reparse_run(chain_name: str, run_started: int) -> [ShowingRow]:
+    # runs in a worker process, replaying the archived responses of one run through the chain's current parsers
+    # runs are already parsed in parallel, so each worker parses its run's listings itself
+    pipeline.set_parse_workers(0)
+    chain = next(cinema_chain for cinema_chain in all_cinema_chains if type(cinema_chain).__name__ == chain_name)
+    entries = response_archive.get_entries(chain_name, run_started)
+    with replay_entries(datetime.fromtimestamp(run_started), entries):
+        showings = chain.get_showings()
+    return [to_row(showing) for showing in showings]
+
+
+def write_batch(batch: [ShowingRow], result: ReparseResult, dry_run: bool) -> None:
+    result.showings += len(batch)
+    if dry_run or len(batch) == 0:
+        return
+    rows = [(film_name, film_year, chain_name, cinema_name, cinema_timezone, screen_name, int(get_utc_time(time, cinema_timezone).timestamp()), json.dumps(json_attributes),)
+            for film_name, film_year, chain_name, cinema_name, cinema_timezone, screen_name, time, json_attributes in batch]
+    inserted, replaced = add_showings(rows)
+    result.inserted += inserted
+    result.replaced += replaced
+    film_resolution.index_showing_rows(rows)
+
+
+def reparse(chain_name: Optional[str] = None, since: Optional[datetime] = None, until: Optional[datetime] = None, workers: Optional[int] = None,
+            dry_run: bool = False) -> ReparseResult:
+    result = ReparseResult()
+    runs = response_archive.get_runs(chain_name, since, until)
+    # worker processes are spawned rather than forked, so none of them share the parent's DB connections
+    batch = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(reparse_run, run_chain_name, run_started) for run_chain_name, run_started in runs]
+        # runs are written oldest first, and a batch's rows keep their order, so the attributes of a later run replace those of an earlier one
+        for (run_chain_name, run_started), future in zip(runs, futures):
+            try:
+                rows = future.result()
+            except Exception as e:
+                result.failures.append((run_chain_name, run_started, e))
+                continue
+            result.runs += 1
+            batch += rows
+            if len(batch) >= REPARSE_BATCH:
+                write_batch(batch, result, dry_run)
+                batch = []
+    write_batch(batch, result, dry_run)
+    return result
@@ -1,47 +1,344 @@
 import requests
 import os
+import json as jsonlib
+import time
+import threading
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
+from typing import Callable, Optional
+from urllib.parse import urlsplit
 from requests import *
 
-from showingpreviously.consts import DATA_DIR, URL_LOG_NAME
+import showingpreviously.cassette as cassette
+import showingpreviously.metrics as metrics
+import showingpreviously.profiling as profiling
+import showingpreviously.response_archive as response_archive
+import showingpreviously.streaming as streaming
+from showingpreviously.consts import DATA_DIR, URL_LOG_NAME, COALESCE_REQUESTS, SINGLE_FLIGHT_WINDOW, DEFAULT_TIMEOUT, HOST_TIMEOUTS, \
+    HEDGE_REQUESTS, HEDGE_MIN_SAMPLES, HEDGE_MIN_DELAY, HEDGE_MAX_FRACTION, MAX_CONCURRENT_REQUESTS, MAX_CONCURRENT_CINEMAS
 
 
 for name in ['head', 'get', 'post', 'put', 'patch', 'delete']:
     del globals()[name]
 
 
+url_log_lock = threading.Lock()
+
+
 def log_url(url: str):
     log_file = datetime.now().strftime(URL_LOG_NAME)
     log_file = os.path.join(DATA_DIR, log_file)
-    with open(log_file, 'a') as f:
+    with url_log_lock, open(log_file, 'a') as f:
         f.write('%s\n' % url)
 
 
-def head(url, **kwargs):
+class SingleFlightCall:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.finished_at: Optional[float] = None
+        self.response: Optional[requests.Response] = None
+        self.exception: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Shares one in-flight request, and its response, between identical GETs. A finished response is only shared for the
+    window after it, and dropped as soon as it is past it, so responses aren't held in memory after a run
+    """
+
+    def __init__(self, enabled: bool, window: float) -> None:
+        self.enabled = enabled
+        self.window = window
+        self.lock = threading.Lock()
+        self.calls: dict[str, SingleFlightCall] = {}
+        self.requests_made = 0
+        self.requests_saved = 0
+
+    def is_fresh(self, call: SingleFlightCall, now: float) -> bool:
+        return call.finished_at is None or now - call.finished_at < self.window
+
+    def prune(self, now: float) -> None:
+        self.calls = {k: c for k, c in self.calls.items() if self.is_fresh(c, now)}
+
+    def do(self, key: str, function: Callable[[], requests.Response]) -> requests.Response:
+        with self.lock:
+            now = time.monotonic()
+            call = self.calls.get(key)
+            leader = call is None or not self.is_fresh(call, now)
+            if leader:
+                self.prune(now)
+                call = SingleFlightCall()
+                self.calls[key] = call
+                self.requests_made += 1
+            else:
+                self.requests_saved += 1
+        metrics.record_cache('single-flight', not leader)
+        if leader:
+            try:
+                call.response = function()
+            except BaseException as e:
+                call.exception = e
+                raise
+            finally:
+                with self.lock:
+                    call.finished_at = time.monotonic()
+                    # failures are only shared with the callers already waiting on them, the next caller retries
+                    if call.exception is not None:
+                        self.calls.pop(key, None)
+                    self.prune(call.finished_at)
+                call.done.set()
+            return call.response
+        call.done.wait()
+        if call.exception is not None:
+            raise call.exception
+        return call.response
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {'requests': self.requests_made, 'saved': self.requests_saved}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.calls = {}
+            self.requests_made = 0
+            self.requests_saved = 0
+
+
+single_flight = SingleFlight(COALESCE_REQUESTS, SINGLE_FLIGHT_WINDOW)
+
+
+def set_single_flight(enabled: bool, window: float) -> None:
+    single_flight.enabled = enabled
+    single_flight.window = window
+
+
+def coalesce(key: str, function: Callable[[], requests.Response], stream: bool = False) -> requests.Response:
+    if not single_flight.enabled or stream:
+        return function()
+    return single_flight.do(key, function)
+
+
+def get_request_key(url, params, kwargs) -> str:
+    return jsonlib.dumps([url, params, kwargs], sort_keys=True, default=str)
+
+
+def get_host(url: str) -> str:
+    return urlsplit(url).hostname or ''
+
+
+def get_timeout(url: str) -> (float, float):
+    host = get_host(url)
+    for host_class, timeout in HOST_TIMEOUTS.items():
+        if host == host_class or host.endswith(f'.{host_class}'):
+            return timeout
+    return DEFAULT_TIMEOUT
+
+
+class RequestStats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.latencies: dict[str, deque[float]] = {}
+        self.counts = Counter()
+
+    def add_latency(self, host: str, latency: float) -> None:
+        with self.lock:
+            if host not in self.latencies:
+                self.latencies[host] = deque(maxlen=200)
+            self.latencies[host].append(latency)
+
+    def get_p95(self, host: str) -> Optional[float]:
+        with self.lock:
+            latencies = sorted(self.latencies.get(host, []))
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[int(len(latencies) * 0.95) - 1]
+
+    def count(self, name: str, host: Optional[str] = None, amount: int = 1) -> None:
+        with self.lock:
+            self.counts[name] += amount
+            if host is not None:
+                self.counts[f'{name}:{host}'] += amount
+
+    def get_count(self, name: str) -> int:
+        with self.lock:
+            return self.counts[name]
+
+    def reset(self) -> None:
+        with self.lock:
+            self.latencies = {}
+            self.counts = Counter()
+
+
+request_stats = RequestStats()
+
+
+class Hedger:
+    """Fires a duplicate of a GET that hasn't answered by its host's p95 latency, and takes whichever returns first"""
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.lock = threading.Lock()
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                # enough workers for every concurrent caller to have a request and its hedge in flight
+                max_workers = MAX_CONCURRENT_REQUESTS * MAX_CONCURRENT_CINEMAS * 2
+                self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge', initializer=profiling.disable_thread_profile)
+            return self.executor
+
+    def within_budget(self, host: str) -> bool:
+        hedged = request_stats.get_count(f'hedged:{host}')
+        sent = request_stats.get_count(f'requests:{host}')
+        return hedged < sent * HEDGE_MAX_FRACTION
+
+    def do(self, url: str, function: Callable[[], requests.Response]) -> requests.Response:
+        host = get_host(url)
+        p95 = request_stats.get_p95(host)
+        if not self.enabled or p95 is None:
+            return function()
+        executor = self.get_executor()
+        function = profiling.profile_task(function)
+        pending = {executor.submit(function)}
+        done, pending = wait(pending, timeout=max(p95, HEDGE_MIN_DELAY))
+        if not done and self.within_budget(host):
+            request_stats.count('hedged', host)
+            metrics.count_request(host, 'hedged')
+            hedge = executor.submit(function)
+            pending.add(hedge)
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if hedge in done and hedge.exception() is None:
+                request_stats.count('hedge_wins', host)
+                metrics.count_request(host, 'hedge_wins')
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+            if not pending:
+                # every attempt failed, so raise the error from one of them
+                return done.pop().result()
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+
+hedger = Hedger(HEDGE_REQUESTS)
+
+
+def set_hedging(enabled: bool) -> None:
+    hedger.enabled = enabled
+
+
+def reset_stats() -> None:
+    single_flight.reset()
+    request_stats.reset()
+
+
+host_sessions: dict[str, requests.Session] = {}
+host_sessions_lock = threading.Lock()
+keep_alive = False
+
+
+def set_keep_alive(enabled: bool) -> None:
+    # a long-running process keeps a session per host, so its connections stay open between runs
+    global keep_alive
+    keep_alive = enabled
+
+
+def get_host_session(host: str) -> requests.Session:
+    with host_sessions_lock:
+        if host not in host_sessions:
+            host_sessions[host] = requests.Session()
+        return host_sessions[host]
+
+
+def close_host_sessions() -> None:
+    with host_sessions_lock:
+        for session in host_sessions.values():
+            session.close()
+        host_sessions.clear()
+
+
+def request(method, url, session: Optional[requests.Session] = None, **kwargs):
+    host = get_host(url)
+    request_stats.count('requests', host)
+    started = time.monotonic()
+    if cassette.is_replaying():
+        r = cassette.active.replay(method, url, kwargs)
+        metrics.record_request(host, time.monotonic() - started, len(r.content))
+        return r
     log_url(url)
-    return requests.head(url, kwargs)
+    kwargs.setdefault('timeout', get_timeout(url))
+    if session is None and keep_alive:
+        session = get_host_session(host)
+    try:
+        if session is None:
+            r = requests.request(method, url, **kwargs)
+        else:
+            r = requests.Session.request(session, method, url, **kwargs)
+    except requests.exceptions.Timeout:
+        request_stats.count('timeouts', host)
+        metrics.count_request(host, 'timeouts')
+        raise
+    latency = time.monotonic() - started
+    request_stats.add_latency(host, latency)
+    # streamed bodies haven't been read yet, so only their advertised size is known
+    size = int(r.headers.get('content-length', 0)) if kwargs.get('stream', False) else len(r.content)
+    metrics.record_request(host, latency, size)
+    if cassette.is_recording():
+        cassette.active.record(method, url, kwargs, r)
+    if not kwargs.get('stream', False):
+        response_archive.record(method, url, kwargs, r)
+    return r
+
+
+def head(url, **kwargs):
+    kwargs.setdefault('allow_redirects', False)
+    return request('HEAD', url, **kwargs)
 
 
 def get(url, params=None, **kwargs):
-    log_url(url)
-    return requests.get(url, params, **kwargs)
+    def do_get():
+        return hedger.do(url, lambda: request('GET', url, params=params, **kwargs))
+
+    return coalesce(get_request_key(url, params, kwargs), do_get, kwargs.get('stream', False))
+
+
+def get_body(url, params=None, **kwargs) -> (requests.Response, streaming.ResponseBody):
+    # the body is read in chunks, and a large one is spooled to a file rather than held in memory, so it is archived from there
+    r = get(url, params=params, stream=True, **kwargs)
+    body = streaming.spool(r)
+    response_archive.record_body('GET', url, {**kwargs, 'params': params}, r, body)
+    return r, body
 
 
 def post(url, data=None, json=None, **kwargs):
-    log_url(url)
-    return requests.post(url, data, json, **kwargs)
+    return request('POST', url, data=data, json=json, **kwargs)
 
 
 def put(url, data=None, **kwargs):
-    log_url(url)
-    return requests.put(url, data, **kwargs)
+    return request('PUT', url, data=data, **kwargs)
 
 
 def patch(url, data=None, **kwargs):
-    log_url(url)
-    return requests.patch(url, data, **kwargs)
+    return request('PATCH', url, data=data, **kwargs)
 
 
 def delete(url, **kwargs):
-    log_url(url)
-    return requests.delete(url, **kwargs)
+    return request('DELETE', url, **kwargs)
+
+
+class Session(requests.Session):
+    def request(self, method, url, **kwargs):
+        if method.upper() != 'GET':
+            return request(method, url, session=self, **kwargs)
+
+        def do_get():
+            return hedger.do(url, lambda: request(method, url, session=self, **kwargs))
+
+        # the session's cookies are part of the request, so only sessions in the same state share a response
+        key = get_request_key(url, kwargs.get('params'), {**kwargs, 'sessionCookies': self.cookies.get_dict()})
+        r = coalesce(key, do_get, kwargs.get('stream', False))
+        # a response shared from another session still sets its cookies on this one
+        self.cookies.update(r.cookies)
+        return r
@@ -0,0 +1,250 @@
+import io
+import json
+import os
+import threading
+import time
+import zlib
+from contextlib import closing, contextmanager
+from datetime import datetime
+from typing import Optional, Iterator
+
+import requests
+
+from showingpreviously.cassette import get_request_key, get_response_metadata
+from showingpreviously.consts import DATA_DIR, RESPONSE_ARCHIVE_NAME, ARCHIVE_RESPONSES, RESPONSE_COMPRESSION_LEVEL, RESPONSE_FLUSH_ENTRIES, RESPONSE_DICTIONARY_SIZE, RESPONSE_DICTIONARY_MIN_SAMPLES, RESPONSE_DICTIONARY_MAX_AGE
+from showingpreviously.db import connect
+from showingpreviously.streaming import ResponseBody, SpooledBody
+
+try:
+    import zstandard
+except ImportError:
+    # without zstandard responses are compressed with zlib, and can't be trained a dictionary for
+    zstandard = None
+
+
+ZSTD = 'zstd'
+ZLIB = 'zlib'
+
+
+class ArchivedResponse:
+    __slots__ = ('utc_fetched', 'method', 'url', 'key', 'metadata', 'content', 'codec')
+
+    def __init__(self, utc_fetched: int, method: str, url: str, key: str, metadata: dict[str, any], content: bytes, codec: Optional[str] = None) -> None:
+        self.utc_fetched = utc_fetched
+        self.method = method
+        self.url = url
+        self.key = key
+        self.metadata = metadata
+        self.content = content
+        # the codec content is already compressed with, or None if it is still to be compressed when its batch is written
+        self.codec = codec
+
+
+class ResponseArchive:
+    """The raw responses of every chain run, compressed with a dictionary trained per chain, so they can be parsed again later"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+        self.chain_name: Optional[str] = None
+        self.run_started: Optional[int] = None
+        self.buffer: [ArchivedResponse] = []
+        self.archived = 0
+        self.conn_lock = threading.Lock()
+        self.dictionaries: dict[int, bytes] = {}
+        # chains whose responses a dictionary couldn't be trained on this run, which are compressed without one until the next run
+        self.untrainable_chains: set[str] = set()
+
+    def get_connection(self):
+        if self.conn is None:
+            self.conn = connect(self.path)
+            with closing(self.conn.cursor()) as cur:
+                cur.execute('CREATE TABLE IF NOT EXISTS dictionaries (id INTEGER PRIMARY KEY, chainName TEXT, utcTrained INT, data BLOB)')
+                cur.execute(
+                    'CREATE TABLE IF NOT EXISTS responses (id INTEGER PRIMARY KEY, chainName TEXT, utcRunStarted INT, utcFetched INT, method TEXT, url TEXT, '
+                    'requestKey TEXT, jsonMetadata TEXT, codec TEXT, dictionaryId INT, content BLOB, FOREIGN KEY (dictionaryId) REFERENCES dictionaries (id))'
+                )
+                cur.execute('CREATE INDEX IF NOT EXISTS responsesByRun ON responses (chainName, utcRunStarted)')
+                cur.execute('CREATE INDEX IF NOT EXISTS responsesByUrl ON responses (chainName, url, utcFetched)')
+            self.conn.commit()
+        return self.conn
+
+    def start_run(self, chain_name: str) -> None:
+        with self.lock:
+            self.chain_name = chain_name
+            self.run_started = int(time.time())
+            self.buffer = []
+            self.archived = 0
+        with self.conn_lock:
+            self.untrainable_chains.discard(chain_name)
+
+    def add(self, method: str, url: str, key: str, metadata: dict[str, any], content: bytes, codec: Optional[str] = None) -> None:
+        with self.lock:
+            if self.chain_name is None:
+                return
+            self.buffer.append(ArchivedResponse(int(time.time()), method.upper(), url, key, metadata, content, codec))
+            if len(self.buffer) < RESPONSE_FLUSH_ENTRIES:
+                return
+            chain_name, run_started, batch = self.chain_name, self.run_started, self.buffer
+            self.buffer = []
+        # the thread which fills a batch writes it, so bodies are only held until there are enough to compress together
+        self.write(chain_name, run_started, batch)
+
+    def get_dictionary(self, chain_name: str) -> (Optional[int], Optional[bytes]):
+        row = self.get_connection().execute(
+            'SELECT id, utcTrained, data FROM dictionaries WHERE chainName = ? ORDER BY utcTrained DESC LIMIT 1', (chain_name,)
+        ).fetchone()
+        if row is None:
+            return None, None
+        dictionary_id, utc_trained, data = row
+        # listings drift as sites change, so an old dictionary is retrained on newer responses
+        if time.time() - utc_trained > RESPONSE_DICTIONARY_MAX_AGE:
+            return None, None
+        return dictionary_id, data
+
+    def train_dictionary(self, chain_name: str, samples: [bytes]) -> (Optional[int], Optional[bytes]):
+        if zstandard is None or len(samples) < RESPONSE_DICTIONARY_MIN_SAMPLES:
+            return None, None
+        try:
+            data = zstandard.train_dictionary(RESPONSE_DICTIONARY_SIZE, samples).as_bytes()
+        except zstandard.ZstdError:
+            # the responses are too few or too alike to train on, which later batches of the run are unlikely to change
+            self.untrainable_chains.add(chain_name)
+            return None, None
+        cur = self.get_connection().execute('INSERT INTO dictionaries (chainName, utcTrained, data) VALUES (?, ?, ?)', (chain_name, int(time.time()), data,))
+        return cur.lastrowid, data
+
+    def write(self, chain_name: str, run_started: int, batch: [ArchivedResponse]) -> None:
+        with self.conn_lock:
+            dictionary_id, dictionary = self.get_dictionary(chain_name)
+            if dictionary_id is None and chain_name not in self.untrainable_chains:
+                # a chain's first batch trains its dictionary, when it has enough responses to
+                dictionary_id, dictionary = self.train_dictionary(chain_name, [response.content for response in batch if response.codec is None])
+                self.get_connection().commit()
+        codec, compress = get_compress(dictionary)
+        rows = [(chain_name, run_started, response.utc_fetched, response.method, response.url, response.key, json.dumps(response.metadata), codec, dictionary_id, compress(response.content),)
+                if response.codec is None else
+                (chain_name, run_started, response.utc_fetched, response.method, response.url, response.key, json.dumps(response.metadata), response.codec, None, response.content,)
+                for response in batch]
+        with self.conn_lock:
+            conn = self.get_connection()
+            conn.executemany(
+                'INSERT INTO responses (chainName, utcRunStarted, utcFetched, method, url, requestKey, jsonMetadata, codec, dictionaryId, content) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            conn.commit()
+        with self.lock:
+            self.archived += len(batch)
+
+    def flush(self) -> int:
+        # writes what is left of the run's responses, and returns how many were archived in all
+        with self.lock:
+            chain_name, run_started, buffer = self.chain_name, self.run_started, self.buffer
+            self.chain_name, self.run_started, self.buffer = None, None, []
+        if chain_name is None:
+            return 0
+        if len(buffer) > 0:
+            self.write(chain_name, run_started, buffer)
+        with self.lock:
+            return self.archived
+
+    def get_runs(self, chain_name: Optional[str] = None, since: Optional[datetime] = None, until: Optional[datetime] = None) -> [(str, int)]:
+        conditions = ['utcRunStarted >= ?', 'utcRunStarted <= ?']
+        parameters = [int(since.timestamp()) if since is not None else 0, int(until.timestamp()) if until is not None else 2 ** 62]
+        if chain_name is not None:
+            conditions.append('chainName = ?')
+            parameters.append(chain_name)
+        with self.conn_lock:
+            return self.get_connection().execute(
+                f'SELECT DISTINCT chainName, utcRunStarted FROM responses WHERE {" AND ".join(conditions)} ORDER BY utcRunStarted', parameters
+            ).fetchall()
+
+    def get_entries(self, chain_name: str, run_started: int) -> [dict[str, any]]:
+        # entries are in the format of a cassette, so a run can be replayed through its chain
+        with self.conn_lock:
+            rows = self.get_connection().execute(
+                'SELECT requestKey, jsonMetadata, codec, dictionaryId, content FROM responses WHERE chainName = ? AND utcRunStarted = ? ORDER BY id',
+                (chain_name, run_started,)
+            ).fetchall()
+            entries = []
+            for key, json_metadata, codec, dictionary_id, content in rows:
+                dictionary = self.load_dictionary(dictionary_id)
+                entries.append({**json.loads(json_metadata), 'key': key, 'content': decompress(codec, dictionary, content)})
+        return entries
+
+    def load_dictionary(self, dictionary_id: Optional[int]) -> Optional[bytes]:
+        if dictionary_id is None:
+            return None
+        if dictionary_id not in self.dictionaries:
+            self.dictionaries[dictionary_id] = self.get_connection().execute('SELECT data FROM dictionaries WHERE id = ?', (dictionary_id,)).fetchone()[0]
+        return self.dictionaries[dictionary_id]
+
+
+def get_compress(dictionary: Optional[bytes]) -> (str, callable):
+    if zstandard is None:
+        return ZLIB, lambda content: zlib.compress(content, 9)
+    dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary is not None else None
+    compressor = zstandard.ZstdCompressor(level=RESPONSE_COMPRESSION_LEVEL, dict_data=dict_data)
+    return ZSTD, compressor.compress
+
+
+def compress_file(body: SpooledBody) -> (str, bytes):
+    # a spooled body is compressed as it is read from its file, without a dictionary, so it is never in memory uncompressed
+    if zstandard is None:
+        compressor = zlib.compressobj(9)
+        return ZLIB, b''.join([compressor.compress(chunk) for chunk in body.iter_chunks()] + [compressor.flush()])
+    compressed = io.BytesIO()
+    with open(body.path, 'rb') as f:
+        zstandard.ZstdCompressor(level=RESPONSE_COMPRESSION_LEVEL).copy_stream(f, compressed, size=body.size)
+    return ZSTD, compressed.getvalue()
+
+
+def decompress(codec: str, dictionary: Optional[bytes], content: bytes) -> bytes:
+    if codec == ZLIB:
+        return zlib.decompress(content)
+    if zstandard is None:
+        raise RuntimeError('The zstandard package is needed to read responses archived with zstd')
+    dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary is not None else None
+    return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(content)
+
+
+response_archive = ResponseArchive(os.path.join(DATA_DIR, RESPONSE_ARCHIVE_NAME))
+enabled = ARCHIVE_RESPONSES
+
+
+def set_enabled(archive_responses: bool) -> None:
+    global enabled
+    enabled = archive_responses
+
+
+@contextmanager
+def archive_run(chain_name: str) -> Iterator[None]:
+    if not enabled:
+        yield
+        return
+    response_archive.start_run(chain_name)
+    try:
+        yield
+    finally:
+        response_archive.flush()
+
+
+def record(method: str, url: str, kwargs: dict[str, any], r: requests.Response) -> None:
+    if enabled:
+        response_archive.add(method, url, get_request_key(method, url, kwargs), get_response_metadata(r), r.content)
+
+
+def record_body(method: str, url: str, kwargs: dict[str, any], r: requests.Response, body: ResponseBody) -> None:
+    if not enabled:
+        return
+    if isinstance(body, SpooledBody):
+        codec, content = compress_file(body)
+        response_archive.add(method, url, get_request_key(method, url, kwargs), get_response_metadata(r), content, codec)
+    else:
+        response_archive.add(method, url, get_request_key(method, url, kwargs), get_response_metadata(r), body)
+
+
+def record_content(method: str, url: str, content: str) -> None:
+    if enabled:
+        response_archive.add(method, url, get_request_key(method, url, {}), {}, content.encode('utf-8'))
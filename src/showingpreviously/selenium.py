@@ -1,31 +1,155 @@
+import fcntl
+import os
+import re
+import shutil
+import tempfile
+
 from selenium import webdriver, common
 from selenium.webdriver.chrome.options import Options as ChromeOptions
 from selenium.webdriver.firefox.options import Options as FirefoxOptions
 from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.support.ui import WebDriverWait
 
 from typing import Optional
 
+import showingpreviously.cassette as cassette
+import showingpreviously.response_archive as response_archive
+from showingpreviously.consts import DATA_DIR, BROWSER_PROFILE_DIR_NAME, BROWSER_BLOCKED_URLS, BROWSER_WAIT_TIMEOUT, BROWSER_POLL_INTERVAL
+
 
 WEBDRIVER: Optional[WebDriver] = None
+PROFILE_DIR = os.path.join(DATA_DIR, BROWSER_PROFILE_DIR_NAME)
+PROFILE_LOCK = None
+TEMPORARY_PROFILE_DIR: Optional[str] = None
+# files a browser keeps in its profile while it is running, which mustn't be copied into another one
+PROFILE_LOCK_FILES = shutil.ignore_patterns('Singleton*', 'lockfile', 'lock', '.parentlock', 'parent.lock')
+
+# the text of the first script or the whole document containing the marker, or null if it hasn't been added yet
+FIND_MARKER_SCRIPT = '''
+const marker = arguments[0];
+for (const script of document.scripts) {
+    if (script.textContent.includes(marker)) {
+        return script.textContent;
+    }
+}
+const html = document.documentElement ? document.documentElement.outerHTML : '';
+return html.includes(marker) ? html : null;
+'''
+
+
+def get_profile_dir(browser: str) -> str:
+    # the shared profile is used by one process at a time. another process on the host, like a cron run next to the
+    # daemon, uses a copy of it instead, which is deleted when its browser is closed
+    global PROFILE_LOCK, TEMPORARY_PROFILE_DIR
+    shared_dir = os.path.join(PROFILE_DIR, browser)
+    os.makedirs(shared_dir, exist_ok=True)
+    lock_file = open(os.path.join(PROFILE_DIR, f'{browser}.lock'), 'a')
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        TEMPORARY_PROFILE_DIR = tempfile.mkdtemp(prefix=f'{browser}-{os.getpid()}-', dir=PROFILE_DIR)
+        try:
+            shutil.copytree(shared_dir, TEMPORARY_PROFILE_DIR, ignore=PROFILE_LOCK_FILES, ignore_dangling_symlinks=True, dirs_exist_ok=True)
+        except shutil.Error:
+            pass  # files the other browser changed while they were copied are left out, the profile is only a cache
+        return TEMPORARY_PROFILE_DIR
+    PROFILE_LOCK = lock_file
+    return shared_dir
+
+
+def release_profile_dir() -> None:
+    global PROFILE_LOCK, TEMPORARY_PROFILE_DIR
+    if PROFILE_LOCK is not None:
+        fcntl.flock(PROFILE_LOCK.fileno(), fcntl.LOCK_UN)
+        PROFILE_LOCK.close()
+        PROFILE_LOCK = None
+    if TEMPORARY_PROFILE_DIR is not None:
+        shutil.rmtree(TEMPORARY_PROFILE_DIR, ignore_errors=True)
+        TEMPORARY_PROFILE_DIR = None
+
+
+def is_browser_unavailable(e: common.exceptions.WebDriverException) -> bool:
+    # only a browser or driver that isn't installed falls back to the other browser, so a profile or session error isn't
+    # hidden by quietly running firefox, which can't block urls
+    message = (e.msg or '').lower()
+    return isinstance(e, common.exceptions.NoSuchDriverException) or 'binary' in message or 'not found' in message or 'unable to obtain' in message
+
+
+def get_chrome_webdriver() -> WebDriver:
+    chrome_options = ChromeOptions()
+    # running headless will stop cloudflare from working
+    # chrome_options.headless = True
+    # get() returns once the HTML is parsed, rather than after every image, font and script has loaded
+    chrome_options.page_load_strategy = 'eager'
+    # the profile is kept between runs, so cookies such as cloudflare's clearance are reused
+    chrome_options.add_argument(f'--user-data-dir={get_profile_dir("chrome")}')
+    chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+    chrome_options.add_argument('--disable-extensions')
+    chrome_options.add_argument('--mute-audio')
+    driver = webdriver.Chrome(options=chrome_options)
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BROWSER_BLOCKED_URLS})
+    return driver
+
+
+def get_firefox_webdriver() -> WebDriver:
+    firefox_options = FirefoxOptions()
+    # running headless will stop cloudflare from working
+    # firefox_options.headless = True
+    firefox_options.page_load_strategy = 'eager'
+    profile_dir = get_profile_dir('firefox')
+    firefox_options.add_argument('-profile')
+    firefox_options.add_argument(profile_dir)
+    # firefox can't block urls by pattern, but can skip images, fonts and media
+    firefox_options.set_preference('permissions.default.image', 2)
+    firefox_options.set_preference('browser.display.use_document_fonts', 0)
+    firefox_options.set_preference('media.autoplay.default', 5)
+    return webdriver.Firefox(options=firefox_options)
 
 
 def get_selenium_webdriver() -> WebDriver:
     global WEBDRIVER
     if WEBDRIVER is None:
         try:
-            chrome_options = ChromeOptions()
-            # running headless will stop cloudflare from working
-            # chrome_options.headless = True
-            WEBDRIVER = webdriver.Chrome(options=chrome_options)
-        except common.exceptions.WebDriverException:
-            firefox_options = FirefoxOptions()
-            # running headless will stop cloudflare from working
-            # firefox_options.headless = True
-            WEBDRIVER = webdriver.Firefox(options=firefox_options)
+            WEBDRIVER = get_chrome_webdriver()
+        except common.exceptions.WebDriverException as e:
+            release_profile_dir()
+            if not is_browser_unavailable(e):
+                raise
+            try:
+                WEBDRIVER = get_firefox_webdriver()
+            except common.exceptions.WebDriverException:
+                release_profile_dir()
+                raise
     return WEBDRIVER
 
 
 def close_selenium_webdriver() -> None:
     global WEBDRIVER
     if WEBDRIVER is not None:
-        WEBDRIVER.close()
+        WEBDRIVER.quit()
+        WEBDRIVER = None
+    release_profile_dir()
+
+
+def find_in_page(url: str, marker: str, pattern: re.Pattern) -> re.Match:
+    # the page is polled until the marker appears, and left as soon as it does, so nothing else on it is waited for
+    if cassette.is_replaying():
+        content = cassette.active.replay_content('BROWSER', url)
+    else:
+        driver = get_selenium_webdriver()
+        driver.get(url)
+        content = WebDriverWait(driver, BROWSER_WAIT_TIMEOUT, poll_frequency=BROWSER_POLL_INTERVAL).until(
+            lambda d: d.execute_script(FIND_MARKER_SCRIPT, marker)
+        )
+        # the page is unloaded, so it doesn't hold the browser's memory or keep loading until the next one
+        driver.execute_script('window.stop();')
+        driver.get('about:blank')
+        if cassette.is_recording():
+            cassette.active.record_content('BROWSER', url, content)
+        response_archive.record_content('BROWSER', url, content)
+    match = pattern.search(content)
+    if match is None:
+        raise common.exceptions.NoSuchElementException(f'"{marker}" was found in {url}, but not in the expected format')
+    return match
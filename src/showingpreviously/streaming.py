@@ -0,0 +1,138 @@
+import json
+import os
+import tempfile
+from contextlib import closing
+from typing import Callable, Iterator, Union
+
+import requests
+
+from showingpreviously.consts import STREAM_JSON_MIN_SIZE, STREAM_CHUNK_SIZE
+
+try:
+    import ijson
+except ImportError:
+    # without ijson documents are decoded whole, which gives the same values using more memory
+    ijson = None
+
+
+# the errors a document that isn't valid JSON raises, from whichever decoder is used
+DECODE_ERRORS = (json.JSONDecodeError,) + ((ijson.JSONError,) if ijson is not None else ())
+
+
+min_stream_size = STREAM_JSON_MIN_SIZE
+
+
+def set_min_stream_size(size: int) -> None:
+    global min_stream_size
+    min_stream_size = size
+
+
+class SpooledBody:
+    """
+    A response body read from the network in chunks into a temporary file, so a large listing is never held in memory
+    whole. Only its path is pickled, so it can be parsed by the parse pool's workers, and it is removed once parsed.
+    """
+
+    def __init__(self, path: str, size: int) -> None:
+        self.path = path
+        self.size = size
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        with open(self.path, 'rb') as f:
+            while chunk := f.read(STREAM_CHUNK_SIZE):
+                yield chunk
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+ResponseBody = Union[bytes, SpooledBody]
+
+
+def spool(r: requests.Response) -> ResponseBody:
+    # r is a response requested with stream=True. a body which ends before min_stream_size is returned as bytes, and a
+    # longer one is written to a file as it is read. its length isn't known beforehand, as it may be compressed in transit
+    if ijson is None:
+        return r.content
+    chunks = r.iter_content(STREAM_CHUNK_SIZE)
+    head = bytearray()
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= min_stream_size:
+            break
+    else:
+        return bytes(head)
+    f = tempfile.NamedTemporaryFile('wb', prefix='showingpreviously-', suffix='.json', delete=False)
+    try:
+        with f:
+            f.write(head)
+            del head
+            for chunk in chunks:
+                f.write(chunk)
+        return SpooledBody(f.name, os.path.getsize(f.name))
+    except BaseException:
+        os.remove(f.name)
+        raise
+
+
+def get_size(body: ResponseBody) -> int:
+    return body.size if isinstance(body, SpooledBody) else len(body)
+
+
+def discard(body: ResponseBody) -> None:
+    if isinstance(body, SpooledBody):
+        body.remove()
+
+
+class JsonDocument:
+    """
+    A JSON response read a path at a time, so the objects of a large array are decoded one at a time, rather than the
+    whole document being decoded into a tree that lives alongside the showings parsed from it. A spooled body is read
+    from its file on each pass, so only about one object is in memory at a time. Streaming is slower than decoding, so
+    responses smaller than min_stream_size are decoded whole.
+    """
+
+    def __init__(self, content: ResponseBody) -> None:
+        self.content = content
+        self.decoded = None
+        self.streamed = ijson is not None and get_size(content) >= min_stream_size
+
+    def get_decoded(self, path: str) -> any:
+        if self.decoded is None:
+            if isinstance(self.content, SpooledBody):
+                with open(self.content.path, 'rb') as f:
+                    self.decoded = json.load(f)
+            else:
+                self.decoded = json.loads(self.content)
+        value = self.decoded
+        for key in path.split('.') if path else []:
+            value = value[key]
+        return value
+
+    def stream(self, read: Callable[..., Iterator[any]], path: str) -> Iterator[any]:
+        if isinstance(self.content, SpooledBody):
+            with open(self.content.path, 'rb') as f:
+                yield from read(f, path, use_float=True)
+        else:
+            yield from read(self.content, path, use_float=True)
+
+    def get_value(self, path: str) -> any:
+        if not self.streamed:
+            return self.get_decoded(path)
+        with closing(self.stream(ijson.items, path)) as values:
+            for value in values:
+                return value
+        raise KeyError(path)
+
+    def get_values(self, path: str) -> dict[str, any]:
+        # every key of the object at path, in one pass over the document
+        if not self.streamed:
+            return dict(self.get_decoded(path))
+        return dict(self.stream(ijson.kvitems, path))
+
+    def iter_items(self, path: str) -> Iterator[any]:
+        if not self.streamed:
+            yield from self.get_decoded(path)
+            return
+        yield from self.stream(ijson.items, f'{path}.item')
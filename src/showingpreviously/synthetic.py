@@ -0,0 +1,128 @@
+import random
+from datetime import datetime, timedelta
+
+from bs4 import BeautifulSoup
+
+
+# sizes of a typical production response, which the benchmark scales are multiples of
+VISTA_SITES = 120
+VISTA_SHOWTIMES = 3000
+CINEWORLD_FILMS = 30
+CINEWORLD_EVENTS = 150
+VUE_FILMS = 25
+VUE_TIMES_PER_FILM = 6
+ISLE_OF_BUTE_ROWS = 31
+ATTRIBUTE_LISTS = 1000
+
+CINEWORLD_ATTRIBUTES = ['audio-described', '2d', '3d', 'imax', '4dx', 'screenx', 'sub-titled', 'hindi', 'tamil', 'dubbed', 'kids', 'vip', 'subbed', 'spanish-sub']
+VUE_TAGS = ['AD', 'ST', 'Event', 'Live', '4K', 'Atmos', 'IMAX', 'Seniors', 'Baby', 'Standard', 'Recliner']
+LPVS_COLLECTIONS = ['Audio Description', 'Subtitled for hard of hearing', 'Silver Screen', 'Baby-friendly', 'Big Screen', 'Meerkat Movies']
+OMNIPLEX_AT = ['', 'Subtitled', 'Sensory Friendly', 'Subtitled Sensory', 'Maxx', 'Kids Club']
+PICTUREHOUSE_ATTRIBUTES = ['ad-trailer', 'Sub Cinema', 'LiveSat', 'Audio D', 'HOHSub', 'Dolby Atmo', '4K', 'Toddler Ti', 'Big Scream', 'Kids Club']
+EMPIRE_IMAGE_ALTS = ['Audio Described Available', 'D-Box', 'IMPACT®', 'IMAX', 'Broadcast Live!', 'Subtitled', 'EMPIRE Jnrs', 'EMPIRE Seniors', 'Recliner']
+VISTA_ATTRIBUTE_NAMES = ['Audio Described', 'Hindi (Audio)', 'Open Captioned', 'IMAX', 'iSense', 'Dolby Cinema', '4K', 'Standard', 'Luxe', 'Kids']
+
+
+def get_random(scale: int) -> random.Random:
+    # payloads are the same on every run, so benchmark results are comparable
+    return random.Random(scale)
+
+
+def pick_some(rand: random.Random, choices: [any], most: int = 3) -> [any]:
+    return rand.sample(choices, rand.randint(0, most))
+
+
+def vista_showings_data(scale: int) -> dict[str, any]:
+    rand = get_random(scale)
+    site_count = VISTA_SITES * scale
+    sites = [{'id': f'site-{i}', 'name': {'text': f'Odeon Site {i}'}} for i in range(site_count)]
+    screens = [{'id': f'screen-{i}-{j}', 'name': {'text': f'Screen {j + 1}'}} for i in range(site_count) for j in range(8)]
+    films = [{'id': f'film-{i}', 'title': {'text': f'Synthetic Film {i}'}, 'releaseDate': f'{2000 + i % 25}-06-01T00:00:00'} for i in range(80 * scale)]
+    attributes = [{'id': f'attribute-{i}', 'name': {'text': name}} for i, name in enumerate(VISTA_ATTRIBUTE_NAMES)]
+    attribute_ids = [attribute['id'] for attribute in attributes]
+    start = datetime.now().replace(hour=10, minute=0, second=0, microsecond=0)
+    showtimes = []
+    for i in range(VISTA_SHOWTIMES * scale):
+        site = rand.randrange(site_count)
+        starts_at = start + timedelta(minutes=15 * rand.randrange(56))
+        showtimes.append({
+            'siteId': f'site-{site}',
+            'screenId': f'screen-{site}-{rand.randrange(8)}',
+            'filmId': rand.choice(films)['id'],
+            'schedule': {'startsAt': starts_at.isoformat() + '+00:00'},
+            'attributeIds': pick_some(rand, attribute_ids),
+        })
+    return {'showtimes': showtimes, 'relatedData': {'sites': sites, 'screens': screens, 'films': films, 'attributes': attributes}}
+
+
+def cineworld_showings_data(scale: int) -> dict[str, any]:
+    rand = get_random(scale)
+    films = [{'id': f'film-{i}', 'name': f'Synthetic Film {i}', 'releaseYear': str(2000 + i % 25)} for i in range(CINEWORLD_FILMS * scale)]
+    start = datetime.now().replace(hour=10, minute=0, second=0, microsecond=0)
+    events = []
+    for i in range(CINEWORLD_EVENTS * scale):
+        event_time = start + timedelta(minutes=15 * rand.randrange(56))
+        events.append({
+            'filmId': rand.choice(films)['id'],
+            'auditorium': str(rand.randint(1, 20)),
+            'eventDateTime': event_time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'attributeIds': pick_some(rand, CINEWORLD_ATTRIBUTES, 5),
+        })
+    return {'body': {'films': films, 'events': events}}
+
+
+def vue_showings_data(scale: int) -> dict[str, any]:
+    rand = get_random(scale)
+    date = datetime.now().strftime('%Y-%m-%d')
+    films = []
+    for i in range(VUE_FILMS * scale):
+        times = []
+        for j in range(VUE_TIMES_PER_FILM):
+            tags = [{'name': name, 'is_imax': name == 'IMAX'} for name in pick_some(rand, VUE_TAGS)]
+            times.append({'screen_name': f'Screen {rand.randint(1, 12)}', 'time': f'{rand.randint(1, 11)}:{rand.choice(["00", "15", "30", "45"])} PM', 'tags': tags})
+        films.append({'title': f'Synthetic Film {i}', 'info_release': f'01 Jun {2000 + i % 25}', 'showings': [{'date_time': date, 'times': times}]})
+    return {'films': films}
+
+
+def isle_of_bute_rows(scale: int) -> [BeautifulSoup]:
+    rand = get_random(scale)
+    start = datetime.now() + timedelta(days=1)
+    rows = ['<tr><td>Date</td><td>Day</td><td>Film - Afternoon</td><td>Time</td><td>Film - Evening</td><td>Time</td></tr>']
+    for i in range(ISLE_OF_BUTE_ROWS * scale):
+        date = start + timedelta(days=i)
+        afternoon = f'Synthetic Film {rand.randrange(40)} (PG)' if rand.random() < 0.6 else ''
+        afternoon_time = '2.30pm' if afternoon else ''
+        rows.append(f'<tr><td>{date.strftime("%d/%m/%Y")}</td><td>{date.strftime("%A")}</td><td>{afternoon}</td>'
+                    f'<td>{afternoon_time}</td><td>Synthetic Film {rand.randrange(40)} (12A)</td><td>7.30pm</td></tr>')
+    soup = BeautifulSoup(f'<table>{"".join(rows)}</table>', features='html.parser')
+    return soup.find_all('tr')[1:]
+
+
+def attribute_lists(choices: [any], scale: int, most: int = 4) -> [[any]]:
+    rand = get_random(scale)
+    return [pick_some(rand, choices, most) for _ in range(ATTRIBUTE_LISTS * scale)]
+
+
+def cineworld_attribute_lists(scale: int) -> [[str]]:
+    return attribute_lists(CINEWORLD_ATTRIBUTES, scale, 5)
+
+
+def vue_tag_lists(scale: int) -> [dict[str, any]]:
+    return [{'tags': [{'name': name, 'is_imax': name == 'IMAX'} for name in names]} for names in attribute_lists(VUE_TAGS, scale)]
+
+
+def lpvs_collection_lists(scale: int) -> [[dict[str, any]]]:
+    return [[{'Title': title} for title in titles] for titles in attribute_lists(LPVS_COLLECTIONS, scale)]
+
+
+def omniplex_attribute_strings(scale: int) -> [str]:
+    rand = get_random(scale)
+    return [rand.choice(OMNIPLEX_AT) for _ in range(ATTRIBUTE_LISTS * scale)]
+
+
+def picturehouse_attribute_lists(scale: int) -> [[dict[str, any]]]:
+    return [[{'attribute': attribute} for attribute in attributes] for attributes in attribute_lists(PICTUREHOUSE_ATTRIBUTES, scale)]
+
+
+def empire_image_lists(scale: int) -> [[dict[str, any]]]:
+    return [[{'alt': alt} for alt in alts] for alts in attribute_lists(EMPIRE_IMAGE_ALTS, scale)]
@@ -0,0 +1,23 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# the data directory is worked out when showingpreviously is imported, so the tests are given their own first
+os.environ['XDG_DATA_HOME'] = tempfile.mkdtemp(prefix='showingpreviously-tests-')
+atexit.register(shutil.rmtree, os.environ['XDG_DATA_HOME'], True)
+
+import showingpreviously.db as db
+
+
+@pytest.fixture
+def archive(tmp_path):
+    db.use_database(str(tmp_path / 'showtimes.db'))
+    return db
+
+
+def count_showings() -> int:
+    with db.read_connection() as read_conn:
+        return read_conn.execute('SELECT COUNT(*) FROM showings').fetchone()[0]
@@ -0,0 +1,49 @@
+import json
+
+import showingpreviously.db as db
+
+from conftest import count_showings
+
+
+def make_row(film_name: str, utc_epoch: int, attributes: dict[str, any]) -> (str, str, str, str, str, str, int, str):
+    return film_name, '2023', 'Test Chain', 'Test Cinema', 'UTC', 'Screen 1', utc_epoch, json.dumps(attributes)
+
+
+def make_shard(path: str, rows: [tuple]) -> str:
+    db.use_database(path)
+    db.add_showings(rows)
+    return path
+
+
+def get_attributes(film_name: str) -> dict[str, any]:
+    with db.read_connection() as read_conn:
+        return json.loads(read_conn.execute('SELECT jsonAttributes FROM showings WHERE filmName = ?', (film_name,)).fetchone()[0])
+
+
+def test_add_showings_counts_new_and_replaced(archive):
+    assert db.add_showings([make_row('A', 1, {}), make_row('B', 2, {})]) == (2, 0)
+    assert db.add_showings([make_row('A', 1, {'format': ['IMAX']}), make_row('C', 3, {})]) == (1, 1)
+    assert get_attributes('A') == {'format': ['IMAX']}
+    assert db.db_info() == (1, 1, 1, 3, 3)
+
+
+def test_merge_copies_shards_and_later_sources_win(tmp_path):
+    first = make_shard(str(tmp_path / 'first.db'), [make_row('A', 1, {'format': ['2D']}), make_row('B', 2, {})])
+    second = make_shard(str(tmp_path / 'second.db'), [make_row('A', 1, {'format': ['IMAX']}), make_row('C', 3, {})])
+    db.use_database(str(tmp_path / 'showtimes.db'))
+    result = db.merge_databases([first, second])
+    # the second source's showing of A is written over the first's
+    assert result.rows['showings'] == 4
+    assert count_showings() == 3
+    assert get_attributes('A') == {'format': ['IMAX']}
+    assert db.db_info()[4] == 3
+
+
+def test_merging_again_adds_nothing(tmp_path):
+    shard = make_shard(str(tmp_path / 'shard.db'), [make_row('A', 1, {}), make_row('B', 2, {})])
+    db.use_database(str(tmp_path / 'showtimes.db'))
+    db.merge_databases([shard])
+    result = db.merge_databases([shard])
+    assert result.rows['showings'] == 0
+    assert not result.rebuilt_stats
+    assert db.db_info()[4] == 2
@@ -0,0 +1,68 @@
+import showingpreviously.distributed as distributed
+from showingpreviously.consts import WORK_MAX_ATTEMPTS
+from showingpreviously.distributed import WorkQueue, QUEUED, RUNNING, FAILED, DONE
+
+
+def make_queue(tmp_path, units: [str]) -> WorkQueue:
+    queue = WorkQueue(str(tmp_path / 'queue.db'))
+    queue.enqueue('run', 'Chain', units)
+    return queue
+
+
+def get_unit(queue: WorkQueue, unit_id: int) -> (str, int):
+    return queue.conn.execute('SELECT state, attempts FROM units WHERE id = ?', (unit_id,)).fetchone()
+
+
+def test_units_are_leased_once_in_order(tmp_path):
+    queue = make_queue(tmp_path, ['a', 'b'])
+    first = queue.lease('worker-1')
+    second = queue.lease('worker-2')
+    assert [first[2], second[2]] == ['a', 'b']
+    assert queue.lease('worker-3') is None
+    queue.finish(first[0], 3, ['Chain'])
+    queue.finish(second[0], 4, ['Chain'])
+    assert queue.get_counts('run') == {DONE: 2}
+    assert not queue.has_pending()
+
+
+def test_failed_units_are_queued_again_until_out_of_attempts(tmp_path):
+    queue = make_queue(tmp_path, ['a'])
+    for attempt in range(1, WORK_MAX_ATTEMPTS + 1):
+        unit_id, _, _ = queue.lease('worker')
+        queue.fail(unit_id, 'error')
+        assert get_unit(queue, unit_id) == (QUEUED if attempt < WORK_MAX_ATTEMPTS else FAILED, attempt)
+    assert queue.lease('worker') is None
+    assert not queue.has_pending()
+
+
+def test_expired_leases_are_leased_again(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path, ['a'])
+    unit_id, _, _ = queue.lease('lost-worker')
+    assert queue.lease('worker') is None
+    # every lease is expired as soon as it is taken
+    monkeypatch.setattr(distributed, 'WORK_LEASE_TIMEOUT', -1)
+    assert queue.lease('worker')[0] == unit_id
+    assert get_unit(queue, unit_id) == (RUNNING, 2)
+
+
+def test_expired_leases_fail_on_their_last_attempt(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path, ['a'])
+    monkeypatch.setattr(distributed, 'WORK_LEASE_TIMEOUT', -1)
+    for _ in range(WORK_MAX_ATTEMPTS):
+        unit_id, _, _ = queue.lease('lost-worker')
+    # a unit which kills every worker it runs on isn't leased again, so a waiting worker can finish
+    assert queue.lease('worker') is None
+    assert get_unit(queue, unit_id) == (FAILED, WORK_MAX_ATTEMPTS)
+    assert not queue.has_pending()
+
+
+def test_archived_chains_only_include_chains_with_every_unit_done(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'))
+    queue.enqueue('run', 'Done', ['a'])
+    queue.enqueue('run', 'Failed', ['a'])
+    done_id, _, _ = queue.lease('worker')
+    queue.finish(done_id, 1, ['Done Chain'])
+    failed_id, _, _ = queue.lease('worker')
+    queue.conn.execute('UPDATE units SET attempts = ? WHERE id = ?', (WORK_MAX_ATTEMPTS, failed_id,))
+    queue.fail(failed_id, 'error')
+    assert queue.get_archived_chains('run') == ['Done Chain']
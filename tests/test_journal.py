@@ -0,0 +1,120 @@
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+from showingpreviously.journal import Journal, JournalLockedException, CompactResult, RECORD_HEADER, read_segment
+from showingpreviously.model import Showing, Film, Chain, Cinema, Screen
+
+from conftest import count_showings
+
+
+def make_showing(i: int) -> (Showing, datetime):
+    time = datetime(2024, 1, 1 + i // 24, i % 24)
+    showing = Showing(Film(f'Film {i % 5}', '2023'), time, Chain('Test Chain'), Cinema('Test Cinema', 'UTC'), Screen('Screen 1'), {'format': ['2D']})
+    return showing, time.replace(tzinfo=timezone.utc)
+
+
+def write_segment(directory: str, count: int) -> str:
+    # a journal which is never started or closed is a process which died before compacting its segment
+    os.makedirs(directory, exist_ok=True)
+    journal = Journal(directory)
+    for i in range(count):
+        journal.append(*make_showing(i))
+    journal.seal()
+    [(_, path)] = journal.get_segments()
+    return path
+
+
+def get_record_offsets(path: str) -> [int]:
+    offsets = []
+    with open(path, 'rb') as f:
+        while header := f.read(RECORD_HEADER.size):
+            offsets.append(f.tell() - RECORD_HEADER.size)
+            length, _ = RECORD_HEADER.unpack(header)
+            f.seek(length, os.SEEK_CUR)
+    return offsets
+
+
+def test_recovers_segments_left_by_a_crash(archive, tmp_path):
+    write_segment(str(tmp_path / 'journal'), 10)
+    journal = Journal(str(tmp_path / 'journal'))
+    recovered = journal.start()
+    journal.close()
+    assert (recovered.segments, recovered.showings, recovered.inserted, recovered.corrupt_records) == (1, 10, 10, 0)
+    assert count_showings() == 10
+    assert journal.get_segments() == []
+
+
+def test_compacts_appended_showings_on_close(archive, tmp_path):
+    journal = Journal(str(tmp_path / 'journal'))
+    journal.start()
+    for i in range(5):
+        journal.append(*make_showing(i))
+    result = journal.close()
+    assert (result.showings, result.inserted) == (5, 5)
+    assert count_showings() == 5
+
+
+def test_recompacting_a_segment_writes_nothing_new(archive, tmp_path):
+    path = write_segment(str(tmp_path / 'journal'), 4)
+    with open(path, 'rb') as f:
+        content = f.read()
+    journal = Journal(str(tmp_path / 'journal'))
+    journal.start()
+    journal.close()
+    # a crash after the commit, but before the segment was removed, leaves it to be compacted again
+    with open(path, 'wb') as f:
+        f.write(content)
+    journal = Journal(str(tmp_path / 'journal'))
+    result = journal.start()
+    journal.close()
+    assert (result.showings, result.inserted, result.replaced) == (4, 0, 4)
+    assert count_showings() == 4
+
+
+def test_torn_tail_is_skipped(archive, tmp_path):
+    path = write_segment(str(tmp_path / 'journal'), 5)
+    last = get_record_offsets(path)[-1]
+    with open(path, 'r+b') as f:
+        f.truncate(last + RECORD_HEADER.size + 3)
+    result = CompactResult()
+    rows = list(read_segment(path, result))
+    assert len(rows) == 4
+    assert result.corrupt_records == 1
+
+
+def test_torn_header_is_skipped(archive, tmp_path):
+    path = write_segment(str(tmp_path / 'journal'), 3)
+    last = get_record_offsets(path)[-1]
+    with open(path, 'r+b') as f:
+        f.truncate(last + 2)
+    result = CompactResult()
+    assert len(list(read_segment(path, result))) == 2
+    assert result.corrupt_records == 1
+
+
+def test_reading_stops_at_a_corrupt_record(archive, tmp_path):
+    path = write_segment(str(tmp_path / 'journal'), 5)
+    second = get_record_offsets(path)[1]
+    with open(path, 'r+b') as f:
+        f.seek(second + RECORD_HEADER.size + 1)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xff]))
+    result = CompactResult()
+    rows = list(read_segment(path, result))
+    # the records after a bad one can't be trusted to start where its length says, so none of them are read
+    assert [row[0] for row in rows] == [make_showing(0)[0].film.name]
+    assert result.corrupt_records == 1
+
+
+def test_a_journal_in_use_is_locked(archive, tmp_path):
+    journal = Journal(str(tmp_path / 'journal'))
+    journal.start()
+    with pytest.raises(JournalLockedException):
+        Journal(str(tmp_path / 'journal')).start()
+    journal.close()
+    other = Journal(str(tmp_path / 'journal'))
+    other.start()
+    other.close()
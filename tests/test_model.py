@@ -0,0 +1,20 @@
+from showingpreviously.model import Film, Cinema, get_cinema_unit, read_cinema_unit
+
+
+def test_equal_values_are_the_same_object():
+    assert Film('Film', '2023') is Film('Film', '2023')
+    assert Film('Film', '2023') is not Film('Film', '2024')
+
+
+def test_values_are_immutable():
+    film = Film('Film', '2023')
+    try:
+        film.name = 'Other'
+    except AttributeError:
+        return
+    raise AssertionError('a Film could be changed')
+
+
+def test_cinema_units_carry_their_cinema():
+    cinema_id, cinema, args = read_cinema_unit(get_cinema_unit('42', Cinema('Test Cinema', 'Europe/London'), '2024-01-01'))
+    assert (cinema_id, cinema, args) == ('42', Cinema('Test Cinema', 'Europe/London'), ['2024-01-01'])
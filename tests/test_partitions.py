@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+
+import showingpreviously.db as db
+import showingpreviously.partitions as partitions
+
+from conftest import count_showings
+
+
+def make_rows(count: int, start: int, chain_name: str) -> [tuple]:
+    return [(f'Film {i % 7}', '2023', chain_name, 'Test Cinema', 'UTC', f'Screen {i % 3}', start + i * 3600, '{}') for i in range(count)]
+
+
+def get_stats() -> ([tuple], [tuple]):
+    with db.read_connection() as read_conn:
+        return read_conn.execute('SELECT * FROM tableCounts ORDER BY name').fetchall(), read_conn.execute('SELECT * FROM chainStats ORDER BY chainName').fetchall()
+
+
+def test_compacting_a_month_keeps_the_stats_of_a_recount(archive, monkeypatch, tmp_path):
+    monkeypatch.setattr(partitions, 'DATA_DIR', str(tmp_path))
+    january = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+    february = int(datetime(2024, 2, 1, tzinfo=timezone.utc).timestamp())
+    db.add_showings(make_rows(300, january, 'A') + make_rows(200, january, 'B') + make_rows(400, february, 'A'))
+    assert partitions.compact_month('2024-01').showings == 500
+    assert count_showings() == 400
+    # late showings of the compacted month, some of which are already in its partition
+    db.add_showings(make_rows(50, january, 'A') + make_rows(20, january + 1, 'B'))
+    assert partitions.compact_month('2024-01').showings == 70
+    stats = get_stats()
+    db.recount_stats()
+    assert stats == get_stats()
+    assert db.db_info()[4] == 920
+
+
+def test_queries_read_compacted_months(archive, monkeypatch, tmp_path):
+    monkeypatch.setattr(partitions, 'DATA_DIR', str(tmp_path))
+    january = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+    db.add_showings(make_rows(10, january, 'A'))
+    partitions.compact_month('2024-01')
+    rows = partitions.query_showings(datetime(2024, 1, 1), datetime(2024, 1, 31), 'A')
+    assert len(rows) == 10
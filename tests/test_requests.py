@@ -0,0 +1,54 @@
+import threading
+import time
+
+from showingpreviously.requests import SingleFlight
+
+
+def test_concurrent_identical_calls_share_one_call():
+    single_flight = SingleFlight(True, 0)
+    release = threading.Event()
+    calls = []
+
+    def function():
+        calls.append(1)
+        release.wait(5)
+        return 'response'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(single_flight.do('key', function))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while single_flight.stats()['saved'] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == ['response'] * 4
+    assert single_flight.stats() == {'requests': 1, 'saved': 3}
+
+
+def test_finished_calls_are_not_kept_without_a_window():
+    single_flight = SingleFlight(True, 0)
+    assert single_flight.do('key', lambda: 'first') == 'first'
+    assert single_flight.do('key', lambda: 'second') == 'second'
+    assert single_flight.calls == {}
+
+
+def test_finished_calls_are_shared_within_the_window():
+    single_flight = SingleFlight(True, 60)
+    assert single_flight.do('key', lambda: 'first') == 'first'
+    assert single_flight.do('key', lambda: 'second') == 'first'
+
+
+def test_failures_are_not_shared_with_later_calls():
+    single_flight = SingleFlight(True, 60)
+
+    def fail():
+        raise ValueError('failed')
+
+    try:
+        single_flight.do('key', fail)
+    except ValueError:
+        pass
+    assert single_flight.do('key', lambda: 'retried') == 'retried'